@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+import aiohttp
+import requests
+from telebot.async_telebot import AsyncTeleBot
+
+from sheets import backoff_delay
+
+
+# Ответ Bot API в том виде, который разбирает apihelper (как у requests.Response)
+class TelegramResponse:
+    def __init__(self, status_code, reason, content):
+        self.status_code = status_code
+        self.reason = reason
+        self.content = content
+        self.text = content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def query_params(params):
+    # Параметры так, как их кодирует requests: None пропускается, остальное — строкой
+    return {key: str(value) for key, value in (params or {}).items() if value is not None}
+
+
+def form_data(files):
+    # Файлы для multipart; читаются в потоке обработчика, чтобы цикл не ждал диск.
+    # Имена файлов не кодируются (quote_fields=False), как у requests и AsyncTeleBot
+    form = aiohttp.FormData(quote_fields=False)
+    for key, value in files.items():
+        if isinstance(value, tuple):
+            file_name, value = value[0], value[1]
+        else:
+            name = getattr(value, 'name', None)
+            file_name = os.path.basename(name) if isinstance(name, str) else key
+        content = value.read() if hasattr(value, 'read') else value
+        form.add_field(key, content, filename=file_name)
+    return form
+
+
+# Режим BOT_RUNTIME=async: цикл asyncio в отдельном потоке. Апдейты получает AsyncTeleBot,
+# все запросы обработчиков к Bot API идут через этот цикл и общий пул соединений aiohttp,
+# а сами обработчики (с вызовами таблицы) выполняются в пуле потоков dispatcher, вне цикла
+class AsyncRuntime:
+    def __init__(self, token, connections=100, metrics=None, poll_timeout=20):
+        self.token = token
+        self.connections = connections  # Соединений с Bot API на все обработчики
+        self.metrics = metrics
+        self.poll_timeout = poll_timeout
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.loop.run_forever, name='telegram-loop', daemon=True)
+        self.thread.start()
+        self.session = self.call(self._open_session())
+        return self.thread
+
+    async def _open_session(self):
+        # Сессия создаётся в потоке цикла: aiohttp привязывает её к циклу
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.connections))
+
+    def call(self, coroutine):
+        # Выполнить корутину в цикле и дождаться результата (из любого потока, кроме потока цикла)
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def request(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        # Запрос Bot API из потока обработчика (apihelper.CUSTOM_REQUEST_SENDER через telegram_sender).
+        # Ошибки сети — исключениями requests, как в режиме threads, чтобы обработчики вели себя так же
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        client_timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        proxy = (proxies or {}).get(url.split(':', 1)[0])
+        data = form_data(files) if files else None
+        try:
+            return self.call(self._send(method, url, query_params(params), data, client_timeout, proxy))
+        except asyncio.TimeoutError as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except aiohttp.ClientError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+    async def _send(self, method, url, params, data, timeout, proxy):
+        async with self.session.request(method.upper(), url, params=params, data=data,
+                                        timeout=timeout, proxy=proxy) as response:
+            return TelegramResponse(response.status, response.reason, await response.read())
+
+    async def poll(self, submit):
+        # Long polling: каждый апдейт отдаётся submit (очередь dispatcher). Когда очередь полна,
+        # submit ждёт в отдельном потоке, а цикл тем временем отправляет ответы обработчиков
+        bot = AsyncTeleBot(self.token)
+        offset = None
+        failures = 0
+        try:
+            await bot.delete_webhook()
+            while True:
+                started = time.perf_counter()
+                error = None
+                try:
+                    updates = await bot.get_updates(offset=offset, timeout=self.poll_timeout,
+                                                    request_timeout=self.poll_timeout + 10)
+                except Exception as e:
+                    error = e
+                if self.metrics is not None:
+                    self.metrics.record_call('telegram', 'getUpdates', time.perf_counter() - started,
+                                             200 if error is None else type(error).__name__)
+                if error is not None:
+                    failures += 1
+                    delay = 1 + backoff_delay(failures, base=2.5, cap=120)
+                    print(f"Polling error: {error}, повтор через {delay:.0f} с")
+                    await asyncio.sleep(delay)
+                    continue
+                failures = 0
+                for update in updates:
+                    offset = update.update_id + 1
+                    await asyncio.to_thread(submit, update)
+        finally:
+            await bot.close_session()
+
+    def run_polling(self, submit):
+        self.call(self.poll(submit))
+
+    def stop(self):
+        if self.session is not None:
+            self.call(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
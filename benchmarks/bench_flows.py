@@ -0,0 +1,232 @@
+# Нагрузочный прогон настоящих обработчиков бота без Google и Telegram: таблица и Bot API
+# подменяются подделками из fake_services.py (с задержкой и квотой), пользователи проходят
+# сценарии поиска, добавления в заказ, изменения количества и выгрузки остатков.
+# В отчёте — пропускная способность, p50/p99 задержки и запросы к API на сценарий.
+# Запуск: python benchmarks/bench_flows.py [--users 20] [--rounds 3] [--rows 5000]
+#         [--sheets-latency 0.05] [--telegram-latency 0.02] [--quota 3000]
+#         [--record updates.jsonl] [--replay updates.jsonl] [--sync-writes] [--orders-layout flat]
+# --record сохраняет апдейты сценариев в формате Telegram (JSON-строки), --replay прогоняет
+# такой файл (или записанные апдейты настоящего бота) через очередь dispatcher; у пользователя
+# с chat_id 1000 + i есть заказ 'Заказ <chat_id>', поэтому --users при повторе — как при записи
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_services import CallLog, FakeClient, FakeSpreadsheet, FakeTelegram, Latency
+
+WORDS = ['Кабель', 'Провод', 'Розетка', 'Выключатель', 'Лампа', 'Автомат', 'Щиток', 'Клемма',
+         'Гофра', 'Коробка', 'Удлинитель', 'Патрон', 'Светильник', 'Счётчик', 'Датчик']
+FLOWS = ('search', 'add_to_order', 'edit_quantity', 'export')
+
+
+def make_warehouse(count):
+    random.seed(42)
+    rows = [['№', 'Товар', 'Количество', 'Бронь', 'Цена', 'Бронь2', 'Дилерская цена']]
+    for i in range(1, count + 1):
+        name = f"{random.choice(WORDS)} {random.choice(WORDS).lower()} {random.randint(1, 99)}x{i}"
+        price = random.randint(50, 5000)
+        rows.append([str(i), name, str(random.randint(100, 100000)), '', f'{price},00 ₽', '', f'{price * 0.8:.2f} ₽'])
+    return rows
+
+
+def make_orders(chat_ids, warehouse):
+    # У каждого пользователя свой заказ из трёх товаров
+    rows = [['📋 Название заказа', '🛒 Товар', '📦 Количество', '💰 Цена', '💵 Сумма']]
+    for chat_id in chat_ids:
+        rows.append([f'📋 Заказ {chat_id}', '', '', '', ''])
+        for row in random.sample(warehouse[1:], 3):
+            rows.append(['', f'🛒 {row[1]}', '2', row[4].replace(' ₽', ''), '0'])
+        rows.append(['', '', '', 'Итого', '0'])
+    return rows
+
+
+class UpdateFactory:
+    def __init__(self):
+        self.update_ids = count(1)
+        self.message_ids = count(1)
+
+    def user(self, chat_id):
+        return {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'}
+
+    def message(self, chat_id, text):
+        return {'update_id': next(self.update_ids), 'message': {
+            'message_id': next(self.message_ids), 'date': int(time.time()), 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'}, 'from': self.user(chat_id)}}
+
+    def callback(self, chat_id, data):
+        return {'update_id': next(self.update_ids), 'callback_query': {
+            'id': str(next(self.message_ids)), 'from': self.user(chat_id), 'chat_instance': str(chat_id), 'data': data,
+            'message': {'message_id': next(self.message_ids), 'date': int(time.time()), 'text': '',
+                        'chat': {'id': chat_id, 'type': 'private'}}}}
+
+    def flow(self, name, chat_id, warehouse):
+        # Апдейты одного сценария пользователя, в том порядке, как их присылает Telegram
+        query = random.choice(warehouse[1:])[1].split()[0].lower()
+        order = f'select_order_Заказ {chat_id}'
+        # Из результатов поиска пользователь возвращается в меню кнопкой "В меню"
+        if name == 'search':
+            return [self.callback(chat_id, 'search'), self.message(chat_id, query),
+                    self.callback(chat_id, 'next'), self.callback(chat_id, 'back_to_menu')]
+        if name == 'add_to_order':
+            return [self.callback(chat_id, 'search'), self.message(chat_id, query),
+                    self.callback(chat_id, 'add_to_order'), self.callback(chat_id, order),
+                    self.callback(chat_id, random.choice(['price_regular', 'price_dealer'])),
+                    self.message(chat_id, '1'), self.callback(chat_id, 'back_to_menu')]
+        if name == 'edit_quantity':
+            return [self.callback(chat_id, 'edit_order'), self.callback(chat_id, order),
+                    self.callback(chat_id, 'edit_item_qty'), self.callback(chat_id, 'select_item_0_edit'),
+                    self.message(chat_id, str(random.randint(1, 5)))]
+        return [self.callback(chat_id, 'export_stock')]
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))] if values else 0.0
+
+
+def setup(args):
+    # Окружение бота до импорта tgbot: без локальной копии, фоновой синхронизации и настоящих ключей
+    journal = os.path.join(tempfile.mkdtemp(), 'bench.journal')
+    os.environ.update({
+        'TOKEN': '0:bench', 'SPREADSHEET_ID': 'bench', 'GOOGLE_CREDENTIALS': '{}',
+        'MIRROR_DB': '', 'SHEET_SYNC_INTERVAL': '0', 'SESSION_STORE': 'memory', 'METRICS_TRACE': '',
+        'WRITE_JOURNAL': '' if args.sync_writes else journal,
+        'SHEETS_REQUESTS_PER_MINUTE': str(args.quota), 'ORDERS_LAYOUT': args.orders_layout,
+    })
+    import tgbot
+    from telebot import apihelper
+    from metrics import telegram_sender
+
+    log = CallLog()
+    spreadsheet = FakeSpreadsheet(log, Latency(args.sheets_latency, args.quota))
+    client = FakeClient(spreadsheet)
+    tgbot.registry.authorize = lambda: client
+    apihelper.CUSTOM_REQUEST_SENDER = telegram_sender(tgbot.metrics, FakeTelegram(log, Latency(args.telegram_latency)))
+    return tgbot, spreadsheet, log
+
+
+def run_flows(tgbot, log, factory, warehouse, chat_ids, args):
+    # Каждый пользователь в своём потоке проходит сценарии по очереди, как живой человек:
+    # следующий апдейт — после ответа на предыдущий
+    from telebot import types
+    timings = {name: [] for name in FLOWS}
+    recorded = []
+    lock = threading.Lock()
+
+    def user(chat_id):
+        for _ in range(args.rounds):
+            for name in FLOWS:
+                updates = factory.flow(name, chat_id, warehouse)
+                log.set_action(name)
+                started = time.perf_counter()
+                for update in updates:
+                    tgbot.handle_update(types.Update.de_json(update))
+                elapsed = time.perf_counter() - started
+                log.set_action(None)
+                with lock:
+                    timings[name].append(elapsed)
+                    recorded.extend(updates)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(chat_ids)) as executor:
+        list(executor.map(user, chat_ids))
+    return timings, recorded, time.perf_counter() - started
+
+
+def run_replay(tgbot, log, updates):
+    # Апдейты из файла — через dispatcher, как при polling; время каждого по действию пользователя
+    from dispatcher import update_chat_id
+    from telebot import types
+    timings = {}
+    lock = threading.Lock()
+
+    def timed(update):
+        action = tgbot.update_action(update, update_chat_id(update))
+        log.set_action(action)
+        started = time.perf_counter()
+        try:
+            tgbot.handle_update(update)
+        finally:
+            elapsed = time.perf_counter() - started
+            log.set_action(None)
+            with lock:
+                timings.setdefault(action, []).append(elapsed)
+
+    started = time.perf_counter()
+    for update in updates:
+        update = types.Update.de_json(update)
+        tgbot.dispatcher.submit(update_chat_id(update), timed, update)
+    tgbot.dispatcher.shutdown(wait=True)
+    return timings, time.perf_counter() - started
+
+
+def report(timings, log, elapsed, unit):
+    total = sum(len(values) for values in timings.values())
+    print(f"{unit.capitalize()}: {total} за {elapsed:.2f} с, {total / elapsed:.1f} в секунду")
+    print(f"{unit:<40} {'кол-во':>7} {'p50, мс':>9} {'p99, мс':>9} {'Sheets':>8} {'Telegram':>9}")
+    for name, values in sorted(timings.items()):
+        if not values:
+            continue
+        print(f"{name:<40} {len(values):>7} {percentile(values, 0.5) * 1000:>9.1f} {percentile(values, 0.99) * 1000:>9.1f}"
+              f" {log.count(name, 'sheets') / len(values):>8.2f} {log.count(name, 'telegram') / len(values):>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--sheets-latency', type=float, default=0.05)
+    parser.add_argument('--telegram-latency', type=float, default=0.02)
+    parser.add_argument('--quota', type=int, default=3000, help='запросов к Sheets в минуту')
+    parser.add_argument('--record')
+    parser.add_argument('--replay')
+    parser.add_argument('--sync-writes', action='store_true', help='писать в таблицу сразу, без журнала')
+    parser.add_argument('--orders-layout', choices=('blocks', 'flat'), default='blocks',
+                        help='хранение заказов; flat переносит заказы из блоков при первом чтении')
+    args = parser.parse_args()
+
+    tgbot, spreadsheet, log = setup(args)
+    random.seed(42)
+    warehouse = make_warehouse(args.rows)
+    chat_ids = list(range(1000, 1000 + args.users))
+    spreadsheet.add_sheet('СКЛАД', warehouse)
+    spreadsheet.add_sheet('Заказы', make_orders(chat_ids, warehouse))
+    if tgbot.write_queue is not None:
+        tgbot.write_queue.start()
+
+    print(f"Строк склада: {args.rows}, пользователей: {args.users}, задержка Sheets {args.sheets_latency * 1000:.0f} мс, "
+          f"Telegram {args.telegram_latency * 1000:.0f} мс, квота {args.quota}/мин, "
+          f"запись {'сразу' if tgbot.write_queue is None else 'через журнал'}, заказы {args.orders_layout}")
+    if args.replay:
+        with open(args.replay, encoding='utf-8') as file:
+            updates = [json.loads(line) for line in file if line.strip()]
+        timings, elapsed = run_replay(tgbot, log, updates)
+        report(timings, log, elapsed, 'апдейты')
+    else:
+        timings, recorded, elapsed = run_flows(tgbot, log, UpdateFactory(), warehouse, chat_ids, args)
+        report(timings, log, elapsed, 'сценарии')
+        if args.record:
+            with open(args.record, 'w', encoding='utf-8') as file:
+                for update in recorded:
+                    file.write(json.dumps(update, ensure_ascii=False) + '\n')
+            print(f"Апдейты записаны в {args.record}")
+
+    if tgbot.write_queue is not None:
+        started = time.perf_counter()
+        tgbot.write_queue.drain()
+        print(f"Отложенная запись: дозапись {time.perf_counter() - started:.2f} с, {tgbot.write_queue.stats()}")
+    print(f"Запросов в фоне: Sheets {log.count('background', 'sheets')}, отказов по квоте: {spreadsheet.latency.rejected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Сравнение линейного поиска по листу "СКЛАД" с индексом ItemIndex
+# Запуск: python benchmarks/bench_index.py [количество строк]
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from warehouse import ItemIndex
+
+
+def make_rows(count):
+    random.seed(42)
+    rows = [['№', 'Товар', 'Количество', 'Бронь', 'Цена', 'Бронь2', 'Дилерская цена']]
+    for i in range(count):
+        name = ''.join(random.choices(string.ascii_lowercase, k=8)) + f' {i}'
+        rows.append([str(i), name.capitalize(), str(random.randint(0, 500)), '', '150,00 ₽', '', '120,00 ₽'])
+    return rows
+
+
+def linear_find(rows, name):
+    for i, row in enumerate(rows, 1):
+        if len(row) >= 2 and row[1] == name:
+            return i
+    return None
+
+
+def measure(func, args_list):
+    started = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - started) / len(args_list)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rows = make_rows(count)
+    names = [rows[random.randint(1, count)][1] for _ in range(200)]
+
+    started = time.perf_counter()
+    index = ItemIndex(rows)
+    build_time = time.perf_counter() - started
+
+    for name in names[:20]:
+        assert index.find(name) == linear_find(rows, name)
+
+    find_linear = measure(lambda n: linear_find(rows, n), [(n,) for n in names])
+    find_index = measure(index.find, [(n,) for n in names])
+
+    started = time.perf_counter()
+    for i in range(1000):
+        row_num = random.randint(2, count)
+        index.set_name(row_num, f'Переименован {i}')
+    update_time = (time.perf_counter() - started) / 1000
+
+    print(f"Строк: {count}, построение индекса: {build_time * 1000:.1f} мс")
+    print(f"Точный поиск:   линейно {find_linear * 1e6:10.1f} мкс, индекс {find_index * 1e6:8.2f} мкс, x{find_linear / find_index:.0f}")
+    print(f"Обновление одной строки: {update_time * 1e6:.1f} мкс")
+
+
+if __name__ == "__main__":
+    main()
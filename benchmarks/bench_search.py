@@ -0,0 +1,77 @@
+# Скорость полнотекстового поиска SearchIndex на синтетическом складе
+# Запуск: python benchmarks/bench_search.py [количество строк]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import RU_TO_EN, SearchIndex, normalize
+
+WORDS = ['кабель', 'розетка', 'выключатель', 'провод', 'автомат', 'щиток', 'лампа', 'светильник',
+         'удлинитель', 'клемма', 'гофра', 'коробка', 'патрон', 'счётчик', 'датчик', 'белый', 'чёрный',
+         'медный', 'двойная', 'наружный', 'legrand', 'schneider', 'iek', 'abb', 'ekf']
+
+
+def make_names(count):
+    random.seed(7)
+    names = {}
+    for row_num in range(2, count + 2):
+        words = random.sample(WORDS, random.randint(2, 4))
+        code = f"{random.choice('ABCDEFGHKLMN')}{random.randint(100, 99999)}"
+        names[row_num] = ' '.join(words).capitalize() + f' {code}'
+    return names
+
+
+def typo(word):
+    pos = random.randrange(1, len(word) - 1)
+    return word[:pos] + word[pos + 1:]
+
+
+def linear_substring(names, query):
+    query = normalize(query)
+    return sorted(row_num for row_num, name in names.items() if query in normalize(name))
+
+
+def measure(index, queries):
+    started = time.perf_counter()
+    for query in queries:
+        index.search(query, limit=50)
+    return (time.perf_counter() - started) / len(queries)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    names = make_names(count)
+
+    started = time.perf_counter()
+    index = SearchIndex(names)
+    build_time = time.perf_counter() - started
+
+    samples = [names[random.randint(2, count + 1)] for _ in range(200)]
+    codes = [name.split()[-1] for name in samples]
+    middle = [name.split()[1] + ' ' + code for name, code in zip(samples, codes)]
+    typos = [typo(code) for code in codes]
+    layouts = [query.translate(RU_TO_EN) for query in middle]
+
+    for code in codes[:20]:
+        found = index.search(code)
+        assert set(linear_substring(names, code)) <= set(found)
+    for name, query in zip(samples[:20], typos[:20]):
+        assert index.search(query, limit=10), query
+    for name, query in zip(samples[:20], layouts[:20]):
+        assert index.search(query, limit=10), query
+
+    print(f"Строк: {count}, построение индекса: {build_time * 1000:.0f} мс")
+    print(f"Артикул целиком:   {measure(index, codes) * 1e3:.3f} мс")
+    print(f"Слово из середины: {measure(index, middle) * 1e3:.3f} мс")
+    print(f"С опечаткой:       {measure(index, typos) * 1e3:.3f} мс")
+    print(f"Не та раскладка:   {measure(index, layouts) * 1e3:.3f} мс")
+    # Широкий запрос: время растёт с числом найденных строк (их приходится ранжировать)
+    found = len(index.search('кабель'))
+    print(f"Частое слово ({found} строк): {measure(index, ['кабель']) * 1e3:.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
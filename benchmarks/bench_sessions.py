@@ -0,0 +1,54 @@
+# Память и размер сохранённой сессии поиска: копии строк против номеров строк
+# Запуск: python benchmarks/bench_sessions.py [количество строк] [количество сессий]
+import os
+import sys
+import tracemalloc
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_index import make_rows
+from sessions import dump_state, load_state
+from warehouse import ItemIndex
+
+
+def format_row(row):
+    return [x if x else '-' for x in row + ['-'] * (7 - len(row))]
+
+
+def old_session(rows, row_nums):
+    return {'state': 'searching', 'results': [(i, format_row(rows[i - 1])) for i in row_nums], 'index': 0}
+
+
+def new_session(rows, row_nums):
+    return {'state': 'searching', 'results': array('I', row_nums), 'index': 0}
+
+
+def measure(build, rows, row_nums, sessions):
+    tracemalloc.start()
+    states = [build(rows, row_nums) for _ in range(sessions)]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return states, memory / sessions
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    sessions = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rows = make_rows(count)
+    index = ItemIndex(rows)
+    row_nums = index.prefix('a')  # Широкий запрос: примерно 1/26 склада
+
+    old_states, old_memory = measure(old_session, rows, row_nums, sessions)
+    new_states, new_memory = measure(new_session, rows, row_nums, sessions)
+    old_size = len(dump_state(old_states[0]))
+    new_size = len(dump_state(new_states[0]))
+    assert load_state(dump_state(new_states[0]))['results'] == new_states[0]['results']
+
+    print(f"Строк: {count}, результатов поиска: {len(row_nums)}, сессий: {sessions}")
+    print(f"Память на сессию:  строки {old_memory / 1024:9.1f} КБ, номера строк {new_memory / 1024:7.1f} КБ, x{old_memory / new_memory:.0f}")
+    print(f"Размер в SQLite:   строки {old_size / 1024:9.1f} КБ, номера строк {new_size / 1024:7.1f} КБ, x{old_size / new_size:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+# Подделки Google Sheets и Telegram Bot API в памяти для нагрузочных прогонов бота:
+# те методы gspread и ответы Bot API, которыми пользуется бот, с задержкой и квотой
+import json
+import random
+import threading
+import time
+from collections import deque
+
+from gspread.exceptions import APIError
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.payload = payload
+        self.text = json.dumps(payload, ensure_ascii=False)
+        self.headers = {}
+
+    def json(self):
+        return self.payload
+
+
+# Учёт вызовов: сколько запросов к каждому API сделало действие, которое сейчас выполняет поток
+class CallLog:
+    def __init__(self):
+        self.counts = {}  # (действие, api) -> количество
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def set_action(self, action):
+        self.local.action = action
+
+    def record(self, api):
+        action = getattr(self.local, 'action', None) or 'background'
+        with self.lock:
+            self.counts[(action, api)] = self.counts.get((action, api), 0) + 1
+
+    def count(self, action, api):
+        with self.lock:
+            return self.counts.get((action, api), 0)
+
+
+# Задержка ответа и поминутная квота, общие для всех запросов к одному API
+class Latency:
+    def __init__(self, seconds=0.0, per_minute=None):
+        self.seconds = seconds
+        self.per_minute = per_minute
+        self.recent = deque()  # Моменты запросов за последнюю минуту
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.per_minute:
+            with self.lock:
+                now = time.monotonic()
+                while self.recent and self.recent[0] <= now - 60:
+                    self.recent.popleft()
+                if len(self.recent) >= self.per_minute:
+                    self.rejected += 1
+                    raise APIError(FakeResponse(429, {'error': {
+                        'code': 429, 'message': 'Quota exceeded (fake)', 'status': 'RESOURCE_EXHAUSTED'}}))
+                self.recent.append(now)
+        if self.seconds:
+            time.sleep(random.uniform(0.5, 1.5) * self.seconds)
+
+
+def cell_text(value):
+    # Значение ячейки так, как его вернёт get_all_values
+    for kind in ('numberValue', 'stringValue', 'boolValue'):
+        if kind in value:
+            value = value[kind]
+            break
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, sheet_id, rows=None, grid_rows=None):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.rows = [list(row) for row in rows or []]
+        # Строк в сетке листа: как у нового листа Google, под данными 1000 пустых строк
+        self.grid_rows = grid_rows or len(self.rows) + 1000
+
+    def values(self):
+        # Как в Sheets: хвостовые пустые строки не возвращаются
+        rows = self.rows
+        end = len(rows)
+        while end and not any(rows[end - 1]):
+            end -= 1
+        return [list(row) for row in rows[:end]]
+
+    def get_all_values(self, *args, **kwargs):
+        self.spreadsheet.call()
+        with self.spreadsheet.lock:
+            return self.values()
+
+    def set_values(self, row, col, values):
+        while len(self.rows) < row:
+            self.rows.append([])
+        target = self.rows[row - 1]
+        if len(target) < col - 1 + len(values):
+            target.extend([''] * (col - 1 + len(values) - len(target)))
+        target[col - 1:col - 1 + len(values)] = values
+
+    def update(self, range_name=None, values=None, **kwargs):
+        self.spreadsheet.call()
+        with self.spreadsheet.lock:
+            start = range_name.split(':')[0]
+            col = ord(start[0]) - ord('A') + 1
+            for i, row in enumerate(values):
+                self.set_values(int(start[1:]) + i, col, [str(value) for value in row])
+            self.spreadsheet.touch()
+
+    def delete_rows(self, start_index, end_index=None):
+        self.spreadsheet.call()
+        with self.spreadsheet.lock:
+            del self.rows[start_index - 1:end_index or start_index]
+            self.grid_rows -= (end_index or start_index) - start_index + 1
+            self.spreadsheet.touch()
+
+
+class FakeSpreadsheet:
+    def __init__(self, log, latency):
+        self.log = log
+        self.latency = latency
+        self.worksheets_list = []
+        self.metadata = []  # developerMetadata таблицы
+        self.modified = 0
+        self.lock = threading.RLock()
+
+    def call(self, api='sheets'):
+        self.log.record(api)
+        self.latency.wait()
+
+    def touch(self):
+        self.modified += 1
+
+    def add_sheet(self, title, rows):
+        worksheet = FakeWorksheet(self, title, len(self.worksheets_list) + 1, rows)
+        self.worksheets_list.append(worksheet)
+        return worksheet
+
+    def worksheets(self):
+        self.call()
+        return list(self.worksheets_list)
+
+    def add_worksheet(self, title, rows, cols):
+        self.call()
+        with self.lock:
+            worksheet = self.add_sheet(title, [])
+            worksheet.grid_rows = rows
+            return worksheet
+
+    def by_id(self, sheet_id):
+        return next(worksheet for worksheet in self.worksheets_list if worksheet.id == sheet_id)
+
+    def check_grid(self, requests):
+        # batchUpdate выполняется целиком или никак: запись за сеткой листа отклоняется до всех изменений
+        grid = {worksheet.id: worksheet.grid_rows for worksheet in self.worksheets_list}
+        for request in requests:
+            kind, params = next(iter(request.items()))
+            if kind == 'addSheet':
+                grid[params['properties']['sheetId']] = params['properties'].get('gridProperties', {}).get('rowCount', 1000)
+            elif kind == 'insertDimension':
+                grid[params['range']['sheetId']] += params['range']['endIndex'] - params['range']['startIndex']
+            elif kind == 'deleteDimension':
+                grid[params['range']['sheetId']] -= params['range']['endIndex'] - params['range']['startIndex']
+            elif kind == 'appendDimension':
+                grid[params['sheetId']] += params['length']
+            elif kind == 'updateCells' and params['start']['rowIndex'] + len(params['rows']) > grid[params['start']['sheetId']]:
+                raise APIError(FakeResponse(400, {'error': {
+                    'code': 400, 'message': 'Range exceeds grid limits (fake)', 'status': 'INVALID_ARGUMENT'}}))
+
+    def batch_update(self, body):
+        self.call()
+        replies = []
+        with self.lock:
+            self.check_grid(body['requests'])
+            for request in body['requests']:
+                kind, params = next(iter(request.items()))
+                reply = {}
+                if kind == 'addSheet':
+                    properties = params['properties']
+                    self.worksheets_list.append(FakeWorksheet(self, properties['title'], properties['sheetId'], grid_rows=
+                                                              properties.get('gridProperties', {}).get('rowCount', 1000)))
+                elif kind == 'insertDimension':
+                    grid = params['range']
+                    worksheet = self.by_id(grid['sheetId'])
+                    for _ in range(grid['endIndex'] - grid['startIndex']):
+                        worksheet.rows.insert(grid['startIndex'], [])
+                    worksheet.grid_rows += grid['endIndex'] - grid['startIndex']
+                elif kind == 'deleteDimension':
+                    grid = params['range']
+                    worksheet = self.by_id(grid['sheetId'])
+                    del worksheet.rows[grid['startIndex']:grid['endIndex']]
+                    worksheet.grid_rows -= grid['endIndex'] - grid['startIndex']
+                elif kind == 'appendDimension':
+                    self.by_id(params['sheetId']).grid_rows += params['length']
+                elif kind == 'updateCells':
+                    start = params['start']
+                    worksheet = self.by_id(start['sheetId'])
+                    for i, row in enumerate(params['rows']):
+                        worksheet.set_values(start['rowIndex'] + 1 + i, start['columnIndex'] + 1,
+                                             [cell_text(value['userEnteredValue']) for value in row['values']])
+                elif kind == 'createDeveloperMetadata':
+                    metadata = dict(params['developerMetadata'], metadataId=len(self.metadata) + 1)
+                    self.metadata.append(metadata)
+                    reply = {'createDeveloperMetadata': {'developerMetadata': metadata}}
+                elif kind == 'updateDeveloperMetadata':
+                    metadata_id = params['dataFilters'][0]['developerMetadataLookup']['metadataId']
+                    for metadata in self.metadata:
+                        if metadata['metadataId'] == metadata_id:
+                            metadata.update(params['developerMetadata'])
+                # repeatCell и прочее форматирование на значения не влияет
+                replies.append(reply)
+            self.touch()
+        return {'replies': replies}
+
+    def values_batch_get(self, ranges, *args, **kwargs):
+        self.call()
+        with self.lock:
+            titles = [name.strip("'") for name in ranges]
+            return {'valueRanges': [{'range': name, 'values': next(
+                worksheet for worksheet in self.worksheets_list if worksheet.title == title).values()}
+                for name, title in zip(ranges, titles)]}
+
+    def fetch_sheet_metadata(self, params=None):
+        self.call()
+        with self.lock:
+            return {'developerMetadata': [dict(metadata) for metadata in self.metadata]}
+
+
+# Клиент gspread: то, что возвращает authorize в WorksheetRegistry
+class FakeClient:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open_by_key(self, key):
+        self.spreadsheet.call()
+        return self.spreadsheet
+
+    def get_file_drive_metadata(self, key):
+        self.spreadsheet.call('drive')
+        return {'modifiedTime': str(self.spreadsheet.modified)}
+
+
+# Bot API: отвечает на запросы бота как Telegram (для apihelper.CUSTOM_REQUEST_SENDER)
+class FakeTelegram:
+    def __init__(self, log, latency):
+        self.log = log
+        self.latency = latency
+        self.message_ids = iter(range(1, 1 << 62))
+        self.lock = threading.Lock()
+
+    def request(self, method, url, params=None, files=None, **kwargs):
+        self.log.record('telegram')
+        self.latency.wait()
+        method_name = url.rsplit('/', 1)[-1]
+        params = params or {}
+        if method_name in ('sendMessage', 'sendDocument', 'editMessageText'):
+            with self.lock:
+                message_id = next(self.message_ids)
+            chat_id = int(params.get('chat_id', 0))
+            result = {'message_id': message_id, 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+        else:
+            result = True
+        return FakeResponse(200, {'ok': True, 'result': result})
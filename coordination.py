@@ -0,0 +1,165 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class LockNotOwnedError(Exception):
+    # Блокировка уже истекла и, возможно, занята другим (как redis.exceptions.LockNotOwnedError)
+    pass
+
+
+# Блокировки и счётчики версий внутри одного процесса (по умолчанию)
+class LocalLocks:
+    shared = False  # Состояние видно только этому процессу
+
+    def __init__(self):
+        self.locks = {}
+        self.versions = {}
+        self.guard = threading.Lock()
+
+    @contextmanager
+    def lock(self, name):
+        with self.guard:
+            named = self.locks.setdefault(name, threading.Lock())
+        with named:
+            yield
+
+    def extend(self, name):
+        pass  # Локальные блокировки не истекают
+
+    def get_version(self, name):
+        with self.guard:
+            return self.versions.get(name, 0)
+
+    def bump_version(self, name):
+        with self.guard:
+            self.versions[name] = self.versions.get(name, 0) + 1
+            return self.versions[name]
+
+
+# Блокировки и счётчики версий в Redis, общие для нескольких процессов бота.
+# Блокировка снимается сама через timeout секунд, если процесс упал, не отпустив её
+class RedisLocks:
+    shared = True
+
+    def __init__(self, client, timeout=60, wait=120, prefix='xyinia:'):
+        self.client = client  # redis.Redis или LocalRedis
+        self.timeout = timeout
+        self.wait = wait  # Сколько секунд ждать чужую блокировку
+        self.prefix = prefix
+        self.held = threading.local()  # Блокировки, которые держит этот поток: имя -> объект Redis
+
+    @contextmanager
+    def lock(self, name):
+        lock = self.client.lock(f'{self.prefix}lock:{name}', timeout=self.timeout, blocking_timeout=self.wait)
+        if not lock.acquire():
+            raise LockTimeout(name)
+        held = self.held.__dict__.setdefault('locks', {})
+        held[name] = lock
+        try:
+            yield
+        finally:
+            held.pop(name, None)
+            try:
+                lock.release()
+            except Exception as e:
+                # Блокировка истекла раньше, чем закончилась работа: запись уже сделана, сообщаем в лог
+                print(f"Блокировка {name} истекла до освобождения: {e}")
+
+    def extend(self, name):
+        # Снова полный срок жизни блокировки, которую держит этот поток (во время долгого ожидания)
+        lock = getattr(self.held, 'locks', {}).get(name)
+        if lock is not None:
+            lock.reacquire()
+
+    def get_version(self, name):
+        value = self.client.get(f'{self.prefix}version:{name}')
+        return int(value) if value else 0
+
+    def bump_version(self, name):
+        return int(self.client.incr(f'{self.prefix}version:{name}'))
+
+
+# Замена Redis в одном процессе для тестов (tests/test_coordination.py): те же
+# get/set/delete/incr/lock, что использует бот, со сроком жизни ключей и теми же
+# ошибками блокировки, что у redis-py
+class LocalRedis:
+    def __init__(self):
+        self.values = {}  # Ключ -> (значение, момент истечения или None)
+        self.condition = threading.Condition()
+
+    def _alive(self, key):
+        entry = self.values.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.values[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self.condition:
+            entry = self._alive(key)
+            return entry[0] if entry else None
+
+    def set(self, key, value, ex=None, nx=False):
+        with self.condition:
+            if nx and self._alive(key):
+                return None
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+            elif isinstance(value, int):
+                value = str(value).encode('utf-8')
+            self.values[key] = (value, time.monotonic() + ex if ex else None)
+            return True
+
+    def delete(self, *keys):
+        with self.condition:
+            removed = sum(1 for key in keys if self._alive(key) and self.values.pop(key))
+            self.condition.notify_all()
+            return removed
+
+    def incr(self, key):
+        with self.condition:
+            entry = self._alive(key)
+            value = int(entry[0]) + 1 if entry else 1
+            self.values[key] = (str(value).encode('utf-8'), entry[1] if entry else None)
+            return value
+
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        return LocalRedisLock(self, name, timeout, blocking_timeout)
+
+
+class LocalRedisLock:
+    def __init__(self, redis, name, timeout, blocking_timeout):
+        self.redis = redis
+        self.name = name
+        self.timeout = timeout
+        self.blocking_timeout = blocking_timeout
+        self.token = uuid.uuid4().hex.encode('utf-8')
+
+    def acquire(self):
+        deadline = None if self.blocking_timeout is None else time.monotonic() + self.blocking_timeout
+        with self.redis.condition:
+            while not self.redis.set(self.name, self.token, ex=self.timeout, nx=True):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                # Просыпаемся и при освобождении, и по истечении чужой блокировки
+                self.redis.condition.wait(min(remaining or 0.1, 0.1))
+            return True
+
+    def reacquire(self):
+        with self.redis.condition:
+            if self.redis.get(self.name) != self.token:
+                raise LockNotOwnedError(self.name)
+            self.redis.set(self.name, self.token, ex=self.timeout)
+
+    def release(self):
+        with self.redis.condition:
+            if self.redis.get(self.name) != self.token:
+                raise LockNotOwnedError(self.name)
+            self.redis.delete(self.name)
@@ -0,0 +1,88 @@
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def update_chat_id(update):
+    # Чат, к которому относится апдейт Telegram: по нему апдейты выстраиваются в очередь
+    for kind in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        message = getattr(update, kind, None)
+        if message is not None:
+            return message.chat.id
+    callback = getattr(update, 'callback_query', None)
+    if callback is not None:
+        return callback.message.chat.id if callback.message else callback.from_user.id
+    for kind in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query'):
+        query = getattr(update, kind, None)
+        if query is not None:
+            return query.from_user.id
+    return None
+
+
+# Пул обработчиков: разные чаты обрабатываются параллельно,
+# апдейты одного чата — строго по очереди
+class ChatDispatcher:
+    def __init__(self, workers=8, max_pending=1000):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chat-worker')
+        self.slots = threading.BoundedSemaphore(max_pending)  # Ограничение очереди: приём апдейтов ждёт
+        self.queues = {}  # chat_id -> очередь задач этого чата
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.pending = 0
+        self.active = 0
+        self.processed = 0
+
+    def submit(self, chat_id, func, *args):
+        self.slots.acquire()
+        with self.lock:
+            self.pending += 1
+            queue = self.queues.get(chat_id)
+            if queue is not None:
+                # Чат уже в работе: задача выполнится после предыдущих
+                queue.append((func, args))
+                return
+            self.queues[chat_id] = deque([(func, args)])
+        self.executor.submit(self._run_next, chat_id)
+
+    def _run_next(self, chat_id):
+        with self.lock:
+            func, args = self.queues[chat_id].popleft()
+            self.pending -= 1
+            self.active += 1
+        try:
+            func(*args)
+        except Exception:
+            print(f"Ошибка обработки апдейта чата {chat_id}:\n{traceback.format_exc()}")
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.processed += 1
+                has_more = bool(self.queues[chat_id])
+                if not has_more:
+                    del self.queues[chat_id]
+                if not self.pending and not self.active:
+                    self.idle.notify_all()
+            self.slots.release()
+        if has_more:
+            # Следующая задача чата встаёт в конец общей очереди, чтобы не задерживать другие чаты
+            self.executor.submit(self._run_next, chat_id)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'active': self.active,
+                'utilization': self.active / self.workers,
+                'pending': self.pending,
+                'chats_queued': len(self.queues),
+                'processed': self.processed,
+            }
+
+    def shutdown(self, wait=True):
+        if wait:
+            # Сначала дожидаемся, пока разберутся все очереди чатов
+            with self.idle:
+                self.idle.wait_for(lambda: not self.pending and not self.active)
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,217 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from gspread.http_client import HTTPClient
+
+# Границы корзин гистограмм задержки, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PREFIX = 'xyinia_'
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+# Метрики бота в памяти процесса: счётчики и гистограммы задержек с метками,
+# выдаются в текстовом формате Prometheus. Текущее действие пользователя (кнопка,
+# состояние диалога) хранится в потоке обработчика, поэтому каждый запрос к Sheets
+# и Telegram засчитывается тому действию, которое его вызвало
+class Metrics:
+    def __init__(self, trace_path=None):
+        self.counters = {}  # (имя, метки) -> значение
+        self.histograms = {}  # (имя, метки) -> Histogram
+        self.gauges = []  # (префикс, функция -> словарь чисел)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.trace = open(trace_path, 'a', encoding='utf-8') if trace_path else None
+        self.trace_lock = threading.Lock()
+
+    def inc(self, name, labels=(), value=1):
+        with self.lock:
+            key = (name, tuple(labels))
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        with self.lock:
+            key = (name, tuple(labels))
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def add_gauges(self, prefix, collect):
+        # collect() -> словарь; числовые значения выдаются как gauge prefix_ключ
+        self.gauges.append((prefix, collect))
+
+    def current_action(self):
+        # Действие пользователя в этом потоке, для фоновых потоков — имя потока
+        return getattr(self.local, 'action', None) or threading.current_thread().name
+
+    @contextmanager
+    def action(self, name, **fields):
+        # Обработка одного апдейта: время, исход и (в трассировку) все внешние вызовы по порядку
+        self.local.action = name
+        self.local.calls = []
+        started = time.perf_counter()
+        status = 'ok'
+        try:
+            yield
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.observe('handler_seconds', (('action', name),), seconds)
+            self.inc('updates_total', (('action', name), ('status', status)))
+            if self.trace is not None:
+                self.write_trace(dict(at=datetime.now().isoformat(timespec='milliseconds'), action=name,
+                                      seconds=round(seconds, 4), status=status, calls=self.local.calls, **fields))
+            self.local.action = None
+            self.local.calls = None
+
+    def record_call(self, api, method, seconds, status):
+        # Один HTTP-запрос к внешнему API: задержка по методу, количество — по методу, действию и ответу
+        labels = (('api', api), ('method', method))
+        self.observe('api_call_seconds', labels, seconds)
+        self.inc('api_calls_total', labels + (('action', self.current_action()), ('status', str(status))))
+        calls = getattr(self.local, 'calls', None)
+        if calls is not None:
+            calls.append([api, method, round(seconds, 4), status])
+
+    def report(self, name, labels=(), **details):
+        # Событие фонового потока (сбой записи, перенос листа): счётчик name_total, подробности — в трассировку
+        self.inc(f'{name}_total', labels)
+        if self.trace is not None:
+            self.write_trace(dict(at=datetime.now().isoformat(timespec='milliseconds'), event=name,
+                                  **dict(labels), **details))
+
+    def write_trace(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str)
+        with self.trace_lock:
+            self.trace.write(line + '\n')
+            self.trace.flush()
+
+    def render(self):
+        # Все метрики в текстовом формате Prometheus
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(h.counts), h.sum, h.count)) for key, h in self.histograms.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {PREFIX}{name} counter')
+            lines.append(f'{PREFIX}{name}{format_labels(labels)} {value}')
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {PREFIX}{name} histogram')
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, counts):
+                cumulative += bucket
+                lines.append(f'{PREFIX}{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{PREFIX}{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{PREFIX}{name}_sum{format_labels(labels)} {total:.6f}')
+            lines.append(f'{PREFIX}{name}_count{format_labels(labels)} {count}')
+        for prefix, collect in self.gauges:
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Ошибка сбора метрик {prefix}: {e}")
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'# TYPE {PREFIX}{prefix}_{key} gauge')
+                    lines.append(f'{PREFIX}{prefix}_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def google_method(method, url):
+    # Короткое имя запроса к Google по URL: values.get, batchUpdate, values.batchGet, drive.get...
+    path = urlsplit(url).path
+    if '/drive/' in path:
+        return f'drive.{method.lower()}'
+    parts = path.split('/v4/spreadsheets/', 1)[-1].split('/')
+    if len(parts) == 1:
+        return parts[0].split(':', 1)[1] if ':' in parts[0] else f'spreadsheets.{method.lower()}'
+    if ':' in parts[1]:
+        return parts[1].replace(':', '.')  # values:batchGet, values:batchUpdate
+    if len(parts) > 2 and ':' in parts[2]:
+        return f"values.{parts[2].rsplit(':', 1)[1]}"  # Диапазон закодирован, двоеточие — только перед :append и т. п.
+    return 'values.get' if method.upper() == 'GET' else 'values.update'
+
+
+def metered_http_client(metrics):
+    # HTTP-клиент gspread, который засчитывает каждый запрос к Google (для gspread.authorize)
+    class MeteredHTTPClient(HTTPClient):
+        def request(self, method, endpoint, *args, **kwargs):
+            started = time.perf_counter()
+            status = 'error'
+            try:
+                response = super().request(method, endpoint, *args, **kwargs)
+                status = response.status_code
+                return response
+            except Exception as e:
+                response = getattr(e, 'response', None)
+                status = response.status_code if response is not None else type(e).__name__
+                raise
+            finally:
+                api = 'drive' if '/drive/' in urlsplit(endpoint).path else 'sheets'
+                metrics.record_call(api, google_method(method, endpoint), time.perf_counter() - started, status)
+    return MeteredHTTPClient
+
+
+def telegram_sender(metrics, session):
+    # Отправка запросов Bot API через общую сессию с учётом (для apihelper.CUSTOM_REQUEST_SENDER)
+    def send(method, url, **kwargs):
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = session.request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            metrics.record_call('telegram', url.rsplit('/', 1)[-1], time.perf_counter() - started, status)
+    return send
+
+
+# Адрес /metrics для Prometheus (WSGI-приложение)
+class MetricsApp:
+    def __init__(self, metrics, path='/metrics'):
+        self.metrics = metrics
+        self.path = path
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') != self.path:
+            start_response('404 Not Found', [('Content-Type', 'text/plain; charset=utf-8')])
+            return [b'']
+        body = self.metrics.render().encode('utf-8')
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
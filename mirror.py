@@ -0,0 +1,111 @@
+import json
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheet_rows (
+    sheet TEXT NOT NULL,
+    row_num INTEGER NOT NULL,
+    cells TEXT NOT NULL,
+    PRIMARY KEY (sheet, row_num)
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+# Локальная копия листов "СКЛАД" и заказов в SQLite: строки листов как есть (ячейки JSON).
+# Бот стартует с неё без скачивания листов, а читает дальше из своих копий в памяти;
+# изменения снимков сохраняются сюда в фоне построчным диффом
+class SheetMirror:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self.saved = {}  # Лист -> последние сохранённые строки, для диффа
+        self.sources = []  # (лист, копия листа, версия при последнем сохранении)
+        self.stop_event = threading.Event()
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def load(self, sheet):
+        # Строки листа в виде get_all_values или None, если лист ещё не сохранялся
+        count = self.get_meta(f'{sheet}:rows')
+        if count is None:
+            return None
+        with self.lock:
+            stored = self.connection.execute(
+                'SELECT row_num, cells FROM sheet_rows WHERE sheet = ? ORDER BY row_num', (sheet,)).fetchall()
+        rows = [[] for _ in range(int(count))]
+        for row_num, cells in stored:
+            if row_num <= len(rows):
+                rows[row_num - 1] = json.loads(cells)
+        return rows
+
+    def save(self, sheet, rows):
+        # Записать строки листа: в SQLite уходят только строки, отличающиеся от прошлого сохранения
+        previous = self.saved.get(sheet)
+        if previous is None:
+            previous = self.load(sheet) or []
+        changed = [i for i in range(len(rows)) if i >= len(previous) or rows[i] != previous[i]]
+        upserts = [(sheet, i + 1, json.dumps(rows[i], ensure_ascii=False)) for i in changed if rows[i]]
+        deletes = [(sheet, i + 1) for i in changed if not rows[i]]
+        deletes += [(sheet, row_num) for row_num in range(len(rows) + 1, len(previous) + 1)]
+        with self.lock:
+            self.connection.execute('BEGIN')
+            try:
+                self.connection.executemany('DELETE FROM sheet_rows WHERE sheet = ? AND row_num = ?', deletes)
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO sheet_rows (sheet, row_num, cells) VALUES (?, ?, ?)', upserts)
+                self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                        (f'{sheet}:rows', str(len(rows))))
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+        self.saved[sheet] = rows
+        return len(upserts) + len(deletes)
+
+    # Фоновое сохранение снимков
+
+    def watch(self, sheet, source):
+        # source — кэш с version и snapshot() -> (версия, копия строк)
+        self.sources.append([sheet, source, None])
+
+    def flush(self, modified_time=None):
+        # Сохранить изменившиеся снимки; modified_time — время изменения таблицы, которому
+        # соответствуют снимки (берётся до снятия копий, чтобы при сомнении лист перечитался)
+        for entry in self.sources:
+            sheet, source, saved_version = entry
+            if source.version == saved_version:
+                continue
+            snapshot = source.snapshot()
+            if snapshot is None:
+                continue
+            version, rows = snapshot
+            self.save(sheet, rows)
+            entry[2] = version
+        if modified_time is not None:
+            self.set_meta('modified_time', modified_time)
+
+    def run(self, interval, modified_time=lambda: None):
+        while not self.stop_event.wait(interval):
+            try:
+                self.flush(modified_time())
+            except Exception as e:
+                print(f"Ошибка сохранения локальной копии таблицы: {e}")
+
+    def start(self, interval=2, modified_time=lambda: None):
+        thread = threading.Thread(target=self.run, args=(interval, modified_time), name='sheet-mirror', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,129 @@
+import math
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+import pandas as pd
+
+# Столбцы листа "СКЛАД" (с 0, как в строках get_all_values)
+NAME_COL = 1
+QTY_COL = 2
+PRICE_COL = 4
+DEALER_PRICE_COL = 6
+
+# Что убираем из чисел в таблице: знак рубля, пробелы (в том числе неразрывные), запятую меняем на точку
+CLEAN_TABLE = str.maketrans({'₽': None, '\xa0': None, ' ': None, ',': '.'})
+EMPTY_VALUES = ('', '-')
+
+
+def parse_number(value):
+    # Одно число из ячейки по тем же правилам, что и столбцы; ValueError, если это не число
+    if value is None:
+        return 0.0
+    cleaned = str(value).translate(CLEAN_TABLE).strip()
+    if cleaned in EMPTY_VALUES:
+        return 0.0
+    number = float(cleaned)
+    if not math.isfinite(number):
+        # float() принимает 'inf' и 'nan', но в ячейке склада это не число
+        raise ValueError(f"could not convert string to number: '{value}'")
+    return number
+
+
+def parse_money(value):
+    # Денежная сумма из ячейки как Decimal: суммы заказов считаются без накопления ошибок float
+    if value is None:
+        return Decimal(0)
+    cleaned = str(value).translate(CLEAN_TABLE).strip()
+    if cleaned in EMPTY_VALUES:
+        return Decimal(0)
+    try:
+        number = Decimal(cleaned)
+    except InvalidOperation:
+        raise ValueError(f"could not convert string to number: '{value}'")
+    if not number.is_finite():
+        raise ValueError(f"could not convert string to number: '{value}'")
+    return number
+
+
+def cell_number(value):
+    # Decimal для записи в таблицу и журнал: целое или float, остальные значения как есть
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+def parse_numbers(values):
+    # Весь столбец разом: (числа, маска ошибок); нечисловые ячейки дают 0 и True в маске.
+    # Цены и количества часто повторяются, поэтому разбираем только уникальные значения
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object).fillna(''))
+    if not len(codes):
+        return np.zeros(0), np.zeros(0, dtype=bool)
+    cleaned = pd.Series(uniques, dtype=object).astype(str).str.translate(CLEAN_TABLE).str.strip()
+    empty = cleaned.isin(EMPTY_VALUES)
+    parsed = pd.to_numeric(cleaned.mask(empty, '0'), errors='coerce')
+    numbers = parsed.fillna(0).to_numpy(dtype=float, copy=True)
+    # 'inf' и 'nan' to_numeric разбирает; это ошибки, а inf ещё и ломает приведение к int64
+    errors = parsed.isna().to_numpy() | ~np.isfinite(numbers)
+    numbers[errors] = 0
+    return numbers[codes], errors[codes]
+
+
+def parse_quantities(values):
+    # Количество — только целое; дробное считается ошибкой, как и раньше с int()
+    numbers, errors = parse_numbers(values)
+    errors = errors | (numbers != np.floor(numbers))
+    numbers[errors] = 0
+    return numbers.astype(np.int64), errors
+
+
+# Разобранные числовые столбцы снимка листа "СКЛАД"; элемент i соответствует строке i + 1
+class WarehouseColumns:
+    def __init__(self, rows):
+        frame = pd.DataFrame(rows) if rows else pd.DataFrame()
+        self.count = len(rows)
+        self.lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+        self.names = self.column(frame, NAME_COL).fillna('').astype(str).to_numpy()
+        self.quantity, qty_errors = parse_quantities(self.column(frame, QTY_COL))
+        self.price, price_errors = parse_numbers(self.column(frame, PRICE_COL))
+        self.dealer_price, dealer_errors = parse_numbers(self.column(frame, DEALER_PRICE_COL))
+        self.errors = {'количество': qty_errors, 'цена': price_errors, 'дилерская цена': dealer_errors}
+
+    def column(self, frame, col):
+        if col in frame.columns:
+            return frame[col]
+        return pd.Series([''] * self.count, dtype=object)
+
+    def complete_rows(self):
+        # Строки со всеми столбцами до дилерской цены включительно
+        return self.lengths > DEALER_PRICE_COL
+
+    def in_stock(self):
+        # Индексы строк (с 0) с остатком > 0, без заголовка
+        mask = self.complete_rows() & (self.quantity > 0)
+        mask[:1] = False
+        return np.flatnonzero(mask)
+
+    def totals(self, indexes):
+        # Общее количество, дилерская и обычная стоимость выбранных строк
+        quantity = self.quantity[indexes]
+        return (int(quantity.sum()),
+                float((quantity * self.dealer_price[indexes]).sum()),
+                float((quantity * self.price[indexes]).sum()))
+
+    def error_summary(self, mask=None):
+        # Одна строка про все ошибки разбора вместо сообщения на каждую ячейку (заголовок не считаем)
+        parts = []
+        for field, errors in self.errors.items():
+            errors = errors.copy()
+            if len(errors):
+                errors[0] = False
+            if mask is not None:
+                errors &= mask
+            row_nums = np.flatnonzero(errors) + 1
+            if len(row_nums):
+                sample = ', '.join(str(row_num) for row_num in row_nums[:10])
+                more = '…' if len(row_nums) > 10 else ''
+                parts.append(f"{field}: {len(row_nums)} (строки {sample}{more})")
+        if not parts:
+            return None
+        return "Ошибки разбора чисел на листе 'СКЛАД' — " + '; '.join(parts)
@@ -0,0 +1,182 @@
+import csv
+import io
+import os
+
+from openpyxl import load_workbook
+
+from numeric import parse_number
+
+MAX_IMPORT_LINES = 500  # Больше строк в одном файле не разбираем
+ITEM_PREFIX = '🛒 '
+
+# Заголовки столбцов файла (по началу слова, без учёта регистра)
+NAME_HEADERS = ('товар', 'наимен', 'назван')
+QTY_HEADERS = ('кол',)
+PRICE_HEADERS = ('цен', 'тип')
+
+
+class ImportFileError(Exception):
+    pass
+
+
+# Строка файла заказа: номер строки в файле, название, количество, дилерская ли цена
+class ImportLine:
+    def __init__(self, line, name, qty, dealer):
+        self.line = line
+        self.name = name
+        self.qty = qty
+        self.dealer = dealer
+
+
+def cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))  # 5.0 из Excel — это 5
+    return str(value).strip()
+
+
+def read_rows(file_name, data):
+    # Все строки файла CSV или XLSX как списки строк
+    extension = os.path.splitext(file_name or '')[1].lower()
+    if extension == '.xlsx':
+        try:
+            workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+        except Exception:
+            raise ImportFileError("файл Excel не читается")
+        try:
+            return [[cell_text(value) for value in row] for row in workbook.active.iter_rows(values_only=True)]
+        finally:
+            workbook.close()
+    if extension in ('.csv', '.txt'):
+        for encoding in ('utf-8-sig', 'cp1251'):
+            try:
+                text = data.decode(encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+        else:
+            raise ImportFileError("не удалось определить кодировку CSV")
+        try:
+            dialect = csv.Sniffer().sniff(text[:4096], delimiters=';,\t')
+        except csv.Error:
+            dialect = csv.excel  # Один столбец или нестандартный файл: разделитель — запятая
+        return [[cell.strip() for cell in row] for row in csv.reader(io.StringIO(text), dialect)]
+    raise ImportFileError("нужен файл .csv или .xlsx")
+
+
+def find_columns(rows):
+    # (номер первой строки данных, столбцы названия, количества и типа цены) — по заголовку,
+    # а без заголовка по порядку: товар, количество, тип цены
+    for start, row in enumerate(rows):
+        if any(row):
+            break
+    else:
+        return 0, 0, 1, 2
+    titles = [title.lower() for title in row]
+    columns = {}
+    for key, prefixes in (('name', NAME_HEADERS), ('qty', QTY_HEADERS), ('price', PRICE_HEADERS)):
+        # Префиксы по приоритету: в выгрузке заказа есть и "Название заказа", и "Товар"
+        for prefix in prefixes:
+            col = next((col for col, title in enumerate(titles) if title.startswith(prefix)), None)
+            if col is not None:
+                columns[key] = col
+                break
+    if 'name' in columns and 'qty' in columns:
+        return start + 1, columns['name'], columns['qty'], columns.get('price')
+    return start, 0, 1, 2
+
+
+def parse_price_type(text):
+    # True — дилерская цена, False — обычная, None — непонятно. Число в столбце цены
+    # (например, в выгрузке завершённого заказа) означает обычную цену
+    text = text.lower()
+    if not text or text.startswith('о'):
+        return False
+    if text.startswith('д'):
+        return True
+    try:
+        parse_number(text)
+        return False
+    except ValueError:
+        return None
+
+
+def parse_order_file(file_name, data):
+    # Строки заказа из файла: (список ImportLine, ошибки [(номер строки, текст)]).
+    # Пустые строки и строки без названия (например, заголовок и "Итого" выгрузки) пропускаются
+    rows = read_rows(file_name, data)
+    start, name_col, qty_col, price_col = find_columns(rows)
+    lines = []
+    errors = []
+    for line, row in enumerate(rows[start:], start + 1):
+        name = row[name_col] if name_col < len(row) else ''
+        if name.startswith(ITEM_PREFIX):
+            name = name[len(ITEM_PREFIX):]
+        name = name.strip()
+        if not name:
+            continue
+        if len(lines) + len(errors) >= MAX_IMPORT_LINES:
+            raise ImportFileError(f"в файле больше {MAX_IMPORT_LINES} строк, раздели заказ на части")
+        qty_text = row[qty_col] if qty_col < len(row) else ''
+        try:
+            qty = parse_number(qty_text)
+        except ValueError:
+            qty = None
+        if qty is None or not qty.is_integer() or qty <= 0:
+            errors.append((line, f"'{name}': количество должно быть целым числом больше 0, а не '{qty_text}'"))
+            continue
+        dealer = parse_price_type(row[price_col]) if price_col is not None and price_col < len(row) else False
+        if dealer is None:
+            errors.append((line, f"'{name}': тип цены '{row[price_col]}' — нужно 'обычная' или 'дилерская'"))
+            continue
+        lines.append(ImportLine(line, name, int(qty), dealer))
+    return lines, errors
+
+
+def resolve_lines(lines, find, search, names):
+    # Строки склада для строк файла: точное название, затем то же без учёта регистра
+    # или единственный результат поиска. Возвращает ([(строка файла, номер строки склада)], ошибки,
+    # замены) — замены (товар найден поиском под другим названием) показываются в отчёте
+    resolved = []
+    errors = []
+    substitutions = []
+    for item in lines:
+        row_num = find(item.name)
+        if row_num is None:
+            found = search(item.name) or []
+            same = [row for row in found if names(row).lower() == item.name.lower()]
+            if same:
+                row_num = same[0]
+            elif len(found) == 1:
+                row_num = found[0]
+                substitutions.append((item.line, f"'{item.name}' → '{names(row_num)}'"))
+            elif found:
+                options = ', '.join(f"'{names(row)}'" for row in found[:3])
+                errors.append((item.line, f"'{item.name}': несколько похожих товаров — {options}"))
+                continue
+            else:
+                errors.append((item.line, f"'{item.name}': товар не найден на складе"))
+                continue
+        resolved.append((item, row_num))
+    return resolved, errors, substitutions
+
+
+def check_stock(resolved, stock):
+    # Остатки для всех строк разом: повторы одного товара в файле складываются
+    wanted = {}
+    for item, row_num in resolved:
+        wanted[row_num] = wanted.get(row_num, 0) + item.qty
+    errors = []
+    for item, row_num in resolved:
+        if wanted[row_num] > stock(row_num):
+            errors.append((item.line, f"'{item.name}': нужно {wanted[row_num]} шт., на складе {stock(row_num)} шт."))
+    return errors
+
+
+def format_errors(errors, limit=30):
+    # Отчёт по строкам файла для сообщения в чат (сообщение Telegram не длиннее 4096 символов)
+    lines = [f"Строка {line}: {text}" for line, text in sorted(errors)[:limit]]
+    if len(errors) > limit:
+        lines.append(f"…и ещё {len(errors) - limit}")
+    return "\n".join(lines)
@@ -0,0 +1,193 @@
+from orders import DELETED_MARK, ITEM_PREFIX, ORDER_PREFIX, TOTAL_LABEL, row_total, sheet_number
+from sheets import SheetBatch
+
+# Хранилища заказов с общим набором операций для обработчиков бота. Вызываются под
+# блокировкой записи заказов; каждое изменение уходит в таблицу одним пакетом SheetBatch
+# (через submit — сразу или в очередь отложенной записи) и повторяется в индексе.
+# position — номер строки товара в order_rows(): 0 — заголовок, дальше товары по порядку
+
+
+# Заказы блоками на листе "Заказы": заголовок, строки товаров и "Итого" подряд.
+# Новый товар вставляется внутрь листа, и все заказы ниже сдвигаются
+class BlockOrderStore:
+    def __init__(self, index, sheet, submit, total_format):
+        self.index = index  # OrderIndex
+        self.sheet = sheet  # Функция, которая возвращает лист "Заказы"
+        self.submit = submit
+        self.total_format = total_format  # CellFormat строки "Итого"
+
+    def order_names(self):
+        return self.index.order_names()
+
+    def find(self, name):
+        return self.index.find(name)
+
+    def order_rows(self, block):
+        return self.index.block_rows(block)
+
+    def create(self, name, items=(), total=0):
+        # Новый заказ в конце листа; items — строки товаров в формате листа
+        row_count = self.index.row_count()
+        start_row = 2 if row_count <= 1 else row_count + 1
+        total_row = start_row + 1 + len(items)
+        # Заголовок, все товары, итог и его формат — одним запросом
+        batch = SheetBatch(self.sheet())
+        batch.append_rows(start_row, [[f'{ORDER_PREFIX}{name}', '', '', '', ''], *items, ['', '', '', TOTAL_LABEL, total]])
+        batch.format(f'D{total_row}:E{total_row}', self.total_format)
+        self.submit(batch)
+        self.index.add_order(name, start_row, items, total)
+        return self.index.find(name)
+
+    def add_item(self, block, values):
+        end_row = block.end_row
+        total = self.index.total(block) + values[4]
+        # Вставка товара, новая сумма и формат итога — одним запросом
+        batch = SheetBatch(self.sheet())
+        if block.total_row:
+            batch.insert_row(values, end_row)
+            total_row = end_row + 1
+            batch.update_cell(total_row, 5, total)
+        else:
+            batch.insert_row(values, end_row + 1)
+            total_row = end_row + 2
+            batch.insert_row(['', '', '', TOTAL_LABEL, total], total_row)
+        batch.format(f'D{total_row}:E{total_row}', self.total_format)
+        self.submit(batch)
+        if block.total_row:
+            self.index.insert_row(end_row, values)
+            self.index.set_cell(total_row, 5, total)
+        else:
+            self.index.insert_row(end_row + 1, values, block.name)
+            self.index.insert_row(total_row, ['', '', '', TOTAL_LABEL, total], block.name)
+
+    def delete_item(self, block, position):
+        row_num = block.start_row + position
+        # Итог пишется только в строку "Итого" (после удаления она на строку выше); без неё
+        # итог считается по строкам, и писать его некуда
+        total_row = block.total_row - 1 if block.total_row else None
+        total = self.index.total(block) - row_total(self.index.rows[row_num - 1])
+        # Удаление, новая сумма и формат итога — одним запросом
+        batch = SheetBatch(self.sheet())
+        batch.delete_rows(row_num, row_num)
+        if total_row:
+            batch.update_cell(total_row, 5, total)
+            batch.format(f'D{total_row}:E{total_row}', self.total_format)
+        self.submit(batch)
+        self.index.delete_rows(row_num, row_num)
+        if total_row:
+            self.index.set_cell(total_row, 5, total)
+
+    def set_quantity(self, block, position, qty, line_total):
+        row_num = block.start_row + position
+        total_row = block.total_row
+        total = self.index.total(block) - row_total(self.index.rows[row_num - 1]) + line_total
+        # Количество, сумма строки, итог и его формат — одним запросом
+        batch = SheetBatch(self.sheet())
+        batch.update_cell(row_num, 3, qty)
+        batch.update_cell(row_num, 5, line_total)
+        if total_row:
+            batch.update_cell(total_row, 5, total)
+            batch.format(f'D{total_row}:E{total_row}', self.total_format)
+        self.submit(batch)
+        self.index.set_cell(row_num, 3, qty)
+        self.index.set_cell(row_num, 5, line_total)
+        if total_row:
+            self.index.set_cell(total_row, 5, total)
+
+    def delete(self, block):
+        start_row, end_row = block.start_row, block.end_row
+        # Через очередь, как и остальные изменения: пакеты в журнале посчитаны до удаления
+        batch = SheetBatch(self.sheet())
+        batch.delete_rows(start_row, end_row)
+        self.submit(batch)
+        self.index.delete_rows(start_row, end_row)
+
+    def check_total(self, block):
+        # (итог в ячейке, итог по строкам); расхождение исправляется. Лист перечитывается: итог или строки
+        # могли исправить в таблице вручную. None, если строки "Итого" или самого заказа уже нет
+        self.index.invalidate()
+        block = self.index.find(block.name)
+        if block is None or not block.total_row:
+            return None
+        stored, computed = self.index.total(block), self.index.compute_total(block)
+        if stored != computed:
+            batch = SheetBatch(self.sheet())
+            batch.update_cell(block.total_row, 5, computed)
+            batch.format(f'D{block.total_row}:E{block.total_row}', self.total_format)
+            self.submit(batch)
+            self.index.set_cell(block.total_row, 5, computed)
+        return stored, computed
+
+
+def flat_line(order_id, name, values):
+    # Строка товара в формате листа "Заказы" -> строка плоского листа (номер заказа — числом)
+    return [sheet_number(order_id), name, values[1].replace(ITEM_PREFIX, '', 1)] + list(values[2:5]) + ['']
+
+
+# Заказы на плоском листе: строка на товар с номером заказа (см. FlatOrderIndex).
+# Новые строки только дописываются в конец, изменения и удаления — по постоянному
+# номеру строки, поэтому запись не сдвигает чужие заказы. Итоги считает формула листа сумм
+class FlatOrderStore:
+    def __init__(self, index, sheet, submit):
+        self.index = index  # FlatOrderIndex
+        self.sheet = sheet  # Функция, которая возвращает плоский лист заказов
+        self.submit = submit
+
+    def order_names(self):
+        return self.index.order_names()
+
+    def find(self, name):
+        return self.index.find(name)
+
+    def order_rows(self, order):
+        return self.index.order_rows(order)
+
+    def create(self, name, items=(), total=0):
+        order_id = str(self.index.new_id())
+        rows = [[sheet_number(order_id), name, '', '', '', '', '']]
+        rows += [flat_line(order_id, name, values) for values in items]
+        batch = SheetBatch(self.sheet())
+        batch.append_rows(self.index.row_count() + 1, rows)
+        self.submit(batch)
+        self.index.append_rows(rows)
+        return self.index.by_id[order_id]
+
+    def add_item(self, order, values):
+        rows = [flat_line(order.order_id, order.name, values)]
+        batch = SheetBatch(self.sheet())
+        batch.append_rows(self.index.row_count() + 1, rows)
+        self.submit(batch)
+        self.index.append_rows(rows)
+
+    def delete_item(self, order, position):
+        row_num = order.lines[position - 1]
+        batch = SheetBatch(self.sheet())
+        batch.update_cell(row_num, 7, DELETED_MARK)
+        self.submit(batch)
+        self.index.mark_deleted([row_num])
+
+    def set_quantity(self, order, position, qty, line_total):
+        row_num = order.lines[position - 1]
+        batch = SheetBatch(self.sheet())
+        batch.update_cell(row_num, 4, qty)
+        batch.update_cell(row_num, 6, line_total)
+        self.submit(batch)
+        self.index.set_line(row_num, qty, line_total)
+
+    def delete(self, order):
+        row_nums = list(order.rows)
+        batch = SheetBatch(self.sheet())
+        for row_num in row_nums:
+            batch.update_cell(row_num, 7, DELETED_MARK)
+        self.submit(batch)
+        self.index.mark_deleted(row_nums)
+
+    def check_total(self, order):
+        # (итог индекса, итог по строкам листа). Лист перечитывается, и индекс получает итог по его
+        # строкам (в таблице итог — формула, её исправлять не нужно). None, если заказа на листе уже нет
+        stored = order.total
+        self.index.invalidate()
+        order = self.index.find_id(order.order_id)
+        if order is None:
+            return None
+        return stored, order.total
@@ -0,0 +1,414 @@
+import threading
+import time
+from decimal import Decimal
+
+from numeric import cell_number, parse_money
+
+ORDER_PREFIX = '📋 '
+ITEM_PREFIX = '🛒 '
+TOTAL_LABEL = 'Итого'
+
+# Плоский лист заказов: строка на каждый товар с номером заказа. Первая строка заказа —
+# без товара (заказ виден и пустым). Строки не вставляются и не удаляются, а помечаются
+# в столбце "Удалено", поэтому номер строки товара не меняется
+FLAT_HEADER = ['ID заказа', 'Заказ', 'Товар', 'Количество', 'Цена', 'Сумма', 'Удалено']
+DELETED_MARK = 'да'
+
+
+def is_total_row(row):
+    return len(row) > 3 and row[3] == TOTAL_LABEL
+
+
+def row_total(row):
+    # Сумма строки товара (столбец E) как Decimal; пустая или нечисловая считается нулём
+    if len(row) > 4 and row[1] and row[4]:
+        try:
+            return parse_money(row[4])
+        except ValueError:
+            pass
+    return Decimal(0)
+
+
+# Блок заказа на листе "Заказы": заголовок, строки товаров и (обычно) строка "Итого"
+class OrderBlock:
+    def __init__(self, name, start_row, end_row, total_row=None):
+        self.name = name
+        self.start_row = start_row
+        self.end_row = end_row
+        self.total_row = total_row  # None, если у блока нет строки "Итого"
+
+    def item_rows(self):
+        # Номера строк товаров (между заголовком и итогом)
+        last = self.total_row - 1 if self.total_row else self.end_row
+        return range(self.start_row + 1, last + 1)
+
+
+def parse_order_blocks(rows):
+    # Все блоки заказов за один проход (первая строка листа — заголовок таблицы).
+    # Блок заканчивается перед следующим заголовком или пустой строкой, либо на строке "Итого"
+    blocks = {}
+    current = None
+    for i, row in enumerate(rows[1:], 2):
+        if current is not None:
+            if is_total_row(row):
+                current.end_row = current.total_row = i
+                current = None
+                continue
+            if row and row[0]:
+                current.end_row = i - 1
+                current = None
+            elif not row:
+                current.end_row = i - 1
+                current = None
+                continue
+            else:
+                continue
+        if row and row[0] and not is_total_row(row):
+            current = OrderBlock(row[0].replace(ORDER_PREFIX, ''), i, i)
+            blocks.setdefault(current.name, current)  # При повторе названия берём первый заказ
+    if current is not None:
+        current.end_row = len(rows)
+    return blocks
+
+
+# Локальная копия листа заказов: строки из таблицы с повторным чтением по TTL
+# и сверкой с фоновой синхронизацией. Разбор строк — в parse() наследников
+class SheetRows:
+    def __init__(self, loader, ttl=60):
+        self.loader = loader  # Функция, которая скачивает все значения листа
+        self.ttl = ttl
+        self.rows = None
+        self.loaded_at = 0
+        self.version = 0
+        self.lock = threading.RLock()
+
+    def parse(self):
+        pass
+
+    def ensure(self):
+        with self.lock:
+            if self.rows is None or time.monotonic() - self.loaded_at >= self.ttl:
+                self.rebuild(self.loader())
+                self.loaded_at = time.monotonic()
+
+    def rebuild(self, rows):
+        with self.lock:
+            self.rows = [list(row) for row in rows]
+            self.parse()
+            self.version += 1
+
+    def invalidate(self):
+        with self.lock:
+            self.rows = None
+
+    def expire(self):
+        # Перечитать лист при следующем обращении; без блокировки, как WarehouseCache.expire
+        self.loaded_at = 0
+
+    def preload(self, rows):
+        # Строки из локальной копии (при старте)
+        with self.lock:
+            self.rebuild(rows)
+            self.loaded_at = time.monotonic()
+
+    def snapshot(self):
+        with self.lock:
+            if self.rows is None:
+                return None
+            return self.version, [list(row) for row in self.rows]
+
+    def touch(self):
+        # Синхронизация убедилась, что лист не менялся
+        with self.lock:
+            if self.rows is not None:
+                self.loaded_at = time.monotonic()
+
+    def apply_rows(self, rows, version):
+        # Свежие значения листа из фоновой синхронизации; заказы пересчитываются, только если
+        # строки отличаются. False, если индекс изменился после чтения version
+        with self.lock:
+            if self.version != version:
+                return False
+            rows = [list(row) for row in rows]
+            if rows != self.rows:
+                self.rebuild(rows)
+            self.loaded_at = time.monotonic()
+            return True
+
+    def row_count(self):
+        with self.lock:
+            self.ensure()
+            return len(self.rows)
+
+
+# Индекс заказов: локальная копия листа "Заказы" и позиции блоков.
+# Изменения, отправленные в таблицу, повторяются здесь со сдвигом номеров строк,
+# поэтому выбор заказа и листание списка не требуют запросов к API
+class OrderIndex(SheetRows):
+    def __init__(self, loader, ttl=60):
+        super().__init__(loader, ttl)
+        self.blocks = {}
+
+    def parse(self):
+        self.blocks = parse_order_blocks(self.rows)
+
+    def order_names(self):
+        # Названия заказов в порядке листа
+        with self.lock:
+            self.ensure()
+            return [block.name for block in sorted(self.blocks.values(), key=lambda block: block.start_row)]
+
+    def find(self, name):
+        with self.lock:
+            self.ensure()
+            return self.blocks.get(name)
+
+    def block_rows(self, block):
+        # Копия строк блока от заголовка до итога включительно
+        with self.lock:
+            return [list(row) for row in self.rows[block.start_row - 1:block.end_row]]
+
+    def compute_total(self, block):
+        # Сумма заказа заново по всем строкам товаров — для проверки итога
+        with self.lock:
+            return sum((row_total(self.rows[row_num - 1]) for row_num in block.item_rows()), Decimal(0))
+
+    def total(self, block):
+        # Текущий итог заказа из ячейки "Итого" — от него считаются изменения по одной строке.
+        # Если строки "Итого" нет или в ячейке не число, итог пересчитывается по строкам
+        with self.lock:
+            row = self.rows[block.total_row - 1] if block.total_row else []
+            if len(row) > 4 and row[4]:
+                try:
+                    return parse_money(row[4])
+                except ValueError:
+                    pass
+            return self.compute_total(block)
+
+    def set_row(self, row_num, col, values):
+        # Значения подряд в строке row_num, начиная со столбца col (оба с 1)
+        with self.lock:
+            while len(self.rows) < row_num:
+                self.rows.append([])
+            row = self.rows[row_num - 1]
+            if len(row) < col - 1 + len(values):
+                row.extend([''] * (col - 1 + len(values) - len(row)))
+            row[col - 1:col - 1 + len(values)] = ['' if value is None else str(cell_number(value)) for value in values]
+            self.version += 1
+
+    def set_cell(self, row_num, col, value):
+        self.set_row(row_num, col, [value])
+
+    def add_order(self, name, start_row, items=(), total=0):
+        # Новый заказ в конце листа: заголовок, строки товаров (если есть) и строка "Итого"
+        with self.lock:
+            self.set_row(start_row, 1, [f'{ORDER_PREFIX}{name}', '', '', '', ''])
+            for i, values in enumerate(items, start_row + 1):
+                self.set_row(i, 1, values)
+            total_row = start_row + 1 + len(items)
+            self.set_row(total_row, 1, ['', '', '', TOTAL_LABEL, total])
+            self.blocks.setdefault(name, OrderBlock(name, start_row, total_row, total_row))
+
+    def insert_row(self, index, values, order_name=None):
+        # Строка вставлена на место index: всё ниже сдвигается на одну строку.
+        # order_name — заказ, к концу которого дописывается строка
+        with self.lock:
+            self.rows.insert(index - 1, ['' if value is None else str(cell_number(value)) for value in values])
+            for block in self.blocks.values():
+                if block.start_row >= index:
+                    block.start_row += 1
+                    block.end_row += 1
+                    if block.total_row:
+                        block.total_row += 1
+                elif block.end_row >= index or (block.name == order_name and block.end_row == index - 1):
+                    block.end_row += 1
+                    if block.total_row and block.total_row >= index:
+                        block.total_row += 1
+                    elif is_total_row(values) and block.total_row is None:
+                        block.total_row = index
+            self.version += 1
+
+    def delete_rows(self, start_index, end_index):
+        # Удалены строки start_index..end_index включительно: всё ниже сдвигается вверх
+        with self.lock:
+            count = end_index - start_index + 1
+            del self.rows[start_index - 1:end_index]
+            for name, block in list(self.blocks.items()):
+                if block.start_row > end_index:
+                    block.start_row -= count
+                    block.end_row -= count
+                    if block.total_row:
+                        block.total_row -= count
+                elif block.start_row >= start_index and block.end_row <= end_index:
+                    del self.blocks[name]
+                elif block.start_row >= start_index:
+                    # Удалён заголовок: положение остатка блока неоднозначно, перечитываем
+                    self.blocks = parse_order_blocks(self.rows)
+                    break
+                elif block.end_row >= start_index:
+                    block.end_row -= min(block.end_row, end_index) - start_index + 1
+                    if block.total_row and start_index <= block.total_row <= end_index:
+                        block.total_row = None
+                    elif block.total_row and block.total_row > end_index:
+                        block.total_row -= count
+            self.version += 1
+
+
+def flat_line_total(row):
+    # Сумма строки плоского листа (столбец F) как Decimal; нечисловая считается нулём
+    try:
+        return parse_money(row[5])
+    except ValueError:
+        return Decimal(0)
+
+
+def sheet_number(value):
+    # Число из текста ячейки для записи в таблицу числом (иначе формулы листа сумм его не сложат)
+    try:
+        return cell_number(parse_money(value)) if value else value
+    except ValueError:
+        return value
+
+
+def flat_rows_from_blocks(rows):
+    # Строки плоского листа из листа блоков (перенос заказов): заказы нумеруются по порядку,
+    # строки без названия товара и "Итого" не переносятся — итоги считает лист сумм
+    flat = [list(FLAT_HEADER)]
+    blocks = sorted(parse_order_blocks(rows).values(), key=lambda block: block.start_row)
+    for order_id, block in enumerate(blocks, 1):
+        flat.append([order_id, block.name, '', '', '', '', ''])
+        for row_num in block.item_rows():
+            row = rows[row_num - 1] + [''] * 5
+            if row[1]:
+                flat.append([order_id, block.name, row[1].replace(ITEM_PREFIX, '', 1)]
+                            + [sheet_number(value) for value in row[2:5]] + [''])
+    return flat
+
+
+# Заказ на плоском листе: номер, первая строка и живые (не удалённые) строки
+class FlatOrder:
+    def __init__(self, order_id, name, start_row):
+        self.order_id = order_id
+        self.name = name
+        self.start_row = start_row
+        self.rows = []  # Все живые строки заказа, вместе с первой
+        self.lines = []  # Строки товаров по порядку
+        self.total = Decimal(0)
+
+
+# Индекс плоского листа заказов. Номер строки товара постоянный, поэтому изменения
+# применяются по адресу без сдвигов, новые строки дописываются в конец, а итог заказа
+# ведётся здесь по строкам (в таблице его считает формула листа сумм)
+class FlatOrderIndex(SheetRows):
+    def __init__(self, loader, ttl=60):
+        super().__init__(loader, ttl)
+        self.orders = {}  # Название -> FlatOrder
+        self.by_id = {}
+        self.next_id = 1
+
+    def parse(self):
+        self.orders = {}
+        self.by_id = {}
+        self.next_id = 1
+        for row_num in range(2, len(self.rows) + 1):
+            self.index_row(row_num)
+
+    def index_row(self, row_num):
+        row = self.rows[row_num - 1]
+        row.extend([''] * (len(FLAT_HEADER) - len(row)))
+        order_id = row[0].strip()
+        if not order_id:
+            return
+        if order_id.isdigit():
+            # Номера удалённых заказов тоже заняты, иначе старые строки попадут в новый заказ
+            self.next_id = max(self.next_id, int(order_id) + 1)
+        if row[6]:
+            return
+        order = self.by_id.get(order_id)
+        if order is None:
+            order = self.by_id[order_id] = FlatOrder(order_id, row[1], row_num)
+            self.orders.setdefault(order.name, order)  # При повторе названия берём первый заказ
+        order.rows.append(row_num)
+        if row[2]:
+            order.lines.append(row_num)
+            order.total += flat_line_total(row)
+
+    def order_names(self):
+        with self.lock:
+            self.ensure()
+            return [order.name for order in sorted(self.orders.values(), key=lambda order: order.start_row)]
+
+    def find(self, name):
+        with self.lock:
+            self.ensure()
+            return self.orders.get(name)
+
+    def find_id(self, order_id):
+        with self.lock:
+            self.ensure()
+            return self.by_id.get(order_id)
+
+    def new_id(self):
+        with self.lock:
+            self.ensure()
+            return self.next_id
+
+    def order_rows(self, order):
+        # Строки заказа в виде блока листа "Заказы" (заголовок, товары, "Итого") — для показа и выгрузки
+        with self.lock:
+            rows = [[f'{ORDER_PREFIX}{order.name}', '', '', '', '']]
+            for row_num in order.lines:
+                row = self.rows[row_num - 1]
+                rows.append(['', f'{ITEM_PREFIX}{row[2]}', row[3], row[4], row[5]])
+            rows.append(['', '', '', TOTAL_LABEL, str(cell_number(order.total))])
+            return rows
+
+    def compute_total(self, order):
+        with self.lock:
+            return sum((flat_line_total(self.rows[row_num - 1]) for row_num in order.lines), Decimal(0))
+
+    def set_total(self, order, total):
+        with self.lock:
+            order.total = total
+            self.version += 1
+
+    def append_rows(self, rows):
+        # Строки записаны сразу после последней строки листа (SheetBatch.append_rows)
+        with self.lock:
+            for values in rows:
+                self.rows.append(['' if value is None else str(cell_number(value)) for value in values])
+                self.index_row(len(self.rows))
+            self.version += 1
+
+    def set_line(self, row_num, qty, line_total):
+        # Новые количество и сумма строки товара; итог заказа меняется на разницу
+        with self.lock:
+            row = self.rows[row_num - 1]
+            order = self.by_id[row[0].strip()]
+            order.total -= flat_line_total(row)
+            row[3], row[5] = str(cell_number(qty)), str(cell_number(line_total))
+            order.total += flat_line_total(row)
+            self.version += 1
+
+    def mark_deleted(self, row_nums):
+        # Строки помечены удалёнными; заказ без живых строк пропадает из списка
+        with self.lock:
+            for row_num in row_nums:
+                row = self.rows[row_num - 1]
+                row[6] = DELETED_MARK
+                order = self.by_id.get(row[0].strip())
+                if order is None or row_num not in order.rows:
+                    continue
+                order.rows.remove(row_num)
+                if row_num in order.lines:
+                    order.lines.remove(row_num)
+                    order.total -= flat_line_total(row)
+                if not order.rows:
+                    del self.by_id[order.order_id]
+                    if self.orders.get(order.name) is order:
+                        # Название переходит к следующему живому заказу с ним, как при разборе листа
+                        del self.orders[order.name]
+                        same = [other for other in self.by_id.values() if other.name == order.name]
+                        if same:
+                            self.orders[order.name] = min(same, key=lambda other: other.start_row)
+            self.version += 1
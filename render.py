@@ -0,0 +1,44 @@
+import threading
+from collections import OrderedDict
+
+from telebot import types
+
+
+# Клавиатура, которая после построения не меняется: JSON для Bot API собирается
+# при первой отправке, дальше отдаётся готовая строка
+class FrozenKeyboard(types.InlineKeyboardMarkup):
+    def to_json(self):
+        cached = self.__dict__.get('_json')
+        if cached is None:
+            cached = self._json = super().to_json()
+        return cached
+
+
+# Готовые клавиатуры и тексты сообщений (LRU). Ключ составляется из всего, от чего
+# зависит результат, поэтому устаревших записей не бывает — лишние просто вытесняются
+class RenderCache:
+    def __init__(self, max_size=2000):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, render):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = render()
+        with self.lock:
+            self.items[key] = value
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+        return value
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.items), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,257 @@
+import bisect
+import math
+import re
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict
+
+# Запрос, набранный не в той раскладке: "rf,tkm" -> "кабель" и обратно
+EN_KEYS = "qwertyuiop[]asdfghjkl;'zxcvbnm,.`"
+RU_KEYS = 'йцукенгшщзхъфывапролджэячсмитьбюё'
+EN_TO_RU = str.maketrans(EN_KEYS, RU_KEYS)
+RU_TO_EN = str.maketrans(RU_KEYS, EN_KEYS)
+
+WORD_RE = re.compile(r'\w+')
+
+# Уровни совпадения: чем больше, тем выше в выдаче
+EXACT, PREFIX, WORD_START, SUBSTRING, ALL_WORDS, FUZZY = 5, 4, 3, 2, 1, 0
+MIN_SIMILARITY = 0.5  # Похожесть слов по триграммам (коэффициент Дайса), ниже — не опечатка
+FUZZY_WORDS = 5  # Сколько самых похожих слов словаря берём на каждое слово запроса
+FUZZY_CANDIDATES = 20  # Сколько слов-кандидатов (с наибольшим числом общих триграмм) проверяем точно
+
+
+def normalize(text):
+    # Нижний регистр, ё -> е, только буквы и цифры через один пробел
+    return ' '.join(WORD_RE.findall(str(text).lower().replace('ё', 'е')))
+
+
+def word_trigrams(word):
+    # Триграммы слова с краями, как в pg_trgm: "  к", " ка", "каб", ..., "ль "
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def inner_trigrams(word):
+    # Триграммы, которые есть в любом слове, содержащем word
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def switch_layout(query):
+    # Запрос в другой раскладке или None, если переключать нечего
+    query = query.lower()
+    for table in (EN_TO_RU, RU_TO_EN):
+        switched = query.translate(table)
+        if switched != query:
+            return switched
+    return None
+
+
+def match_level(name, query, words):
+    # Уровень совпадения нормализованного названия с нормализованным запросом или None
+    if name == query:
+        return EXACT
+    if name.startswith(query):
+        return PREFIX
+    pos = name.find(query)
+    if pos > 0:
+        return WORD_START if name[pos - 1] == ' ' else SUBSTRING
+    if len(words) > 1 and all(word in name for word in words):
+        return ALL_WORDS
+    return None
+
+
+# Поисковый индекс по названиям товаров: слова, подстроки, опечатки, другая раскладка.
+# Подстроки ищутся по триграммам названий (кандидаты из самого редкого списка
+# проверяются по названию), опечатки — по триграммам словаря слов
+class SearchIndex:
+    def __init__(self, names=None):
+        self.names = {}  # Номер строки -> нормализованное название
+        self.postings = {}  # Триграмма -> номера строк по возрастанию
+        self.word_rows = {}  # Слово -> номера строк, где оно есть
+        self.vocabulary = []  # Отсортированные слова, для запросов короче трёх букв
+        self.word_grams = {}  # Триграмма слова (с краями) -> слова словаря
+        if names:
+            self.rebuild(names)
+
+    def rebuild(self, names):
+        # names: номер строки -> название
+        normalized = {}
+        postings = {}
+        word_rows = {}
+        for row_num in sorted(names):
+            name = normalize(names[row_num])
+            if not name:
+                continue
+            normalized[row_num] = name
+            for word in set(name.split()):
+                word_rows.setdefault(word, []).append(row_num)
+            for gram in {name[i:i + 3] for i in range(len(name) - 2)}:
+                postings.setdefault(gram, []).append(row_num)
+        word_grams = {}
+        for word in word_rows:
+            for gram in word_trigrams(word):
+                word_grams.setdefault(gram, []).append(word)
+        self.names = normalized
+        self.postings = {gram: array('I', row_nums) for gram, row_nums in postings.items()}
+        self.word_rows = {word: array('I', row_nums) for word, row_nums in word_rows.items()}
+        self.vocabulary = sorted(word_rows)
+        self.word_grams = word_grams
+
+    def _add_word(self, word, row_num):
+        row_nums = self.word_rows.get(word)
+        if row_nums is None:
+            row_nums = self.word_rows[word] = array('I')
+            bisect.insort(self.vocabulary, word)
+            for gram in word_trigrams(word):
+                self.word_grams.setdefault(gram, []).append(word)
+        bisect.insort(row_nums, row_num)
+
+    def _remove_word(self, word, row_num):
+        row_nums = self.word_rows[word]
+        del row_nums[bisect.bisect_left(row_nums, row_num)]
+        if row_nums:
+            return
+        del self.word_rows[word]
+        del self.vocabulary[bisect.bisect_left(self.vocabulary, word)]
+        for gram in word_trigrams(word):
+            words = self.word_grams[gram]
+            words.remove(word)
+            if not words:
+                del self.word_grams[gram]
+
+    def set_name(self, row_num, name):
+        # Точечное обновление при изменении названия в одной строке
+        old = self.names.pop(row_num, None)
+        if old is not None:
+            for word in set(old.split()):
+                self._remove_word(word, row_num)
+            for gram in {old[i:i + 3] for i in range(len(old) - 2)}:
+                row_nums = self.postings[gram]
+                del row_nums[bisect.bisect_left(row_nums, row_num)]
+                if not row_nums:
+                    del self.postings[gram]
+        name = normalize(name) if name else ''
+        if not name:
+            return
+        self.names[row_num] = name
+        for word in set(name.split()):
+            self._add_word(word, row_num)
+        for gram in {name[i:i + 3] for i in range(len(name) - 2)}:
+            bisect.insort(self.postings.setdefault(gram, array('I')), row_num)
+
+    def _word_prefix_rows(self, prefix):
+        # Строки со словом, начинающимся на prefix
+        pos = bisect.bisect_left(self.vocabulary, prefix)
+        found = set()
+        while pos < len(self.vocabulary) and self.vocabulary[pos].startswith(prefix):
+            found.update(self.word_rows[self.vocabulary[pos]])
+            pos += 1
+        return found
+
+    def _candidates(self, query, words):
+        # Строки, которые могут содержать запрос целиком или все его слова:
+        # самый редкий список среди триграмм слов запроса
+        grams = set()
+        for word in words:
+            grams |= inner_trigrams(word)
+        if not grams:
+            return self._word_prefix_rows(max(words, key=len))
+        return min((self.postings.get(gram, ()) for gram in grams), key=len)
+
+    def _match(self, query, ranked):
+        query = normalize(query)
+        words = query.split()
+        if not words:
+            return
+        for row_num in self._candidates(query, words):
+            level = match_level(self.names[row_num], query, words)
+            if level is not None and level > ranked.get(row_num, (-1,))[0]:
+                ranked[row_num] = (level, 1.0)
+
+    def similar_words(self, word):
+        # Слова словаря, похожие на word (опечатка, пропущенная буква): [(похожесть, слово)]
+        grams = word_trigrams(word)
+        lists = sorted((self.word_grams.get(gram, ()) for gram in grams), key=len)
+        # У слова с похожестью >= MIN_SIMILARITY не меньше need общих триграмм, значит
+        # оно есть хотя бы в одном из len - need + 1 самых редких списков
+        need = max(1, math.ceil(MIN_SIMILARITY * len(grams) / (2 - MIN_SIMILARITY)))
+        counts = Counter()
+        for words in lists[:len(lists) - need + 1]:
+            counts.update(words)
+        similar = []
+        for candidate, _ in counts.most_common(FUZZY_CANDIDATES):
+            candidate_grams = word_trigrams(candidate)
+            similarity = 2 * len(grams & candidate_grams) / (len(grams) + len(candidate_grams))
+            if similarity >= MIN_SIMILARITY:
+                similar.append((similarity, candidate))
+        similar.sort(reverse=True)
+        return similar[:FUZZY_WORDS]
+
+    def _fuzzy(self, query, ranked):
+        # Каждое слово запроса заменяется похожими словами словаря; строка подходит,
+        # если в ней есть замена для каждого слова. Похожесть — средняя по словам
+        options = []
+        for word in normalize(query).split():
+            similar = dict((candidate, similarity) for similarity, candidate in self.similar_words(word))
+            if not similar:
+                return
+            options.append(similar)
+        if not options:
+            return
+        rarest = min(options, key=lambda similar: sum(len(self.word_rows[word]) for word in similar))
+        row_nums = set()
+        for word in rarest:
+            row_nums.update(self.word_rows[word])
+        for row_num in row_nums:
+            if row_num in ranked:
+                continue
+            row_words = self.names[row_num].split()
+            total = 0
+            for similar in options:
+                best = max((similar.get(word, 0) for word in row_words), default=0)
+                if not best:
+                    break
+                total += best
+            else:
+                ranked[row_num] = (FUZZY, total / len(options))
+
+    def search(self, query, limit=None):
+        # Номера строк по убыванию релевантности: точное название, начало названия,
+        # начало слова, подстрока, все слова запроса. Если ничего не нашлось — тот же
+        # запрос в другой раскладке, затем похожие слова (опечатки)
+        ranked = {}  # Номер строки -> (уровень, похожесть)
+        switched = switch_layout(query)
+        variants = [query, switched] if switched else [query]
+        for step in (self._match, self._fuzzy):
+            for variant in variants:
+                if not ranked:
+                    step(variant, ranked)
+        result = sorted(ranked, key=lambda row_num: (-ranked[row_num][0], -ranked[row_num][1], row_num))
+        return result if limit is None else result[:limit]
+
+
+# Кэш результатов по запросу: следующая страница inline-выдачи или тот же запрос
+# от другого пользователя не ищутся заново. Ключ включает версию снимка склада,
+# поэтому после изменений результаты пересчитываются
+class SearchCache:
+    def __init__(self, max_size=1000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # Ключ -> (время, результат)
+        self.lock = threading.Lock()
+
+    def get(self, key, compute):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                return entry[1]
+        result = compute()
+        with self.lock:
+            self.entries[key] = (now, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return result
@@ -0,0 +1,186 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+
+
+def encode_value(value):
+    # Массивы номеров строк (результаты поиска) сохраняются с типом, чтобы вернуться массивом
+    if isinstance(value, array):
+        return {'__array__': value.typecode, 'items': value.tolist()}
+    raise TypeError(f'Не удаётся сохранить в сессию значение типа {type(value).__name__}')
+
+
+def decode_value(obj):
+    if '__array__' in obj:
+        return array(obj['__array__'], obj['items'])
+    return obj
+
+
+def dump_state(state):
+    # Компактно: JSON без пробелов, сжатый zlib
+    return zlib.compress(json.dumps(state, ensure_ascii=False, separators=(',', ':'),
+                                    default=encode_value).encode('utf-8'), 1)
+
+
+def load_state(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'), object_hook=decode_value)
+
+
+# Хранилище сессий в локальном файле SQLite: переживает перезапуск бота
+class SqliteSessionBackend:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS sessions (chat_id INTEGER PRIMARY KEY, state BLOB NOT NULL, updated_at REAL NOT NULL)')
+        self.lock = threading.Lock()
+
+    def load(self, chat_id, ttl):
+        with self.lock:
+            row = self.connection.execute('SELECT state FROM sessions WHERE chat_id = ? AND updated_at >= ?',
+                                          (chat_id, time.time() - ttl)).fetchone()
+        return load_state(row[0]) if row else None
+
+    def save(self, chat_id, state):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO sessions (chat_id, state, updated_at) VALUES (?, ?, ?)',
+                                    (chat_id, dump_state(state), time.time()))
+
+    def delete(self, chat_id):
+        with self.lock:
+            self.connection.execute('DELETE FROM sessions WHERE chat_id = ?', (chat_id,))
+
+    def expire(self, ttl):
+        with self.lock:
+            self.connection.execute('DELETE FROM sessions WHERE updated_at < ?', (time.time() - ttl,))
+
+
+# Сессии в Redis (или LocalRedis): общие для нескольких процессов бота,
+# брошенные сессии удаляет сам Redis по сроку жизни ключа
+class RedisSessionBackend:
+    def __init__(self, client, ttl=86400, prefix='xyinia:session:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def load(self, chat_id, ttl):
+        data = self.client.get(f'{self.prefix}{chat_id}')
+        return load_state(data) if data else None
+
+    def save(self, chat_id, state):
+        self.client.set(f'{self.prefix}{chat_id}', dump_state(state), ex=self.ttl)
+
+    def delete(self, chat_id):
+        self.client.delete(f'{self.prefix}{chat_id}')
+
+    def expire(self, ttl):
+        pass
+
+
+# Состояния пользователей (chat_id -> строка-состояние или словарь).
+# В памяти держится не больше max_sessions последних сессий (LRU), брошенные
+# сессии удаляются через ttl секунд. С backend сессии сохраняются после каждого
+# апдейта (commit) и подгружаются обратно после перезапуска или вытеснения из памяти
+class SessionStore:
+    def __init__(self, backend=None, max_sessions=10000, ttl=86400):
+        self.backend = backend
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()  # chat_id -> [состояние, время последнего обращения]
+        self.last_expire = time.monotonic()
+        self.lock = threading.RLock()
+
+    def _entry(self, chat_id):
+        entry = self.sessions.get(chat_id)
+        if entry is not None and time.monotonic() - entry[1] > self.ttl:
+            self._drop(chat_id)
+            entry = None
+        if entry is None and self.backend is not None:
+            state = self.backend.load(chat_id, self.ttl)
+            if state is not None:
+                entry = self.sessions[chat_id] = [state, 0]
+        if entry is not None:
+            entry[1] = time.monotonic()
+            self.sessions.move_to_end(chat_id)
+        return entry
+
+    def _drop(self, chat_id):
+        self.sessions.pop(chat_id, None)
+        if self.backend is not None:
+            self.backend.delete(chat_id)
+
+    def _evict(self):
+        # Лишние сессии вытесняются из памяти; с backend они остаются на диске
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+        if time.monotonic() - self.last_expire > 60:
+            self.expire()
+
+    def expire(self):
+        # Удаляем брошенные сессии (кэшированные результаты поиска, блоки заказов)
+        with self.lock:
+            now = time.monotonic()
+            for chat_id in [chat_id for chat_id, entry in self.sessions.items() if now - entry[1] > self.ttl]:
+                del self.sessions[chat_id]
+            if self.backend is not None:
+                self.backend.expire(self.ttl)
+            self.last_expire = now
+
+    def __contains__(self, chat_id):
+        with self.lock:
+            return self._entry(chat_id) is not None
+
+    def __getitem__(self, chat_id):
+        with self.lock:
+            entry = self._entry(chat_id)
+            if entry is None:
+                raise KeyError(chat_id)
+            return entry[0]
+
+    def __setitem__(self, chat_id, state):
+        with self.lock:
+            self.sessions[chat_id] = [state, time.monotonic()]
+            self.sessions.move_to_end(chat_id)
+            self._evict()
+
+    def __delitem__(self, chat_id):
+        with self.lock:
+            if self._entry(chat_id) is None:
+                raise KeyError(chat_id)
+            self._drop(chat_id)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.sessions)
+
+    def get(self, chat_id, default=None):
+        with self.lock:
+            entry = self._entry(chat_id)
+            return default if entry is None else entry[0]
+
+    def pop(self, chat_id, default=None):
+        with self.lock:
+            entry = self._entry(chat_id)
+            if entry is None:
+                return default
+            self._drop(chat_id)
+            return entry[0]
+
+    def forget(self, chat_id):
+        # Убрать копию сессии из памяти, не трогая backend: следующее обращение прочитает
+        # сессию заново (её мог изменить другой процесс бота)
+        with self.lock:
+            self.sessions.pop(chat_id, None)
+
+    def commit(self, chat_id):
+        # Сохранить сессию после обработки апдейта (словари состояний меняются на месте)
+        if self.backend is None:
+            return
+        with self.lock:
+            entry = self.sessions.get(chat_id)
+            if entry is not None:
+                self.backend.save(chat_id, entry[0])
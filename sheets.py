@@ -0,0 +1,388 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import gspread
+from gspread.exceptions import APIError
+from requests.exceptions import ConnectionError as NetworkError, Timeout
+from gspread.utils import a1_range_to_grid_range, absolute_range_name, fill_gaps
+
+from numeric import cell_number
+
+
+def api_error_status(error):
+    # В разных версиях gspread код ответа лежит в разных местах
+    code = getattr(error, 'code', None)
+    if code is None and getattr(error, 'response', None) is not None:
+        code = error.response.status_code
+    return code
+
+
+# Ответы, после которых запрос стоит повторить с паузой: превышена квота или сбой на стороне Google
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Методы листа, которые только читают: одинаковые одновременные вызовы объединяются в один запрос
+READ_METHODS = {'get_all_values', 'get_all_records', 'get_values', 'get', 'batch_get',
+                'row_values', 'col_values', 'acell', 'cell'}
+SPREADSHEET_READ_METHODS = {'fetch_sheet_metadata', 'values_get', 'values_batch_get', 'worksheets', 'worksheet',
+                            'get_worksheet', 'get_worksheet_by_id'}
+
+
+def is_transient_error(error):
+    # Квота или временный сбой, которые не прошли и после всех повторов
+    if isinstance(error, (NetworkError, Timeout)):
+        return True
+    return isinstance(error, APIError) and api_error_status(error) in RETRY_STATUSES
+
+
+def is_rate_limited(error):
+    return isinstance(error, APIError) and api_error_status(error) == 429
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0, error=None):
+    # Экспоненциальная пауза со случайным разбросом (full jitter), чтобы повторы
+    # разных потоков не приходили одновременно; Retry-After от сервера важнее
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), cap)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# Ведро токенов под поминутную квоту Sheets API: в среднем не больше per_minute
+# запросов в минуту, до burst подряд; лишние запросы ждут своей очереди
+class TokenBucket:
+    def __init__(self, per_minute=60, burst=10):
+        self.rate = per_minute / 60.0
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Сколько секунд пришлось ждать токен
+        started = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - started
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_stale_error(error):
+    # Лист удалили или переименовали, пока у нас был старый объект
+    text = str(error)
+    return api_error_status(error) == 404 or (
+        api_error_status(error) == 400 and ('Unable to parse range' in text or 'No grid with id' in text))
+
+
+# Реестр таблицы и листов: open_by_key и worksheets() вызываются один раз,
+# а не перед каждым обращением к листу
+class WorksheetRegistry:
+    def __init__(self, spreadsheet_id, authorize, requests_per_minute=60, max_retries=5, metrics=None):
+        self.spreadsheet_id = spreadsheet_id
+        self.authorize = authorize  # Функция, которая возвращает авторизованный gspread-клиент
+        self.client = None
+        self.spreadsheet = None
+        self.worksheets = []
+        self.lock = threading.RLock()
+        self.bucket = TokenBucket(requests_per_minute, max(1, requests_per_minute // 6))
+        self.max_retries = max_retries
+        self.inflight = {}  # Ключ чтения -> Future запроса, который уже выполняется
+        self.inflight_lock = threading.Lock()
+        self.metrics = metrics  # Metrics: ожидание квоты и повторы
+
+    def get_client(self):
+        with self.lock:
+            if self.client is None:
+                self.client = self.authorize()
+            return self.client
+
+    def reauthorize(self):
+        with self.lock:
+            self.client = self.authorize()
+            self.spreadsheet = None
+            self.worksheets = []
+
+    def get_spreadsheet(self):
+        with self.lock:
+            if self.spreadsheet is None:
+                self.spreadsheet = self.get_client().open_by_key(self.spreadsheet_id)
+                self.worksheets = self.spreadsheet.worksheets()
+            return self.spreadsheet
+
+    def refresh(self):
+        # Перечитать список листов (после изменения структуры таблицы)
+        with self.lock:
+            if self.spreadsheet is None:
+                self.get_spreadsheet()
+            else:
+                self.worksheets = self.spreadsheet.worksheets()
+
+    def _lookup(self, title, partial):
+        for worksheet in self.worksheets:
+            if worksheet.title == title or (partial and title in worksheet.title):
+                return worksheet
+        return None
+
+    def handle(self, title, partial=False):
+        with self.lock:
+            self.get_spreadsheet()
+            worksheet = self._lookup(title, partial)
+            if worksheet is None:
+                self.refresh()
+                worksheet = self._lookup(title, partial)
+            return worksheet
+
+    def sheet(self, title, partial=False):
+        # Лист-обёртка или None, если такого листа нет
+        if self.handle(title, partial) is None:
+            return None
+        return ManagedWorksheet(self, title, partial)
+
+    def new_sheet_id(self):
+        # Свободный id для листа, который создаётся в одном batchUpdate со своими строками
+        # (API назначает id сам, только если строки пишутся отдельным запросом)
+        self.request(self.refresh)
+        with self.lock:
+            taken = {worksheet.id for worksheet in self.worksheets}
+        while True:
+            sheet_id = random.randrange(1, 2 ** 31)
+            if sheet_id not in taken:
+                return sheet_id
+
+    def add_worksheet(self, title, rows, cols):
+        with self.lock:
+            self.request(lambda: self.get_spreadsheet().add_worksheet(title, rows, cols), idempotent=False)
+            self.request(self.refresh)
+            return ManagedWorksheet(self, title)
+
+    def recover(self, error):
+        # True, если после ошибки имеет смысл повторить запрос
+        status = api_error_status(error)
+        if status == 401:
+            self.reauthorize()
+            return True
+        if is_stale_error(error):
+            with self.lock:
+                self.spreadsheet = None
+                self.worksheets = []
+            return True
+        return False
+
+    def request(self, func, key=None, limited=True, idempotent=True):
+        # Запрос к таблице: по квоте (limited), с паузами и повторами на 429/5xx и сетевых
+        # сбоях и с одним повтором после переавторизации или обновления листов.
+        # Запись (idempotent=False) повторяется только после 429: при сбое сети или 5xx она
+        # могла уже выполниться, и повтор удалил бы или вставил строки второй раз.
+        # Запросы с одинаковым ключом key, пока первый не завершился, получают его результат
+        if key is not None:
+            return self.coalesce(key, lambda: self.request(func, limited=limited, idempotent=idempotent))
+        retries = 0
+        recovered = False
+        while True:
+            if limited:
+                waited = self.bucket.acquire()
+                if self.metrics is not None:
+                    self.metrics.observe('sheets_quota_wait_seconds', (), waited)
+            try:
+                return func()
+            except (APIError, NetworkError, Timeout) as e:
+                if is_transient_error(e) and retries < self.max_retries and (idempotent or is_rate_limited(e)):
+                    if self.metrics is not None:
+                        self.metrics.inc('sheets_retries_total', (('status', str(api_error_status(e) or type(e).__name__)),))
+                    time.sleep(backoff_delay(retries, error=e))
+                    retries += 1
+                    continue
+                if isinstance(e, APIError) and not recovered and self.recover(e):
+                    recovered = True
+                    continue
+                raise
+
+    def coalesce(self, key, func):
+        with self.inflight_lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self.inflight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as e:
+            with self.inflight_lock:
+                del self.inflight[key]
+            future.set_exception(e)
+            raise
+        with self.inflight_lock:
+            del self.inflight[key]
+        future.set_result(result)
+        return result
+
+    def batch_update(self, build_body):
+        # Тело собирается на каждой попытке: после обновления листов у них могут быть новые id
+        return self.request(lambda: self.get_spreadsheet().batch_update(build_body()), idempotent=False)
+
+    def modified_time(self):
+        # Время последнего изменения файла таблицы (метаданные Drive, квоту Sheets не тратит)
+        return self.request(lambda: self.get_client().get_file_drive_metadata(self.spreadsheet_id)['modifiedTime'],
+                            key='modified_time', limited=False)
+
+    def values(self, sheets):
+        # Все значения нескольких листов одним запросом values.batchGet, в том же виде,
+        # что и get_all_values; sheets — пары (название, partial), для отсутствующего листа None
+        def fetch():
+            worksheets = [self.handle(title, partial) for title, partial in sheets]
+            ranges = [absolute_range_name(worksheet.title) for worksheet in worksheets if worksheet is not None]
+            if not ranges:
+                return [None] * len(worksheets)
+            value_ranges = iter(self.get_spreadsheet().values_batch_get(ranges)['valueRanges'])
+            result = []
+            for worksheet in worksheets:
+                values = next(value_ranges).get('values') if worksheet is not None else None
+                result.append(None if worksheet is None else fill_gaps(values) if values else [])
+            return result
+        return self.request(fetch, key=('values', tuple(sheets)))
+
+    def call(self, title, partial, method, args, kwargs):
+        def run():
+            worksheet = self.handle(title, partial)
+            if worksheet is None:
+                raise gspread.WorksheetNotFound(title)
+            return getattr(worksheet, method)(*args, **kwargs)
+        key = None
+        if method in READ_METHODS:
+            key = (title, partial, method, repr(args), repr(sorted(kwargs.items())))
+        return self.request(run, key, idempotent=method in READ_METHODS)
+
+
+# Обёртка над gspread.Worksheet: берёт актуальный объект листа из реестра
+# и повторяет запрос после переавторизации или обновления устаревшего листа
+class ManagedWorksheet:
+    def __init__(self, registry, title, partial=False):
+        self._registry = registry
+        self._title = title
+        self._partial = partial
+
+    def __getattr__(self, name):
+        worksheet = self._registry.handle(self._title, self._partial)
+        if worksheet is None:
+            raise gspread.WorksheetNotFound(self._title)
+        attr = getattr(worksheet, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self._registry.call(self._title, self._partial, name, args, kwargs)
+        return call
+
+    @property
+    def spreadsheet(self):
+        # Таблица листа (через неё пишет gspread_formatting) — тоже через реестр
+        return ManagedSpreadsheet(self._registry)
+
+
+# Обёртка над gspread.Spreadsheet: запросы по квоте реестра, с повторами для чтения
+# и повтором записи только после 429, как у ManagedWorksheet
+class ManagedSpreadsheet:
+    def __init__(self, registry):
+        self._registry = registry
+
+    def __getattr__(self, name):
+        attr = getattr(self._registry.get_spreadsheet(), name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self._registry.request(lambda: getattr(self._registry.get_spreadsheet(), name)(*args, **kwargs),
+                                          idempotent=name in SPREADSHEET_READ_METHODS)
+        return call
+
+
+def cell_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, (int, float)):
+        return {'numberValue': value}
+    return {'stringValue': '' if value is None else str(value)}
+
+
+def build_requests(operations, sheet_id):
+    # Запросы spreadsheets.batchUpdate для операций SheetBatch над листом sheet_id
+    requests = []
+    for operation in operations:
+        kind = operation[0]
+        if kind == 'insert':
+            index = operation[1]
+            requests.append({'insertDimension': {
+                'range': {'sheetId': sheet_id, 'dimension': 'ROWS', 'startIndex': index - 1, 'endIndex': index},
+                'inheritFromBefore': False}})
+        elif kind == 'delete':
+            start_index, end_index = operation[1:]
+            requests.append({'deleteDimension': {
+                'range': {'sheetId': sheet_id, 'dimension': 'ROWS', 'startIndex': start_index - 1, 'endIndex': end_index}}})
+        elif kind == 'values':
+            row, col, values = operation[1:]
+            requests.append({'updateCells': {
+                'start': {'sheetId': sheet_id, 'rowIndex': row - 1, 'columnIndex': col - 1},
+                'rows': [{'values': [{'userEnteredValue': cell_value(value)} for value in values]}],
+                'fields': 'userEnteredValue'}})
+        elif kind == 'grow':
+            # Пустые строки в конце сетки листа: запись ниже последней строки сетки не пройдёт
+            requests.append({'appendDimension': {'sheetId': sheet_id, 'dimension': 'ROWS', 'length': operation[1]}})
+        elif kind == 'format':
+            range_name, props, fields = operation[1:]
+            requests.append({'repeatCell': {
+                'range': a1_range_to_grid_range(range_name, sheet_id),
+                'cell': {'userEnteredFormat': props},
+                'fields': fields}})
+    return requests
+
+
+# Пакет изменений одного листа: вставки, удаления, значения и форматирование
+# копятся и уходят в таблицу одним запросом spreadsheets.batchUpdate.
+# Операции хранятся как данные, поэтому пакет можно записать в журнал и повторить
+class SheetBatch:
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.operations = []
+
+    def insert_row(self, values, index):
+        # index с 1, как в gspread: строка встаёт на это место, остальные сдвигаются вниз
+        self.operations.append(['insert', index])
+        self.update_row(index, 1, values)
+
+    def delete_rows(self, start_index, end_index):
+        self.operations.append(['delete', start_index, end_index])
+
+    def update_row(self, row, col, values):
+        # Значения подряд в одной строке, начиная со столбца col
+        self.operations.append(['values', row, col, [cell_number(value) for value in values]])
+
+    def update_cell(self, row, col, value):
+        self.update_row(row, col, [value])
+
+    def append_rows(self, row, rows):
+        # Строки в конец данных, начиная с row. Сетка листа вырастает на столько же строк,
+        # поэтому запас пустых строк под данными не кончается
+        self.operations.append(['grow', len(rows)])
+        for row_num, values in enumerate(rows, row):
+            self.update_row(row_num, 1, values)
+
+    def format(self, range_name, cell_format):
+        # cell_format — CellFormat из gspread_formatting
+        self.operations.append(['format', range_name, cell_format.to_props(),
+                                ','.join(cell_format.affected_fields('userEnteredFormat'))])
+
+    def flush(self):
+        if not self.operations:
+            return None
+        operations, self.operations = self.operations, []
+        return self.sheet._registry.batch_update(
+            lambda: {'requests': build_requests(operations, self.sheet.id)})
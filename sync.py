@@ -0,0 +1,64 @@
+import threading
+
+
+# Фоновая синхронизация локальных копий листов с таблицей. Раз в interval секунд
+# проверяется время изменения файла (Drive API, квота Sheets не расходуется);
+# только если таблица менялась, все листы скачиваются одним запросом values.batchGet
+# и отличающиеся строки применяются к копиям
+class SheetSync:
+    def __init__(self, registry, interval=5, last_modified=None, busy=None):
+        self.registry = registry
+        self.interval = interval
+        self.busy = busy  # Функция: True, пока есть изменения, ещё не записанные в таблицу
+        self.targets = []  # (название листа, partial, копия с version/touch/apply_rows)
+        self.last_modified = last_modified  # Время изменения таблицы, которому соответствуют копии
+        self.checks = 0
+        self.fetches = 0
+        self.stop_event = threading.Event()
+
+    def add(self, title, cache, partial=False):
+        self.targets.append((title, partial, cache))
+
+    def check(self):
+        # Один шаг синхронизации; True, если скачивались значения листов
+        self.checks += 1
+        if self.busy is not None and self.busy():
+            # Локальные копии новее таблицы, пока в неё не записаны отложенные изменения
+            for _, _, cache in self.targets:
+                cache.touch()
+            return False
+        modified = self.registry.modified_time()
+        if modified == self.last_modified:
+            for _, _, cache in self.targets:
+                cache.touch()
+            return False
+        versions = [cache.version for _, _, cache in self.targets]
+        values = self.registry.values([(title, partial) for title, partial, _ in self.targets])
+        self.fetches += 1
+        applied = True
+        for (_, _, cache), version, rows in zip(self.targets, versions, values):
+            if rows is not None and not cache.apply_rows(rows, version):
+                applied = False
+        if applied:
+            # Время запомнено до скачивания: правка между запросами просто вызовет ещё одну проверку
+            self.last_modified = modified
+        return True
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Ошибка синхронизации таблицы: {e}")
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='sheet-sync', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stop_event.set()
+
+    def stats(self):
+        return {'checks': self.checks, 'fetches': self.fetches, 'last_modified': self.last_modified}
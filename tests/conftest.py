@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота лежат в корне репозитория, подделки Google Sheets и Telegram — в benchmarks
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+from fake_services import CallLog, FakeClient, FakeSpreadsheet, Latency
+from sheets import WorksheetRegistry
+
+
+@pytest.fixture
+def spreadsheet():
+    # Таблица в памяти без задержек и квоты
+    return FakeSpreadsheet(CallLog(), Latency())
+
+
+@pytest.fixture
+def registry(spreadsheet):
+    return WorksheetRegistry('test', lambda: FakeClient(spreadsheet), requests_per_minute=60000, max_retries=0)
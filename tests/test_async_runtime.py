@@ -0,0 +1,147 @@
+import asyncio
+import io
+import json
+import threading
+import time
+from urllib.parse import parse_qs
+
+import pytest
+import requests
+import telebot
+from aiohttp import web
+from telebot import apihelper, asyncio_helper
+
+from async_runtime import AsyncRuntime
+from metrics import Metrics, telegram_sender
+
+TOKEN = '123:test'
+
+
+def recorded_update(update_id, chat_id=5):
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': '/start',
+        'chat': {'id': chat_id, 'type': 'private'}, 'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'}}}
+
+
+# Bot API на локальном порту: запоминает запросы и отвечает как Telegram
+class FakeBotApi:
+    def __init__(self):
+        self.requests = []  # (метод, параметры запроса, поля формы)
+        self.updates = [recorded_update(1), recorded_update(2)]
+        self.loop = asyncio.new_event_loop()
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        fields = {}
+        if request.content_type == 'multipart/form-data':
+            async for part in await request.multipart():
+                fields[part.name] = (part.filename, (await part.read()).decode('utf-8'))
+        else:
+            fields = {key: values[0] for key, values in parse_qs((await request.read()).decode('utf-8')).items()}
+        params = dict(request.query)
+        self.requests.append((method, params, fields))
+        if method == 'getUpdates':
+            offset = int(fields.get('offset', 0))
+            updates = [update for update in self.updates if update['update_id'] >= offset]
+            if not updates:
+                await asyncio.sleep(0.05)
+            return web.json_response({'ok': True, 'result': updates})
+        if method == 'sendMessage' and params.get('text') == 'fail':
+            return web.json_response({'ok': False, 'error_code': 400, 'description': 'Bad Request: test'}, status=400)
+        if method in ('sendMessage', 'sendDocument'):
+            return web.json_response({'ok': True, 'result': {
+                'message_id': 10, 'date': 0, 'text': params.get('text', ''), 'chat': {'id': int(params['chat_id']), 'type': 'private'}}})
+        return web.json_response({'ok': True, 'result': True})
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+
+    def start(self):
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+@pytest.fixture
+def api():
+    api = FakeBotApi()
+    api.start()
+    yield api
+    api.stop()
+
+
+@pytest.fixture
+def runtime():
+    runtime = AsyncRuntime(TOKEN, connections=4, metrics=Metrics(), poll_timeout=1)
+    runtime.start()
+    yield runtime
+    runtime.stop()
+
+
+@pytest.fixture
+def sync_bot(api, runtime, monkeypatch):
+    # Синхронный TeleBot обработчиков, запросы которого идут через цикл runtime
+    monkeypatch.setattr(apihelper, 'API_URL', api.url + '/bot{0}/{1}')
+    monkeypatch.setattr(apihelper, 'CUSTOM_REQUEST_SENDER', telegram_sender(runtime.metrics, runtime))
+    return telebot.TeleBot(TOKEN, threaded=False)
+
+
+def test_handler_requests_go_through_loop(api, sync_bot, runtime):
+    message = sync_bot.send_message(5, 'Привет', disable_notification=True)
+    assert message.message_id == 10 and message.text == 'Привет'
+    method, params, _ = api.requests[-1]
+    assert method == 'sendMessage'
+    assert params['chat_id'] == '5' and params['text'] == 'Привет' and params['disable_notification'] == 'True'
+    assert ('api_calls_total', (('api', 'telegram'), ('method', 'sendMessage'), ('action', 'MainThread'),
+                                ('status', '200'))) in runtime.metrics.counters
+
+
+def test_handler_requests_from_many_threads(api, sync_bot):
+    threads = [threading.Thread(target=sync_bot.send_message, args=(chat_id, 'x')) for chat_id in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(int(params['chat_id']) for _, params, _ in api.requests) == list(range(20))
+
+
+def test_document_is_sent_as_multipart(api, sync_bot):
+    sync_bot.send_document(5, io.BytesIO('строка'.encode('utf-8')), visible_file_name='Заказ.csv')
+    method, params, fields = api.requests[-1]
+    assert method == 'sendDocument' and params['chat_id'] == '5'
+    assert fields['document'] == ('Заказ.csv', 'строка')
+
+
+def test_api_errors_are_raised_as_in_threads_mode(api, sync_bot, runtime):
+    with pytest.raises(apihelper.ApiTelegramException) as error:
+        sync_bot.send_message(5, 'fail')
+    assert error.value.error_code == 400
+    api.stop()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        runtime.request('get', api.url + f'/bot{TOKEN}/getMe', timeout=(1, 1))
+    api.start()
+
+
+def test_polling_submits_updates_in_order(api, runtime, monkeypatch):
+    monkeypatch.setattr(asyncio_helper, 'API_URL', api.url + '/bot{0}/{1}')
+    submitted = []
+    polling = asyncio.run_coroutine_threadsafe(runtime.poll(lambda update: submitted.append(update.update_id)), runtime.loop)
+    deadline = time.monotonic() + 5
+    while len([method for method, _, _ in api.requests if method == 'getUpdates']) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    polling.cancel()
+    assert submitted == [1, 2]
+    methods = [(method, fields.get('offset')) for method, _, fields in api.requests]
+    assert methods[:3] == [('deleteWebhook', None), ('getUpdates', None), ('getUpdates', '3')]
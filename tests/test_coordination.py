@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from coordination import LocalRedis, LockNotOwnedError, LockTimeout, RedisLocks
+from sessions import RedisSessionBackend, SessionStore
+
+
+def test_lock_is_exclusive_across_threads():
+    locks = RedisLocks(LocalRedis(), timeout=5, wait=5)
+    events = []
+
+    def worker(n):
+        with locks.lock('orders'):
+            events.append(('in', n))
+            time.sleep(0.02)
+            events.append(('out', n))
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Никто не входит, пока предыдущий не вышел
+    assert all(events[i][0] == 'in' and events[i + 1] == ('out', events[i][1]) for i in range(0, len(events), 2))
+
+
+def test_lock_of_crashed_process_expires():
+    client = LocalRedis()
+    assert client.lock('xyinia:lock:orders', timeout=0.2).acquire()  # Процесс упал, не отпустив блокировку
+    locks = RedisLocks(client, timeout=5, wait=2)
+    started = time.monotonic()
+    with locks.lock('orders'):
+        waited = time.monotonic() - started
+    assert 0.1 < waited < 1.5
+
+
+def test_waiting_for_lock_is_bounded():
+    client = LocalRedis()
+    assert client.lock('xyinia:lock:orders', timeout=5).acquire()
+    locks = RedisLocks(client, timeout=5, wait=0.2)
+    with pytest.raises(LockTimeout):
+        with locks.lock('orders'):
+            pass
+    with locks.lock('other'):
+        pass
+
+
+def test_extend_keeps_lock_alive():
+    client = LocalRedis()
+    locks = RedisLocks(client, timeout=0.3, wait=0.1)
+    other = RedisLocks(client, timeout=0.3, wait=0.1)
+    with locks.lock('orders'):
+        for _ in range(4):
+            time.sleep(0.15)
+            locks.extend('orders')
+        # Прошло больше срока блокировки, но она продлевалась и всё ещё занята
+        with pytest.raises(LockTimeout):
+            with other.lock('orders'):
+                pass
+    with other.lock('orders'):
+        pass
+
+
+def test_extend_of_expired_lock_fails():
+    client = LocalRedis()
+    locks = RedisLocks(client, timeout=0.1, wait=1)
+    with locks.lock('orders'):
+        time.sleep(0.2)
+        assert client.lock('xyinia:lock:orders', timeout=5).acquire()  # Блокировку уже взял другой процесс
+        with pytest.raises(LockNotOwnedError):
+            locks.extend('orders')
+    # Истёкшая блокировка при выходе не снимает чужую
+    assert client.get('xyinia:lock:orders') is not None
+
+
+def test_extend_without_lock_is_noop():
+    RedisLocks(LocalRedis()).extend('orders')
+
+
+def test_version_counter_is_shared():
+    client = LocalRedis()
+    first, second = RedisLocks(client), RedisLocks(client)
+    assert first.get_version('orders') == 0
+    assert first.bump_version('orders') == 1
+    assert second.bump_version('orders') == 2
+    assert first.get_version('orders') == 2
+    assert first.get_version('warehouse') == 0
+
+
+def test_redis_sessions_are_shared_between_processes():
+    client = LocalRedis()
+    first = SessionStore(RedisSessionBackend(client))
+    second = SessionStore(RedisSessionBackend(client))
+    first[1] = {'state': 'editing_order', 'order_name': 'Заказ'}
+    first.commit(1)
+    state = second[1]
+    state['selected_item_index'] = 2
+    second.commit(1)
+    first.forget(1)  # Как chat_lock: сессию читаем заново после другого процесса
+    assert first[1] == {'state': 'editing_order', 'order_name': 'Заказ', 'selected_item_index': 2}
+    del second[1]
+    first.forget(1)
+    assert 1 not in first
+
+
+def test_redis_session_expires_with_key():
+    client = LocalRedis()
+    backend = RedisSessionBackend(client, ttl=0.1)
+    backend.save(1, 'waiting_for_search')
+    assert backend.load(1, 0.1) == 'waiting_for_search'
+    time.sleep(0.2)
+    assert backend.load(1, 0.1) is None
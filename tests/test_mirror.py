@@ -0,0 +1,46 @@
+from mirror import SheetMirror
+
+
+class Source:
+    # Копия листа, как у WarehouseCache и индексов заказов: версия и снимок строк
+    def __init__(self, rows):
+        self.rows = rows
+        self.version = 1
+
+    def snapshot(self):
+        return self.version, [list(row) for row in self.rows]
+
+
+def test_rows_survive_restart(tmp_path):
+    path = str(tmp_path / 'mirror.db')
+    mirror = SheetMirror(path)
+    assert mirror.load('warehouse') is None
+    rows = [['№', 'Название'], ['1', 'Кабель'], [], ['3', 'Лампа']]
+    mirror.save('warehouse', rows)
+    mirror.save('orders', [['📋 Заказ']])
+    assert SheetMirror(path).load('warehouse') == rows
+    assert SheetMirror(path).load('orders') == [['📋 Заказ']]
+
+
+def test_only_changed_rows_are_written(tmp_path):
+    path = str(tmp_path / 'mirror.db')
+    mirror = SheetMirror(path)
+    mirror.save('warehouse', [['1', 'Кабель'], ['2', 'Лампа'], ['3', 'Розетка']])
+    assert mirror.save('warehouse', [['1', 'Кабель'], ['2', 'Лампа LED']]) == 2
+    assert SheetMirror(path).save('warehouse', [['1', 'Кабель'], ['2', 'Лампа LED']]) == 0
+    assert SheetMirror(path).load('warehouse') == [['1', 'Кабель'], ['2', 'Лампа LED']]
+
+
+def test_flush_saves_changed_snapshots(tmp_path):
+    path = str(tmp_path / 'mirror.db')
+    mirror = SheetMirror(path)
+    source = Source([['1', 'Кабель']])
+    mirror.watch('warehouse', source)
+    mirror.flush('2026-01-01T00:00:00Z')
+    source.rows.append(['2', 'Лампа'])
+    mirror.flush()  # Версия та же: снимок не сохраняется
+    assert SheetMirror(path).load('warehouse') == [['1', 'Кабель']]
+    source.version += 1
+    mirror.flush()
+    assert SheetMirror(path).load('warehouse') == [['1', 'Кабель'], ['2', 'Лампа']]
+    assert SheetMirror(path).get_meta('modified_time') == '2026-01-01T00:00:00Z'
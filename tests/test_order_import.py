@@ -0,0 +1,100 @@
+import io
+
+import pytest
+from openpyxl import Workbook
+
+from order_import import (MAX_IMPORT_LINES, ImportFileError, ImportLine, check_stock, format_errors,
+                          parse_order_file, resolve_lines)
+
+
+def csv_bytes(text, encoding='utf-8'):
+    return text.encode(encoding)
+
+
+def xlsx_bytes(rows):
+    workbook = Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    file = io.BytesIO()
+    workbook.save(file)
+    return file.getvalue()
+
+
+def summary(lines):
+    return [(line.line, line.name, line.qty, line.dealer) for line in lines]
+
+
+def test_csv_with_header_and_price_type():
+    data = csv_bytes("Товар;Количество;Цена\nКабель ВВГ;2;обычная\nЛампа;3;Дилерская\n\nРозетка;1;\n", 'cp1251')
+    lines, errors = parse_order_file('заказ.csv', data)
+    assert errors == []
+    assert summary(lines) == [(2, 'Кабель ВВГ', 2, False), (3, 'Лампа', 3, True), (5, 'Розетка', 1, False)]
+
+
+def test_csv_without_header():
+    lines, errors = parse_order_file('заказ.csv', csv_bytes("Кабель,2\nЛампа,5,дилерская\n"))
+    assert errors == []
+    assert summary(lines) == [(1, 'Кабель', 2, False), (2, 'Лампа', 5, True)]
+
+
+def test_xlsx_order_export_is_read_back():
+    # Выгрузка завершённого заказа: строка заказа, товары с префиксом и "Итого" без товара
+    data = xlsx_bytes([
+        ['Название заказа', 'Товар', 'Количество', 'Цена', 'Сумма'],
+        ['📋 Заказ', '', '', '', ''],
+        ['', '🛒 Кабель', 2.0, 150.5, 301],
+        ['', '🛒 Лампа', 1, 99, 99],
+        ['', '', '', 'Итого', 400],
+    ])
+    lines, errors = parse_order_file('Заказ.xlsx', data)
+    assert errors == []
+    assert summary(lines) == [(3, 'Кабель', 2, False), (4, 'Лампа', 1, False)]
+
+
+def test_bad_lines_are_reported_with_numbers():
+    data = csv_bytes("Товар,Количество,Тип\nКабель,0,\nЛампа,1.5,\nРозетка,много,\nПровод,2,розница\nЩиток,1,\n")
+    lines, errors = parse_order_file('заказ.csv', data)
+    assert summary(lines) == [(6, 'Щиток', 1, False)]
+    assert [line for line, _ in errors] == [2, 3, 4, 5]
+    assert "тип цены 'розница'" in errors[3][1]
+
+
+def test_unsupported_and_broken_files():
+    with pytest.raises(ImportFileError):
+        parse_order_file('заказ.pdf', b'%PDF')
+    with pytest.raises(ImportFileError):
+        parse_order_file('заказ.xlsx', b'not a workbook')
+
+
+def test_too_many_lines():
+    data = csv_bytes(''.join(f"Товар {i},1\n" for i in range(MAX_IMPORT_LINES + 1)))
+    with pytest.raises(ImportFileError):
+        parse_order_file('заказ.csv', data)
+
+
+def test_resolve_lines():
+    names = {2: 'Кабель ВВГ', 3: 'Лампа LED', 4: 'Лампа накаливания', 5: 'Розетка'}
+    by_name = {name: row for row, name in names.items()}
+    search_results = {'кабель ввг': [2], 'лампа': [3, 4], 'розетк': [5], 'щиток': []}
+    lines = [ImportLine(1, 'Кабель ВВГ', 1, False), ImportLine(2, 'кабель ввг', 1, False),
+             ImportLine(3, 'Лампа', 1, False), ImportLine(4, 'Розетк', 1, False), ImportLine(5, 'Щиток', 1, False)]
+    resolved, errors, substitutions = resolve_lines(
+        lines, by_name.get, lambda query: search_results[query.lower()], names.get)
+    assert [(item.line, row_num) for item, row_num in resolved] == [(1, 2), (2, 2), (4, 5)]
+    assert [line for line, _ in errors] == [3, 5]
+    # Товар, найденный поиском под другим названием, попадает в отчёт
+    assert substitutions == [(4, "'Розетк' → 'Розетка'")]
+
+
+def test_check_stock_adds_up_repeated_items():
+    first, second, other = ImportLine(1, 'Кабель', 3, False), ImportLine(2, 'Кабель', 4, True), ImportLine(3, 'Лампа', 1, False)
+    stock = {2: 5, 3: 1}
+    errors = check_stock([(first, 2), (second, 2), (other, 3)], stock.get)
+    assert [line for line, _ in errors] == [1, 2]
+    assert 'нужно 7 шт., на складе 5 шт.' in errors[0][1]
+
+
+def test_format_errors_is_limited():
+    text = format_errors([(line, 'ошибка') for line in range(1, 41)], limit=30)
+    assert text.splitlines()[0] == 'Строка 1: ошибка'
+    assert text.splitlines()[-1] == '…и ещё 10'
@@ -0,0 +1,195 @@
+from decimal import Decimal
+
+import pytest
+from gspread_formatting import CellFormat, TextFormat
+
+from order_store import BlockOrderStore, FlatOrderStore
+from orders import DELETED_MARK, FlatOrderIndex, OrderIndex, flat_rows_from_blocks
+
+TOTAL_FORMAT = CellFormat(textFormat=TextFormat(bold=True))
+
+BLOCK_ROWS = [
+    ['📋 Название заказа', '🛒 Товар', '📦 Количество', '💰 Цена', '💵 Сумма'],
+    ['📋 Первый', '', '', '', ''],
+    ['', '🛒 Кабель', '2', '10', '20'],
+    ['', '🛒 Лампа', '1', '15,50', '15,50'],
+    ['', '', '', 'Итого', '35,5'],
+    ['📋 Без итога', '', '', '', ''],
+    ['', '🛒 Розетка', '4', '10', '40'],
+    ['', '🛒 Провод', '3', '10', '30'],
+    [],
+    ['📋 Последний', '', '', '', ''],
+    ['', '🛒 Щиток', '1', '100', '100'],
+    ['', '', '', 'Итого', '100'],
+]
+
+
+def trimmed(rows):
+    # Строки без хвостовых пустых ячеек и строк — как их сравнивать с get_all_values
+    rows = [list(row) for row in rows]
+    for row in rows:
+        while row and row[-1] == '':
+            row.pop()
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+
+@pytest.fixture
+def block_store(spreadsheet, registry):
+    worksheet = spreadsheet.add_sheet('Заказы', BLOCK_ROWS)
+    index = OrderIndex(lambda: registry.sheet('Заказы').get_all_values(), ttl=3600)
+    store = BlockOrderStore(index, lambda: registry.sheet('Заказы'), lambda batch: batch.flush(), TOTAL_FORMAT)
+    return store, worksheet
+
+
+def assert_blocks_match_sheet(store, worksheet):
+    # Индекс совпадает с листом, а итог каждого заказа — с суммой его строк
+    index = store.index
+    assert trimmed(index.rows) == trimmed(worksheet.values())
+    fresh = OrderIndex(worksheet.values, ttl=3600)
+    assert index.order_names() == fresh.order_names()
+    for name in fresh.order_names():
+        block, fresh_block = index.find(name), fresh.find(name)
+        assert (block.start_row, block.end_row, block.total_row) == \
+               (fresh_block.start_row, fresh_block.end_row, fresh_block.total_row)
+        assert index.total(block) == fresh.compute_total(fresh_block)
+
+
+def test_block_item_changes_keep_totals(block_store):
+    store, worksheet = block_store
+    store.add_item(store.find('Первый'), ['', '🛒 Гофра', 3, Decimal('2.5'), Decimal('7.5')])
+    assert store.index.total(store.find('Первый')) == Decimal('43')
+    store.set_quantity(store.find('Первый'), 1, 5, Decimal(50))
+    store.delete_item(store.find('Первый'), 2)
+    assert store.index.total(store.find('Первый')) == Decimal('57.5')
+    assert_blocks_match_sheet(store, worksheet)
+
+
+def test_block_without_total_row(block_store):
+    # У заказа нет строки "Итого": суммы строк не затираются итогом
+    store, worksheet = block_store
+    store.set_quantity(store.find('Без итога'), 1, 3, Decimal(30))
+    assert worksheet.values()[6] == ['', '🛒 Розетка', '3', '10', '30']
+    assert worksheet.values()[7] == ['', '🛒 Провод', '3', '10', '30']
+    assert store.check_total(store.find('Без итога')) is None
+    store.add_item(store.find('Без итога'), ['', '🛒 Лампа', 1, 15, 15])
+    block = store.find('Без итога')
+    assert block.total_row is not None
+    assert store.index.total(block) == Decimal(75)
+    assert_blocks_match_sheet(store, worksheet)
+
+
+def test_block_create_and_delete_shift_other_orders(block_store):
+    store, worksheet = block_store
+    items = [['', '🛒 Кабель', 1, 10, 10], ['', '🛒 Лампа', 2, Decimal('15.5'), Decimal(31)]]
+    order = store.create('Новый', items, Decimal(41))
+    assert store.order_rows(order)[-1][3:] == ['Итого', '41']
+    store.delete(store.find('Первый'))
+    assert store.find('Первый') is None
+    store.add_item(store.find('Последний'), ['', '🛒 Провод', 1, 10, 10])
+    assert store.index.total(store.find('Последний')) == Decimal(110)
+    assert_blocks_match_sheet(store, worksheet)
+
+
+def test_block_check_total_fixes_edited_sheet(block_store):
+    store, worksheet = block_store
+    block = store.find('Первый')
+    worksheet.rows[4][4] = '999'  # Итог исправили в таблице вручную, индекс об этом не знает
+    assert store.check_total(block) == (Decimal(999), Decimal('35.5'))
+    assert worksheet.values()[4][4] == '35.5'
+    assert store.check_total(store.find('Первый')) == (Decimal('35.5'), Decimal('35.5'))
+    assert_blocks_match_sheet(store, worksheet)
+
+
+def test_block_create_grows_full_grid(block_store):
+    store, worksheet = block_store
+    worksheet.grid_rows = len(BLOCK_ROWS)  # Под данными не осталось пустых строк
+    store.create('Новый', [['', '🛒 Кабель', 1, 10, 10]], Decimal(10))
+    assert worksheet.grid_rows == len(BLOCK_ROWS) + 3
+    assert_blocks_match_sheet(store, worksheet)
+
+
+@pytest.fixture
+def flat_store(spreadsheet, registry):
+    # Перенос из блоков, как его запишет таблица (значения — текстом)
+    rows = [[str(value) for value in row] for row in flat_rows_from_blocks(BLOCK_ROWS)]
+    worksheet = spreadsheet.add_sheet('Строки заказов', rows)
+    index = FlatOrderIndex(lambda: registry.sheet('Строки заказов').get_all_values(), ttl=3600)
+    store = FlatOrderStore(index, lambda: registry.sheet('Строки заказов'), lambda batch: batch.flush())
+    return store, worksheet
+
+
+def assert_flat_matches_sheet(store, worksheet):
+    index = store.index
+    assert trimmed(index.rows) == trimmed(worksheet.values())
+    fresh = FlatOrderIndex(worksheet.values, ttl=3600)
+    assert index.order_names() == fresh.order_names()
+    for name in fresh.order_names():
+        order, fresh_order = index.find(name), fresh.find(name)
+        assert (order.order_id, order.rows, order.lines) == (fresh_order.order_id, fresh_order.rows, fresh_order.lines)
+        assert order.total == fresh_order.total == fresh.compute_total(fresh_order)
+
+
+def test_flat_migration_keeps_orders(flat_store):
+    store, worksheet = flat_store
+    assert store.order_names() == ['Первый', 'Без итога', 'Последний']
+    assert store.find('Первый').total == Decimal('35.5')
+    assert store.find('Без итога').total == Decimal(70)
+    assert store.order_rows(store.find('Последний')) == [
+        ['📋 Последний', '', '', '', ''], ['', '🛒 Щиток', '1', '100', '100'], ['', '', '', 'Итого', '100']]
+
+
+def test_flat_item_changes_keep_totals(flat_store):
+    store, worksheet = flat_store
+    store.add_item(store.find('Первый'), ['', '🛒 Гофра', 3, Decimal('2.5'), Decimal('7.5')])
+    store.set_quantity(store.find('Первый'), 1, 5, Decimal(50))
+    store.delete_item(store.find('Первый'), 2)
+    assert store.find('Первый').total == Decimal('57.5')
+    assert [row[2] for row in store.order_rows(store.find('Первый'))[1:-1]] == ['5', '3']
+    assert_flat_matches_sheet(store, worksheet)
+
+
+def test_flat_create_and_delete(flat_store):
+    store, worksheet = flat_store
+    order = store.create('Новый', [['', '🛒 Кабель', 1, 10, 10]], Decimal(10))
+    assert order.order_id == '4'
+    assert store.order_rows(order)[-1][3:] == ['Итого', '10']
+    store.delete(store.find('Без итога'))
+    assert store.find('Без итога') is None
+    # Номер удалённого заказа не достаётся новому
+    assert store.create('Ещё', []).order_id == '5'
+    assert_flat_matches_sheet(store, worksheet)
+
+
+def test_flat_rows_are_written_where_index_expects(flat_store):
+    store, worksheet = flat_store
+    worksheet.grid_rows = len(worksheet.rows)  # Под данными не осталось пустых строк
+    order = store.create('Новый', [['', '🛒 Кабель', 1, 10, 10]])
+    store.add_item(store.find('Первый'), ['', '🛒 Гофра', 3, Decimal('2.5'), Decimal('7.5')])
+    assert order.rows == [len(worksheet.rows) - 2, len(worksheet.rows) - 1]
+    assert worksheet.values()[-1][:3] == ['1', 'Первый', 'Гофра']
+    assert worksheet.grid_rows == len(worksheet.rows)
+    assert_flat_matches_sheet(store, worksheet)
+
+
+def test_flat_check_total_rereads_sheet(flat_store):
+    store, worksheet = flat_store
+    order = store.find('Первый')
+    assert store.check_total(order) == (Decimal('35.5'), Decimal('35.5'))
+    row = worksheet.rows[order.lines[0] - 1]
+    row[3], row[5] = '3', '30'  # Количество исправили в таблице вручную
+    assert store.check_total(store.find('Первый')) == (Decimal('35.5'), Decimal('45.5'))
+    assert store.find('Первый').total == Decimal('45.5')
+    worksheet.rows[order.rows[0] - 1][6] = DELETED_MARK
+    for row_num in order.lines:
+        worksheet.rows[row_num - 1][6] = DELETED_MARK
+    assert store.check_total(order) is None
+
+
+def test_flat_duplicate_name_survives_delete(flat_store):
+    store, worksheet = flat_store
+    second = store.create('Первый', [['', '🛒 Кабель', 1, 10, 10]])
+    store.delete(store.find('Первый'))
+    assert store.find('Первый') is second
+    assert_flat_matches_sheet(store, worksheet)
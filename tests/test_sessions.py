@@ -0,0 +1,98 @@
+import time
+from array import array
+
+import pytest
+
+import sessions
+from sessions import SessionStore, SqliteSessionBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Часы только для модуля sessions: время сессий двигает тест
+    clock = FakeClock()
+    monkeypatch.setattr(sessions, 'time', clock)
+    return clock
+
+
+def test_least_recently_used_session_is_evicted():
+    store = SessionStore(max_sessions=2)
+    store[1] = 'waiting_for_search'
+    store[2] = {'state': 'searching'}
+    assert store.get(1) == 'waiting_for_search'  # Чат 1 снова свежий
+    store[3] = 'waiting_for_neworder'
+    assert len(store) == 2
+    assert 2 not in store
+    assert 1 in store and 3 in store
+
+
+def test_idle_session_expires(clock):
+    store = SessionStore(ttl=10)
+    store[1] = 'waiting_for_search'
+    clock.now += 9
+    assert store.get(1) == 'waiting_for_search'
+    clock.now += 11
+    assert 1 not in store
+    assert store.get(1, 'menu') == 'menu'
+
+
+def test_expire_sweeps_abandoned_sessions(clock):
+    store = SessionStore(ttl=10)
+    store[1] = 'waiting_for_search'
+    store[2] = 'waiting_for_import'
+    clock.now += 6
+    store.get(2)
+    clock.now += 6
+    store.expire()
+    assert len(store) == 1
+    assert store.get(2) == 'waiting_for_import'
+
+
+def test_sessions_survive_restart_and_eviction(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    store = SessionStore(SqliteSessionBackend(path), max_sessions=1)
+    store[1] = {'state': 'searching', 'results': array('I', [5, 7, 9]), 'index': 1}
+    store.commit(1)
+    store[2] = 'waiting_for_search'
+    store.commit(2)
+    assert len(store) == 1
+    # Вытесненная из памяти сессия подгружается с диска
+    assert store.get(1)['results'] == array('I', [5, 7, 9])
+
+    restarted = SessionStore(SqliteSessionBackend(path))
+    assert restarted.get(1) == {'state': 'searching', 'results': array('I', [5, 7, 9]), 'index': 1}
+    assert restarted.get(2) == 'waiting_for_search'
+
+
+def test_deleted_session_is_removed_from_backend(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    store = SessionStore(SqliteSessionBackend(path))
+    store[1] = 'waiting_for_search'
+    store.commit(1)
+    del store[1]
+    assert SessionStore(SqliteSessionBackend(path)).get(1) is None
+
+
+def test_stored_session_expires_on_disk(tmp_path, clock):
+    path = str(tmp_path / 'sessions.db')
+    store = SessionStore(SqliteSessionBackend(path), ttl=10)
+    store[1] = 'waiting_for_search'
+    store.commit(1)
+    clock.now += 11
+    assert SessionStore(SqliteSessionBackend(path), ttl=10).get(1) is None
+
+
+def test_unsupported_value_is_rejected():
+    with pytest.raises(TypeError):
+        sessions.dump_state({'when': time})
@@ -0,0 +1,75 @@
+import pytest
+from gspread.exceptions import APIError
+from gspread_formatting import CellFormat, TextFormat, format_cell_range, set_column_width
+
+import sheets
+from fake_services import FakeClient, FakeResponse
+from sheets import WorksheetRegistry
+
+
+def quota_error():
+    return APIError(FakeResponse(429, {'error': {'code': 429, 'message': 'Quota exceeded (fake)', 'status': 'RESOURCE_EXHAUSTED'}}))
+
+
+def server_error():
+    return APIError(FakeResponse(503, {'error': {'code': 503, 'message': 'Backend error (fake)', 'status': 'UNAVAILABLE'}}))
+
+
+@pytest.fixture
+def retrying_registry(spreadsheet, monkeypatch):
+    monkeypatch.setattr(sheets, 'backoff_delay', lambda *args, **kwargs: 0)
+    return WorksheetRegistry('test', lambda: FakeClient(spreadsheet), requests_per_minute=60000, max_retries=2)
+
+
+def fail_first(spreadsheet, method, error):
+    # Первый вызов метода таблицы падает с error, следующие проходят
+    original = getattr(spreadsheet, method)
+    calls = []
+
+    def call(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise error
+        return original(*args, **kwargs)
+    setattr(spreadsheet, method, call)
+    return calls
+
+
+def test_new_sheet_id_skips_existing_sheets(spreadsheet, registry, monkeypatch):
+    spreadsheet.add_sheet('Лист', [['a']])
+    spreadsheet.add_sheet('Другой', [['b']])
+    candidates = iter([2, 1, 77])
+    monkeypatch.setattr(sheets.random, 'randrange', lambda start, stop: next(candidates))
+    assert registry.new_sheet_id() == 77
+
+
+def test_formatting_goes_through_registry(spreadsheet, retrying_registry):
+    # gspread_formatting пишет через worksheet.spreadsheet: запрос повторяется после 429
+    spreadsheet.add_sheet('Лист', [['a']])
+    calls = fail_first(spreadsheet, 'batch_update', quota_error())
+    worksheet = retrying_registry.sheet('Лист')
+    format_cell_range(worksheet, 'A1:B1', CellFormat(textFormat=TextFormat(bold=True)))
+    assert len(calls) == 2
+    set_column_width(worksheet, 'A', 200)
+    assert len(calls) == 3
+
+
+def test_spreadsheet_write_is_not_retried_after_server_error(spreadsheet, retrying_registry):
+    # После 5xx запись могла пройти: повторяется только чтение
+    spreadsheet.add_sheet('Лист', [['a']])
+    worksheet = retrying_registry.sheet('Лист')
+    calls = fail_first(spreadsheet, 'batch_update', server_error())
+    with pytest.raises(APIError):
+        worksheet.spreadsheet.batch_update({'requests': []})
+    assert len(calls) == 1
+    calls = fail_first(spreadsheet, 'fetch_sheet_metadata', server_error())
+    assert worksheet.spreadsheet.fetch_sheet_metadata() == {'developerMetadata': []}
+    assert len(calls) == 2
+
+
+def test_add_worksheet_retries_quota_errors(spreadsheet, retrying_registry):
+    calls = fail_first(spreadsheet, 'add_worksheet', quota_error())
+    worksheet = retrying_registry.add_worksheet('Новый', 100, 5)
+    assert len(calls) == 2
+    assert worksheet.get_all_values() == []
+    assert [sheet.title for sheet in spreadsheet.worksheets_list] == ['Новый']
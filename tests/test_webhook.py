@@ -0,0 +1,108 @@
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from webhook import WebhookApp, make_webhook_server
+
+SECRET = 'test-secret'
+
+
+def recorded_update(update_id, text='/start', chat_id=5):
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': text,
+        'chat': {'id': chat_id, 'type': 'private'}, 'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'}}}
+
+
+def call(app, body, secret=SECRET, path='/telegram', method='POST'):
+    data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': method, 'CONTENT_LENGTH': str(len(data)),
+               'wsgi.input': io.BytesIO(data)}
+    if secret is not None:
+        environ['HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN'] = secret
+    statuses = []
+    app(environ, lambda status, headers: statuses.append(status))
+    return statuses[0]
+
+
+@pytest.fixture
+def received():
+    return []
+
+
+@pytest.fixture
+def app(received):
+    return WebhookApp(received.append, SECRET)
+
+
+def test_secret_is_required():
+    with pytest.raises(ValueError):
+        WebhookApp(lambda update: None, None)
+    with pytest.raises(ValueError):
+        WebhookApp(lambda update: None, '')
+
+
+def test_update_with_secret_is_submitted(app, received):
+    assert call(app, recorded_update(1)) == '200 OK'
+    assert [update.update_id for update in received] == [1]
+    assert received[0].message.text == '/start'
+
+
+@pytest.mark.parametrize('secret', [None, '', 'wrong'])
+def test_wrong_secret_is_rejected(app, received, secret):
+    assert call(app, recorded_update(1), secret=secret) == '403 Forbidden'
+    assert received == []
+
+
+def test_redelivered_update_is_skipped(app, received):
+    assert call(app, recorded_update(1)) == '200 OK'
+    assert call(app, recorded_update(2)) == '200 OK'
+    assert call(app, recorded_update(1)) == '200 OK'  # Telegram не должен слать его снова
+    assert [update.update_id for update in received] == [1, 2]
+
+
+def test_remembered_ids_are_bounded(received):
+    app = WebhookApp(received.append, SECRET, remember=2)
+    for update_id in (1, 2, 3, 1):
+        call(app, recorded_update(update_id))
+    assert [update.update_id for update in received] == [1, 2, 3, 1]
+    assert len(app.recent_set) == 2
+
+
+@pytest.mark.parametrize('body', [b'null', b'not json', b'[1, 2]', b''])
+def test_malformed_body_is_rejected(app, received, body):
+    assert call(app, body) == '400 Bad Request'
+    assert received == []
+
+
+def test_wrong_path_and_method(app, received):
+    assert call(app, recorded_update(1), path='/other') == '404 Not Found'
+    assert call(app, recorded_update(1), method='GET') == '405 Method Not Allowed'
+    assert received == []
+
+
+def test_recorded_update_posted_to_server(app, received):
+    # Как при проверке вручную: POST записанного апдейта на запущенный сервер
+    server = make_webhook_server(app, '127.0.0.1', 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f'http://127.0.0.1:{server.server_port}/telegram'
+
+    def post(secret):
+        request = urllib.request.Request(url, data=json.dumps(recorded_update(7)).encode('utf-8'), headers={
+            'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret})
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    try:
+        assert post('wrong') == 403
+        assert post(SECRET) == 200
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert [update.update_id for update in received] == [7]
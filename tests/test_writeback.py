@@ -0,0 +1,208 @@
+import pytest
+from gspread.exceptions import APIError
+
+from fake_services import FakeResponse
+from sheets import SheetBatch
+from writeback import JOURNAL_KEY_PREFIX, WriteBehindQueue
+
+
+def server_error():
+    return APIError(FakeResponse(503, {'error': {'code': 503, 'message': 'Backend error (fake)', 'status': 'UNAVAILABLE'}}))
+
+
+def submit_cell(queue, registry, row, value):
+    batch = SheetBatch(registry.sheet('Лист'))
+    batch.update_cell(row, 1, value)
+    return queue.submit(batch)
+
+
+def submit_insert(queue, registry, row, value):
+    batch = SheetBatch(registry.sheet('Лист'))
+    batch.insert_row([value], row)
+    return queue.submit(batch)
+
+
+def flush_all(queue):
+    while queue.flush_once():
+        pass
+
+
+def marker_value(spreadsheet, queue):
+    values = [item['metadataValue'] for item in spreadsheet.metadata if item['metadataKey'] == queue.marker_key]
+    assert len(values) == 1
+    return int(values[0])
+
+
+def test_flush_writes_batches_and_marker(spreadsheet, registry, tmp_path):
+    worksheet = spreadsheet.add_sheet('Лист', [['a']])
+    queue = WriteBehindQueue(registry, str(tmp_path / 'writes.journal'))
+    first = submit_cell(queue, registry, 2, 'x')
+    last = submit_cell(queue, registry, 3, 'y')
+    assert queue.pending_count() == 2
+    assert not queue.wait(last, 0)
+
+    queue.recover()
+    flush_all(queue)
+    assert worksheet.values() == [['a'], ['x'], ['y']]
+    assert queue.wait(first, 0) and queue.wait(last, 0)
+    assert queue.pending_count() == 0
+    assert marker_value(spreadsheet, queue) == last
+    assert queue.marker_key.startswith(JOURNAL_KEY_PREFIX)
+    queue.journal.close()
+
+
+def test_empty_batch_is_not_journaled(registry, spreadsheet, tmp_path):
+    spreadsheet.add_sheet('Лист', [['a']])
+    queue = WriteBehindQueue(registry, str(tmp_path / 'writes.journal'))
+    assert queue.submit(SheetBatch(registry.sheet('Лист'))) is None
+    assert queue.pending_count() == 0
+    queue.journal.close()
+
+
+def test_pending_batches_replay_after_restart(spreadsheet, registry, tmp_path):
+    worksheet = spreadsheet.add_sheet('Лист', [['a']])
+    path = str(tmp_path / 'writes.journal')
+    queue = WriteBehindQueue(registry, path)
+    submit_cell(queue, registry, 2, 'x')
+    submit_cell(queue, registry, 3, 'y')
+    marker_key = queue.marker_key
+    queue.journal.close()  # Процесс упал, ничего не отправив
+
+    queue = WriteBehindQueue(registry, path)
+    assert queue.marker_key == marker_key
+    assert queue.pending_count() == 2
+    queue.recover()
+    flush_all(queue)
+    assert worksheet.values() == [['a'], ['x'], ['y']]
+    queue.journal.close()
+
+    # Всё записано: после следующего перезапуска повторять нечего
+    queue = WriteBehindQueue(registry, path)
+    assert queue.pending_count() == 0
+    queue.journal.close()
+
+
+def test_batches_applied_before_crash_are_not_replayed(spreadsheet, registry, tmp_path):
+    # Таблица приняла batchUpdate, но отметка "done" в журнал не попала: вставка не должна повториться
+    worksheet = spreadsheet.add_sheet('Лист', [['a'], ['b']])
+    path = str(tmp_path / 'writes.journal')
+    queue = WriteBehindQueue(registry, path)
+    submit_insert(queue, registry, 2, 'x')
+    queue.recover()
+    entries = list(queue.pending)
+    registry.batch_update(lambda: queue._body(entries))
+    queue.journal.close()
+
+    queue = WriteBehindQueue(registry, path)
+    assert queue.pending_count() == 1
+    queue.recover()
+    assert queue.pending_count() == 0
+    assert not queue.flush_once()
+    assert worksheet.values() == [['a'], ['x'], ['b']]
+    queue.journal.close()
+
+
+def test_lost_response_is_checked_against_marker(spreadsheet, registry, tmp_path):
+    # Запись прошла, но ответ потерялся (5xx): повтор не отправляется, пока не сверились с меткой
+    worksheet = spreadsheet.add_sheet('Лист', [['a'], ['b']])
+    queue = WriteBehindQueue(registry, str(tmp_path / 'writes.journal'))
+    queue.recover()
+    submit_insert(queue, registry, 2, 'x')
+    apply = spreadsheet.batch_update
+
+    def applied_without_response(body):
+        apply(body)
+        raise server_error()
+    spreadsheet.batch_update = applied_without_response
+    with pytest.raises(APIError):
+        queue.flush_once()
+    del spreadsheet.batch_update
+    assert queue.pending_count() == 1
+
+    queue.recover()
+    assert not queue.flush_once()
+    assert worksheet.values() == [['a'], ['x'], ['b']]
+    queue.journal.close()
+
+
+def test_rejected_batch_is_skipped_and_reported(spreadsheet, registry, tmp_path):
+    # Таблица не принимает пакет (400): он пропускается, следующие записываются, об ошибке сообщает on_failed
+    worksheet = spreadsheet.add_sheet('Лист', [['a']])
+    failed = []
+    queue = WriteBehindQueue(registry, str(tmp_path / 'writes.journal'),
+                             on_failed=lambda entry, error: failed.append((entry['seq'], type(error))))
+    queue.recover()
+    rejected = submit_cell(queue, registry, 2, 'x')
+    accepted = submit_cell(queue, registry, 3, 'y')
+    apply = spreadsheet.batch_update
+
+    def reject_first(body):
+        if any('updateCells' in request and request['updateCells']['start']['rowIndex'] == 1
+               for request in body['requests']):
+            raise APIError(FakeResponse(400, {'error': {'code': 400, 'message': 'Invalid request (fake)',
+                                                        'status': 'INVALID_ARGUMENT'}}))
+        return apply(body)
+    spreadsheet.batch_update = reject_first
+    flush_all(queue)
+    del spreadsheet.batch_update
+    assert failed == [(rejected, APIError)]
+    assert queue.wait(accepted, 0)
+    assert worksheet.values() == [['a'], [], ['y']]
+    assert queue.stats()['failed'] == 1
+    queue.journal.close()
+
+
+def test_marker_is_created_once_per_journal(spreadsheet, registry, tmp_path):
+    spreadsheet.add_sheet('Лист', [['a']])
+    path = str(tmp_path / 'writes.journal')
+    queue = WriteBehindQueue(registry, path)
+    queue.recover()
+    queue.journal.close()
+    queue = WriteBehindQueue(registry, path)
+    queue.recover()
+    assert marker_value(spreadsheet, queue) == 0
+    queue.journal.close()
+
+
+def test_torn_last_line_is_ignored(spreadsheet, registry, tmp_path):
+    worksheet = spreadsheet.add_sheet('Лист', [['a']])
+    path = str(tmp_path / 'writes.journal')
+    queue = WriteBehindQueue(registry, path)
+    submit_cell(queue, registry, 2, 'x')
+    queue.journal.close()
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write('{"seq":2,"title":"Лист"')  # Падение посреди записи строки
+
+    queue = WriteBehindQueue(registry, path)
+    assert [entry['seq'] for entry in queue.pending] == [1]
+    queue.recover()
+    flush_all(queue)
+    assert worksheet.values() == [['a'], ['x']]
+    queue.journal.close()
+
+
+def test_compaction_keeps_only_pending_batches(spreadsheet, registry, tmp_path):
+    spreadsheet.add_sheet('Лист', [['a']])
+    path = str(tmp_path / 'writes.journal')
+    queue = WriteBehindQueue(registry, path, max_batch=1, compact_every=2)
+    queue.recover()
+    for row in range(2, 5):
+        submit_cell(queue, registry, row, row)
+    queue.flush_once()
+    queue.flush_once()  # Второй записанный пакет — сжатие журнала
+    with open(path, encoding='utf-8') as file:
+        assert len(file.read().splitlines()) == 3  # Номер журнала, отметка "done" и оставшийся пакет
+    queue.journal.close()
+
+    queue = WriteBehindQueue(registry, path)
+    assert [entry['seq'] for entry in queue.pending] == [3]
+    queue.journal.close()
+
+
+def test_journal_is_owned_by_one_process(registry, tmp_path):
+    path = str(tmp_path / 'writes.journal')
+    queue = WriteBehindQueue(registry, path)
+    with pytest.raises(RuntimeError):
+        WriteBehindQueue(registry, path)
+    queue.journal.close()
+    WriteBehindQueue(registry, path).journal.close()
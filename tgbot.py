@@ -1,25 +1,120 @@
 import telebot
-from telebot import types
+from telebot import types, apihelper
 import gspread
+import requests
 from oauth2client.service_account import ServiceAccountCredentials
-import pandas as pd
+from openpyxl import Workbook
 import os
+import html
 import json
+import secrets
+import tempfile
+from array import array
+from itertools import chain, groupby
 from gspread_formatting import *
 from datetime import datetime
+from decimal import Decimal
 import time
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from warehouse import WarehouseCache
+from search import SearchCache
+from sheets import WorksheetRegistry, SheetBatch, backoff_delay, build_requests, is_rate_limited, is_transient_error
+from dispatcher import ChatDispatcher, update_chat_id
+from sessions import SessionStore, SqliteSessionBackend, RedisSessionBackend
+from coordination import LocalLocks, RedisLocks
+from numeric import WarehouseColumns, parse_money, parse_number, parse_numbers
+from orders import OrderIndex, FlatOrderIndex, FLAT_HEADER, flat_rows_from_blocks
+from order_store import BlockOrderStore, FlatOrderStore
+from sync import SheetSync
+from mirror import SheetMirror
+from writeback import WriteBehindQueue
+from render import FrozenKeyboard, RenderCache
+from metrics import Metrics, MetricsApp, metered_http_client, telegram_sender
+from order_import import ImportFileError, parse_order_file, resolve_lines, check_stock, format_errors
 
 # Чтение конфигурации из переменных окружения
 TOKEN = os.getenv("TOKEN")
 SPREADSHEET_ID = os.getenv("SPREADSHEET_ID")
+WAREHOUSE_CACHE_TTL = int(os.getenv("WAREHOUSE_CACHE_TTL", "60"))  # Сколько секунд живёт снимок листа "СКЛАД"
+ORDERS_CACHE_TTL = int(os.getenv("ORDERS_CACHE_TTL", "60"))  # Через сколько секунд индекс заказов перечитывает лист "Заказы"
+ORDERS_LAYOUT = os.getenv("ORDERS_LAYOUT", "blocks")  # "blocks" — заказы блоками на листе "Заказы", "flat" — строка на товар на листе "Строки заказов"
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "8"))  # Сколько апдейтов обрабатывается параллельно
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "1000"))  # Предел очереди необработанных апдейтов
+UPDATE_SOURCE = os.getenv("UPDATE_SOURCE", "polling")  # "polling" — getUpdates, "webhook" — встроенный HTTP-сервер
+BOT_RUNTIME = os.getenv("BOT_RUNTIME", "threads")  # "threads" — запросы к Bot API из потоков обработчиков, "async" — через цикл asyncio (AsyncTeleBot, aiohttp)
+TELEGRAM_CONNECTIONS = int(os.getenv("TELEGRAM_CONNECTIONS", "100"))  # Соединений с Bot API в режиме async
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Публичный адрес webhook для Telegram (без него webhook не регистрируется)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Сверяется с заголовком X-Telegram-Bot-Api-Secret-Token
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")  # "memory" — только в памяти, "sqlite" — ещё и в файле, "redis" — в общем Redis
+SESSION_DB = os.getenv("SESSION_DB", "sessions.db")  # Файл сессий для SESSION_STORE=sqlite
+SESSION_TTL = int(os.getenv("SESSION_TTL", "86400"))  # Через сколько секунд простоя сессия удаляется
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))  # Сколько сессий держать в памяти
+INLINE_PAGE_SIZE = min(int(os.getenv("INLINE_PAGE_SIZE", "20")), 50)  # Результатов на страницу inline-выдачи (Telegram разрешает до 50)
+INLINE_CACHE_TTL = int(os.getenv("INLINE_CACHE_TTL", "30"))  # Сколько секунд помнить результаты inline-запроса
+SHEETS_REQUESTS_PER_MINUTE = int(os.getenv("SHEETS_REQUESTS_PER_MINUTE", "60"))  # Квота Sheets API на сервисный аккаунт
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", "5"))  # Повторов запроса к таблице при 429/5xx
+SHEET_SYNC_INTERVAL = int(os.getenv("SHEET_SYNC_INTERVAL", "5"))  # Раз в сколько секунд проверять изменения таблицы (0 — только по TTL)
+MIRROR_DB = os.getenv("MIRROR_DB", "")  # Локальная копия листов в SQLite, с неё бот стартует ("" — не вести)
+MIRROR_INTERVAL = int(os.getenv("MIRROR_INTERVAL", "2"))  # Раз в сколько секунд сохранять изменения снимков в копию
+WRITE_JOURNAL = os.getenv("WRITE_JOURNAL", "")  # Журнал отложенной записи в таблицу ("" — писать сразу); у каждого процесса свой
+WRITE_BATCH = int(os.getenv("WRITE_BATCH", "50"))  # Сколько пакетов изменений отправлять одним batchUpdate
+REDIS_URL = os.getenv("REDIS_URL")  # Общий Redis для нескольких процессов бота: блокировки записи и сессии
+LOCK_TIMEOUT = int(os.getenv("LOCK_TIMEOUT", "60"))  # Через сколько секунд блокировка упавшего процесса снимается сама
+IMPORT_MAX_FILE_SIZE = int(os.getenv("IMPORT_MAX_FILE_SIZE", str(1024 * 1024)))  # Предел размера файла заказа для импорта, байт
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Порт адреса /metrics для Prometheus (0 — не открывать)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_TRACE = os.getenv("METRICS_TRACE", "")  # Файл трассировки: JSON-строка на каждый апдейт со всеми запросами к API ("" — не писать)
+DISPATCH_STATS_INTERVAL = int(os.getenv("DISPATCH_STATS_INTERVAL", "0"))  # Раз в сколько секунд писать статистику пула (0 — не писать)
 
 # Проверка, что переменные установлены
 if not TOKEN or not SPREADSHEET_ID:
     print("Ошибка: переменные окружения TOKEN и SPREADSHEET_ID должны быть установлены!")
     exit(1)
 
-# Инициализация бота
-bot = telebot.TeleBot(TOKEN)
+# Webhook без секрета принимает апдейты от любого, кто достучится до порта. Если webhook
+# регистрирует сам бот (WEBHOOK_URL), секрет создаётся на этот запуск, иначе его нужно задать
+if UPDATE_SOURCE == "webhook" and not WEBHOOK_SECRET:
+    if not WEBHOOK_URL:
+        print("Ошибка: для UPDATE_SOURCE=webhook без WEBHOOK_URL нужна переменная WEBHOOK_SECRET — тот же секрет, что при регистрации webhook!")
+        exit(1)
+    WEBHOOK_SECRET = secrets.token_urlsafe(32)
+
+# Задержки обработчиков и учёт запросов к Sheets и Telegram по действиям пользователей
+metrics = Metrics(METRICS_TRACE or None)
+
+# Запросы к Bot API — через одну сессию с пулом соединений на все потоки обработчиков, с учётом в metrics.
+# В режиме async сессия — цикл asyncio с aiohttp: обработчики отдают ему запросы и ждут ответа
+if BOT_RUNTIME == "async":
+    try:
+        from async_runtime import AsyncRuntime
+    except ImportError:
+        print("Ошибка: для BOT_RUNTIME=async нужен пакет aiohttp (pip install aiohttp)!")
+        exit(1)
+    telegram_runtime = AsyncRuntime(TOKEN, TELEGRAM_CONNECTIONS, metrics)
+    telegram_session = telegram_runtime
+else:
+    telegram_session = requests.Session()
+    telegram_session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=WORKER_THREADS))
+apihelper.CUSTOM_REQUEST_SENDER = telegram_sender(metrics, telegram_session)
+
+# Пул обработчиков с очередью на каждый чат
+dispatcher = ChatDispatcher(WORKER_THREADS, MAX_PENDING_UPDATES)
+
+class ChatDispatchingTeleBot(telebot.TeleBot):
+    def process_new_updates(self, updates):
+        for update in updates:
+            # Смещение сдвигаем сразу, иначе polling получит эти апдейты повторно
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            dispatcher.submit(update_chat_id(update), handle_update, update)
+
+# Инициализация бота (обработчики выполняются в пуле dispatcher)
+bot = ChatDispatchingTeleBot(TOKEN, threaded=False)
 
 # Настройка командного меню
 def set_bot_commands():
@@ -34,28 +129,193 @@ def set_bot_commands():
 scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
 credentials_json = os.environ.get('GOOGLE_CREDENTIALS')
 creds_dict = json.loads(credentials_json)
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-client = gspread.authorize(creds)
+
+def authorize_client():
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+    return gspread.authorize(creds, http_client=metered_http_client(metrics))
+
+# Таблица и листы открываются один раз и переоткрываются только при ошибках
+registry = WorksheetRegistry(SPREADSHEET_ID, authorize_client, SHEETS_REQUESTS_PER_MINUTE, SHEETS_MAX_RETRIES, metrics)
+
+# Блокировки: внутри процесса или, с REDIS_URL, общие для всех процессов бота
+if REDIS_URL:
+    try:
+        import redis
+    except ImportError:
+        print("Ошибка: для REDIS_URL нужен пакет redis (pip install redis)!")
+        exit(1)
+    redis_client = redis.Redis.from_url(REDIS_URL)
+    coordination = RedisLocks(redis_client, LOCK_TIMEOUT)
+else:
+    redis_client = None
+    coordination = LocalLocks()
 
 # Состояния пользователей
-user_states = {}
+if SESSION_STORE == "redis":
+    if redis_client is None:
+        print("Ошибка: для SESSION_STORE=redis нужна переменная окружения REDIS_URL!")
+        exit(1)
+    session_backend = RedisSessionBackend(redis_client, SESSION_TTL)
+elif SESSION_STORE == "sqlite":
+    session_backend = SqliteSessionBackend(SESSION_DB)
+else:
+    session_backend = None
+user_states = SessionStore(session_backend, MAX_SESSIONS, SESSION_TTL)
+
+@contextmanager
+def chat_lock(chat_id):
+    # Апдейты одного чата в разных процессах — по очереди, сессия читается заново из общего хранилища.
+    # В одном процессе очередь чата и так держит dispatcher
+    if not coordination.shared or chat_id is None:
+        yield
+        return
+    with coordination.lock(f'chat:{chat_id}'):
+        user_states.forget(chat_id)
+        yield
+
+def user_error_text(e):
+    # Текст ошибки для пользователя: перегрузку таблицы объясняем, а не показываем ответ API
+    if is_rate_limited(e):
+        return "⏳ Таблица сейчас перегружена запросами. Подожди минуту и попробуй снова!"
+    if is_transient_error(e):
+        return "⏳ Google Таблицы сейчас не отвечают. Подожди минуту и попробуй снова!"
+    return f"❌ Ошибка: {str(e)}. Попробуй снова!"
+
+# Кнопки с данными в callback_data (название заказа, страница): в метриках — только начало
+CALLBACK_PREFIXES = ('select_order_', 'select_item_', 'prev_orders_', 'next_orders_', 'prev_items_', 'next_items_')
+COMMANDS = ('start', 'search', 'export')
+
+def update_action(update, chat_id):
+    # Действие пользователя для метрик: кнопка, команда или шаг диалога (без названий и чисел)
+    if update.callback_query is not None:
+        data = update.callback_query.data or ''
+        prefix = next((prefix for prefix in CALLBACK_PREFIXES if data.startswith(prefix)), None)
+        if prefix is not None:
+            return f"callback:{prefix.rstrip('_')}"
+        return f"callback:{data}" if data.replace('_', '').isalpha() and data.isascii() and len(data) <= 32 else "callback:other"
+    if update.inline_query is not None:
+        return "inline"
+    message = update.message
+    if message is None:
+        return "other"
+    if message.content_type == 'document':
+        return "document"
+    if message.text and message.text.startswith('/'):
+        command = message.text.split()[0][1:].split('@')[0]
+        return f"command:{command if command in COMMANDS else 'other'}"
+    state = user_states.get(chat_id)
+    if isinstance(state, dict):
+        step = next((key for key in ('edit_action', 'waiting_for_add', 'waiting_for_qty') if key in state), None)
+        return f"message:{state.get('state')}" + (f":{step}" if step else "")
+    return f"message:{state or 'menu'}"
+
+def handle_update(update):
+    # Обработчики бота для одного апдейта, затем сохранение сессии чата
+    chat_id = update_chat_id(update)
+    with chat_lock(chat_id):
+        with metrics.action(update_action(update, chat_id), chat=chat_id):
+            try:
+                telebot.TeleBot.process_new_updates(bot, [update])
+            except Exception as e:
+                # Квота и сбои Google после всех повторов: сообщаем в чат, остальное — в лог диспетчера
+                if not is_transient_error(e) or chat_id is None or update.inline_query is not None:
+                    raise
+                bot.send_message(chat_id, user_error_text(e), reply_markup=create_main_menu())
+            finally:
+                user_states.commit(chat_id)
+
+# Номер последней записи в "Заказы", после которой индекс заказов совпадает с листом
+orders_seen_version = [coordination.get_version('orders')]
+
+@contextmanager
+def orders_write():
+    # Запись в лист "Заказы" из разных чатов и процессов по очереди, иначе сдвигаются номера строк.
+    # Если лист успел изменить другой процесс, индекс заказов перечитывается до записи
+    with coordination.lock('orders'):
+        if coordination.get_version('orders') != orders_seen_version[0]:
+            order_index.invalidate()
+        try:
+            yield
+        finally:
+            orders_seen_version[0] = coordination.bump_version('orders')
+
+# Отложенная запись: изменения сразу применяются к локальным копиям, а в таблицу уходят в фоне
+def write_failed(entry, error):
+    # Пакет не попал в таблицу, а локальная копия листа уже с ним: перечитываем лист при следующем обращении
+    if entry['title'] == 'СКЛАД':
+        warehouse_cache.expire()
+    elif entry['title'] == orders_sheet_title:
+        order_index.expire()
+    metrics.report('write_failures', (('sheet', entry['title']),), seq=entry['seq'], error=str(error))
+
+write_queue = WriteBehindQueue(registry, WRITE_JOURNAL, WRITE_BATCH, on_failed=write_failed) if WRITE_JOURNAL else None
+
+def submit_writes(batch):
+    # Пакет изменений листа: в журнал и очередь (пользователь не ждёт таблицу) или сразу в таблицу
+    if write_queue is None:
+        batch.flush()
+        return
+    seq = write_queue.submit(batch)
+    if coordination.shared and seq is not None:
+        # Другие процессы перечитывают лист после снятия блокировки: изменения должны быть уже там.
+        # Очередь может долго ждать квоту, поэтому ждём частями и продлеваем блокировку заказов,
+        # чтобы она не истекла раньше и другой процесс не записал по старым номерам строк
+        while not write_queue.wait(seq, LOCK_TIMEOUT / 3):
+            coordination.extend('orders')
+
+def drain_writes():
+    # Перед чтением листа из таблицы дожидаемся записи отложенных изменений, иначе они потеряются в снимке
+    if write_queue is not None:
+        write_queue.drain()
 
 # Вспомогательные функции
 def find_warehouse_sheet():
-    spreadsheet = client.open_by_key(SPREADSHEET_ID)
-    sheets = spreadsheet.worksheets()
-    for sheet in sheets:
-        if 'СКЛАД' in sheet.title:
-            return sheet
-    return None
+    return registry.sheet('СКЛАД', partial=True)
+
+def load_warehouse_rows():
+    warehouse_sheet = find_warehouse_sheet()
+    if not warehouse_sheet:
+        return None
+    drain_writes()
+    return warehouse_sheet.get_all_values()
+
+# Общий снимок склада для всех пользователей
+warehouse_cache = WarehouseCache(load_warehouse_rows, WAREHOUSE_CACHE_TTL)
+
+# Результаты inline-поиска по запросу и версии снимка
+inline_cache = SearchCache(1000, INLINE_CACHE_TTL)
+warehouse_refresh_lock = threading.Lock()
+
+def refresh_warehouse_later():
+    # Устаревший снимок перечитываем в фоне, а inline-запрос сразу отвечает по старому
+    if warehouse_cache.is_fresh() or not warehouse_refresh_lock.acquire(blocking=False):
+        return
+    def refresh():
+        try:
+            warehouse_cache.reload()
+        except Exception as e:
+            print(f"Ошибка обновления склада: {e}")
+        finally:
+            warehouse_refresh_lock.release()
+    threading.Thread(target=refresh, daemon=True).start()
+
+def warehouse_columns():
+    # Числовые столбцы снимка разбираются один раз на версию снимка
+    return warehouse_cache.derived(WarehouseColumns)
+
+def update_warehouse_cell(sheet, row_num, col, value):
+    batch = SheetBatch(sheet)
+    batch.update_cell(row_num, col, value)
+    submit_writes(batch)
+    warehouse_cache.set_cell(row_num, col, value)
 
 def ensure_orders_sheet():
-    spreadsheet = client.open_by_key(SPREADSHEET_ID)
-    if 'Заказы' not in [sheet.title for sheet in spreadsheet.worksheets()]:
-        sheet = spreadsheet.add_worksheet('Заказы', 1000, 5)
+    sheet = registry.sheet('Заказы')
+    if sheet is None:
+        sheet = registry.add_worksheet('Заказы', 1000, 5)
         sheet.update(range_name='A1:E1', values=[['📋 Название заказа', '🛒 Товар', '📦 Количество', '💰 Цена', '💵 Сумма']])
         format_orders_sheet(sheet)
-    return spreadsheet.worksheet('Заказы')
+    return sheet
 
 def format_orders_sheet(sheet):
     set_column_width(sheet, 'A', 200)
@@ -79,153 +339,205 @@ def format_orders_sheet(sheet):
         borders=Borders(custom={'bottom': Border('DOTTED', Color(0.7, 0.7, 0.7))}))
     format_cell_range(sheet, 'A2:E1000', data_format)
 
+# Формат строки "Итого"
+total_format = CellFormat(
+    backgroundColor=Color(0.9, 1, 0.9),
+    textFormat=TextFormat(fontFamily='Roboto', fontSize=11, bold=True),
+    horizontalAlignment='RIGHT')
+
 def format_row(row):
     return [x if x else '-' for x in row + ['-'] * (7 - len(row))]
 
-def find_order_block(order_sheet, order_name):
-    all_data = order_sheet.get_all_values()
-    start_row = None
-    end_row = None
-    for i, row in enumerate(all_data, 1):
-
-        if row and row[0].replace('📋 ', '') == order_name and start_row is None:
-            start_row = i
-        elif start_row and (not row or row[0] or (len(row) > 3 and row[3] == 'Итого')):
-            end_row = i - 1
-            break
-    if start_row and not end_row:
-        end_row = len(all_data)
-    if end_row and end_row < len(all_data) and all_data[end_row][3] == 'Итого':
-        end_row += 1
-    return start_row, end_row
-
-def get_order_list(order_sheet):
-    all_data = order_sheet.get_all_values()[1:]
-    orders = {row[0].replace('📋 ', '') for row in all_data if row and row[0] and row[3] != 'Итого'}
-    return list(orders)
+def load_orders_rows():
+    drain_writes()
+    return ensure_orders_sheet().get_all_values()
+
+ORDER_LINES_SHEET = 'Строки заказов'
+ORDER_TOTALS_SHEET = 'Итоги заказов'
+
+def ensure_order_lines_sheet():
+    # Плоский лист заказов. При первом запуске с ORDERS_LAYOUT=flat он создаётся и в него
+    # переносятся все заказы с листа "Заказы" (сам лист остаётся как был)
+    sheet = registry.sheet(ORDER_LINES_SHEET)
+    if sheet is None:
+        # Перенос один на все процессы: под своей блокировкой (блокировку записи заказов
+        # вызывающий может уже держать) и с повторной проверкой, не перенёс ли кто-то раньше
+        with coordination.lock('orders_migration'):
+            sheet = registry.sheet(ORDER_LINES_SHEET)
+            if sheet is None:
+                sheet = migrate_orders_to_lines()
+    return sheet
+
+def migrate_orders_to_lines():
+    blocks_sheet = registry.sheet('Заказы')
+    rows = flat_rows_from_blocks(blocks_sheet.get_all_values() if blocks_sheet else [])
+    # Новый лист и все строки — одним batchUpdate: он выполняется целиком или никак,
+    # поэтому сбой не оставит пустой лист, который следующий запуск примет за перенесённый
+    sheet_id = registry.new_sheet_id()
+    requests = [{'addSheet': {'properties': {'sheetId': sheet_id, 'title': ORDER_LINES_SHEET, 'gridProperties': {
+        'rowCount': len(rows) + 1000, 'columnCount': len(FLAT_HEADER)}}}}]
+    requests += build_requests([['values', row_num, 1, row] for row_num, row in enumerate(rows, 1)], sheet_id)
+    registry.batch_update(lambda: {'requests': requests})
+    registry.refresh()
+    sheet = registry.sheet(ORDER_LINES_SHEET)
+    format_order_lines_sheet(sheet)
+    ensure_order_totals_sheet()
+    orders_count = sum(1 for row in rows[1:] if row[2] == '')
+    metrics.report('order_migrations', (('sheet', ORDER_LINES_SHEET),), orders=orders_count, lines=len(rows) - 1 - orders_count)
+    return sheet
+
+def format_order_lines_sheet(sheet):
+    for column, width in zip('ABCDEFG', (90, 200, 250, 100, 100, 120, 90)):
+        set_column_width(sheet, column, width)
+    format_cell_range(sheet, 'A1:G1', CellFormat(
+        backgroundColor=Color(0.2, 0.6, 1),
+        textFormat=TextFormat(fontFamily='Roboto', fontSize=12, bold=True),
+        horizontalAlignment='CENTER'))
+
+def ensure_order_totals_sheet():
+    # Итоги заказов — формула по плоскому листу: бот их не пишет, они не расходятся со строками
+    if registry.sheet(ORDER_TOTALS_SHEET) is not None:
+        return
+    sheet = registry.add_worksheet(ORDER_TOTALS_SHEET, 1000, 3)
+    sheet.update(range_name='A1', raw=False, values=[[
+        f"=QUERY('{ORDER_LINES_SHEET}'!A:G, \"select A, B, sum(F) where A is not null and G is null "
+        f"group by A, B order by A label A 'ID заказа', B 'Заказ', sum(F) 'Итого'\", 1)"]])
+
+def load_order_lines_rows():
+    drain_writes()
+    return ensure_order_lines_sheet().get_all_values()
+
+# Индекс заказов без запросов к API и операции над заказами для выбранного хранения
+if ORDERS_LAYOUT == 'flat':
+    order_index = FlatOrderIndex(load_order_lines_rows, ORDERS_CACHE_TTL)
+    order_store = FlatOrderStore(order_index, ensure_order_lines_sheet, submit_writes)
+    orders_sheet_title, orders_mirror_sheet = ORDER_LINES_SHEET, 'order_lines'
+else:
+    order_index = OrderIndex(load_orders_rows, ORDERS_CACHE_TTL)
+    order_store = BlockOrderStore(order_index, ensure_orders_sheet, submit_writes, total_format)
+    orders_sheet_title, orders_mirror_sheet = 'Заказы', 'orders'
+
+# Локальная копия листов: снимки загружаются из неё без запросов к таблице,
+# а синхронизация ниже сверяет их с таблицей по времени изменения
+sheet_mirror = SheetMirror(MIRROR_DB) if MIRROR_DB else None
+if sheet_mirror is not None:
+    mirrored_rows = sheet_mirror.load('warehouse')
+    if mirrored_rows is not None:
+        warehouse_cache.preload(mirrored_rows)
+    mirrored_rows = sheet_mirror.load(orders_mirror_sheet)
+    if mirrored_rows is not None:
+        order_index.preload(mirrored_rows)
+    sheet_mirror.watch('warehouse', warehouse_cache)
+    sheet_mirror.watch(orders_mirror_sheet, order_index)
+
+# Правки таблицы вручную попадают в снимок склада и индекс заказов за несколько секунд
+sheet_sync = SheetSync(registry, SHEET_SYNC_INTERVAL, sheet_mirror.get_meta('modified_time') if sheet_mirror else None,
+                       busy=lambda: write_queue is not None and write_queue.pending_count() > 0)
+sheet_sync.add('СКЛАД', warehouse_cache, partial=True)
+sheet_sync.add(orders_sheet_title, order_index)
+
+# Состояние очередей — в метриках рядом со счётчиками запросов
+metrics.add_gauges('dispatcher', dispatcher.stats)
+metrics.add_gauges('sheet_sync', sheet_sync.stats)
+if write_queue is not None:
+    metrics.add_gauges('write_queue', write_queue.stats)
+
+def refresh_order_state(state):
+    # Актуальные строки заказа из индекса: другие пользователи могли сдвинуть строки
+    order = order_store.find(state['order_name'])
+    if order is None:
+        return None
+    state['start_row'] = order.start_row
+    state['block_data'] = order_store.order_rows(order)
+    return order
 
 def get_stock_quantity(item_name):
-    warehouse_sheet = find_warehouse_sheet()
-    if not warehouse_sheet:
+    columns = warehouse_columns()
+    if columns is None:
         return None
-    all_data = warehouse_sheet.get_all_values()
-    for row in all_data:
-        if len(row) >= 2 and row[1] == item_name:
-            return int(row[2]) if row[2] and row[2] != '-' else 0
-    return 0
+    row_num = warehouse_cache.find(item_name)
+    if row_num is None or row_num > columns.count:
+        return 0
+    return int(columns.quantity[row_num - 1])
 
-def format_order_table(block_data, start_row):
+# Готовые таблицы заказов и страницы клавиатур
+render_cache = RenderCache()
+metrics.add_gauges('render_cache', render_cache.stats)
+
+ORDER_TABLE_HEAD = "<b>📋 Заказ:</b>\n<code>№  Товар            Кол-во  Цена      Сумма"
+ORDER_TABLE_LINE = "═════════════════════════════════════════════"
+
+def render_order_table(block_data):
     valid_items = [item for item in block_data[1:-1] if item and len(item) >= 4 and item[1]]
-    total = block_data[-1][4] if len(block_data[-1]) > 4 else '0'
-    total = float(total.replace(',', '.')) if total else 0
-    table = "<b>📋 Заказ:</b>\n<code>"
-    table += "№  Товар            Кол-во  Цена      Сумма\n"
-    table += "═════════════════════════════════════════════\n"
-    for i, item in enumerate(valid_items, 1):
-        name = item[1].replace('🛒 ', '')[:12] + "..." if len(item[1].replace('🛒 ', '')) > 12 else item[1].replace('🛒 ', '').ljust(15)
-        qty = str(item[2]).rjust(6)
-        price_str = item[3].replace(',', '.') if item[3] else '0'
-        price = f"{float(price_str):.2f} ₽".rjust(8)
-        total_line_str = item[4].replace(',', '.') if item[4] else '0'
-        total_line = f"{float(total_line_str):.2f} ₽".rjust(8)
-        table += f"{str(i).rjust(2)} {name} {qty}  {price} {total_line}\n"
-    table += "═════════════════════════════════════════════\n"
-    table += f"{'Итого:'.rjust(33)} {total:.2f} ₽".rjust(12) + "\n"
-    table += "</code>"
-    return table
+    total = parse_number(block_data[-1][4]) if len(block_data[-1]) > 4 else 0
+    prices, _ = parse_numbers([item[3] for item in valid_items])
+    line_totals, _ = parse_numbers([item[4] for item in valid_items])
+    lines = [ORDER_TABLE_HEAD, ORDER_TABLE_LINE]
+    for i, (item, price, line_total) in enumerate(zip(valid_items, prices.tolist(), line_totals.tolist()), 1):
+        item_name = item[1].replace('🛒 ', '')
+        name = item_name[:12] + "..." if len(item_name) > 12 else item_name.ljust(15)
+        lines.append(f"{str(i).rjust(2)} {html.escape(name)} {str(item[2]).rjust(6)}  {f'{price:.2f} ₽'.rjust(8)} {f'{line_total:.2f} ₽'.rjust(8)}")
+    lines.append(ORDER_TABLE_LINE)
+    lines.append(f"{'Итого:'.rjust(33)} {total:.2f} ₽".rjust(12))
+    return "\n".join(lines) + "\n</code>"
+
+def format_order_table(block_data, start_row):
+    # Таблица зависит только от строк блока: копия блока в сессии может отставать от индекса,
+    # поэтому ключ — сами строки, а не версия индекса
+    return render_cache.get(('order_table', tuple(map(tuple, block_data))), lambda: render_order_table(block_data))
+
+def write_xlsx(file, header, rows):
+    # Excel в потоковом режиме: строки сразу уходят в файл, а не копятся в памяти
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    worksheet.append(header)
+    for row in rows:
+        worksheet.append(row)
+    workbook.save(file)
+    file.seek(0)
+
+def send_xlsx(chat_id, file_name, header, rows, caption=None):
+    # У каждой выгрузки свой временный файл, одновременные выгрузки не мешают друг другу
+    with tempfile.TemporaryFile(suffix='.xlsx') as file:
+        write_xlsx(file, header, rows)
+        bot.send_document(chat_id, file, caption=caption, visible_file_name=file_name)
 
 def export_stock(chat_id):
-    warehouse_sheet = find_warehouse_sheet()
-    if not warehouse_sheet:
+    columns = warehouse_columns()
+    if columns is None:
         bot.send_message(chat_id, "❌ Лист 'СКЛАД' не найден. Проверь настройки!")
         return
-    
-    # Получаем все данные из листа "СКЛАД"
-    all_data = warehouse_sheet.get_all_values()[1:]  # Пропускаем заголовок
-    # Формируем список товаров с остатками > 0
-    stock_items = []
-    for row in all_data:
-        if len(row) >= 7:  # Убедимся, что строка содержит все нужные столбцы
-            item_name = row[1] if row[1] else "Неизвестный товар"  # Название товара, если пусто — ставим заглушку
-            
-            # Обрабатываем количество
-            qty_str = row[2].replace('\xa0', ' ').replace(' ', '').strip() if row[2] and row[2] != '-' else '0'
-            try:
-                qty = int(qty_str) if qty_str else 0
-            except ValueError as e:
-                print(f"Ошибка преобразования количества в строке с товаром '{item_name}': {qty_str}, ошибка: {e}")
-                qty = 0
-            
-            # Обрабатываем дилерскую цену
-            dealer_price_str = row[6].replace('₽', '').replace('\xa0', ' ').replace(' ', '').replace(',', '.').strip() if row[6] and row[6] != '-' else '0'
-            try:
-                dealer_price = float(dealer_price_str) if dealer_price_str else 0
-            except ValueError as e:
-                print(f"Ошибка преобразования дилерской цены в строке с товаром '{item_name}': {dealer_price_str}, ошибка: {e}")
-                dealer_price = 0
-            
-            # Обрабатываем обычную цену
-            regular_price_str = row[4].replace('₽', '').replace('\xa0', ' ').replace(' ', '').replace(',', '.').strip() if row[4] and row[4] != '-' else '0'
-            try:
-                regular_price = float(regular_price_str) if regular_price_str else 0
-            except ValueError as e:
-                print(f"Ошибка преобразования обычной цены в строке с товаром '{item_name}': {regular_price_str}, ошибка: {e}")
-                regular_price = 0
-            
-            if qty > 0:  # Только товары с остатками > 0
-                stock_items.append((item_name, qty, dealer_price, regular_price))
-    
+
+    # Ошибки разбора — одной строкой в лог
+    report = columns.error_summary(columns.complete_rows())
+    if report:
+        print(report)
+
+    # Товары с остатками > 0 и итоги считаются по уже разобранным столбцам
+    indexes = columns.in_stock()
+    total_quantity, total_dealer_price, total_regular_price = columns.totals(indexes)
+    names = [name or "Неизвестный товар" for name in columns.names[indexes].tolist()]  # Пустое название — заглушка
+    stock_items = list(zip(names, columns.quantity[indexes].tolist(),
+                           columns.dealer_price[indexes].tolist(), columns.price[indexes].tolist()))
+
     # Сортируем по названию товара
     stock_items.sort(key=lambda x: x[0].lower())
-    
+
     if not stock_items:
         bot.send_message(chat_id, "📦 На складе нет товаров с остатками > 0!")
         return
-    
-    # Группируем товары по первой букве для вывода в чат
-    grouped_items = {}
-    for item_name, qty, dealer_price, regular_price in stock_items:
-        first_letter = item_name[0].upper() if item_name else '?'
-        if first_letter not in grouped_items:
-            grouped_items[first_letter] = []
-        grouped_items[first_letter].append((item_name, qty))
-    
-    # Отправляем сообщения с товарами по буквам
-    for letter, items in sorted(grouped_items.items()):
-        message = f"📦 <b>Товары на букву '{letter}':</b>\n"
-        for item_name, qty in items:
-            message += f"📋 {item_name}\n📏 Количество: {qty}\n\n"
-        bot.send_message(chat_id, message.strip(), parse_mode='HTML')
-    
-    # Подсчитываем итоги
-    total_quantity = sum(item[1] for item in stock_items)  # Общее количество
-    total_dealer_price = sum(item[1] * item[2] for item in stock_items)  # Общая дилерская цена
-    total_regular_price = sum(item[1] * item[3] for item in stock_items)  # Общая обычная цена
-    
-    # Формируем DataFrame для Excel
-    df = pd.DataFrame(stock_items, columns=['Товар', 'Количество', 'Дилерская цена', 'Обычная цена'])
-    
-    # Добавляем итоговую строку
-    summary = pd.DataFrame({
-        'Товар': ['ИТОГО'],
-        'Количество': [total_quantity],
-        'Дилерская цена': [total_dealer_price],
-        'Обычная цена': [total_regular_price]
-    })
-    df = pd.concat([df, summary], ignore_index=True)
-
-    # Сохраняем в Excel
-    file_path = "stock_remains.xlsx"
-    df.to_excel(file_path, index=False)
-    
-    # Отправляем файл в Telegram
-    with open(file_path, 'rb') as file:
-        bot.send_message(chat_id, "📄 <b>Полный список остатков на складе:</b>", parse_mode='HTML')
-        bot.send_document(chat_id, file)
-    
-    # Удаляем временный файл
-    os.remove(file_path)
-    
+
+    # Отправляем сообщения с товарами по первой букве (список уже отсортирован)
+    for letter, items in groupby(stock_items, key=lambda x: x[0][0].upper() if x[0] else '?'):
+        lines = [f"📦 <b>Товары на букву '{letter}':</b>"]
+        lines.extend(f"📋 {item_name}\n📏 Количество: {qty}\n" for item_name, qty, _, _ in items)
+        bot.send_message(chat_id, "\n".join(lines).strip(), parse_mode='HTML')
+
+    # Excel пишется построчно во временный файл, итоговая строка — последней
+    bot.send_message(chat_id, "📄 <b>Полный список остатков на складе:</b>", parse_mode='HTML')
+    send_xlsx(chat_id, "stock_remains.xlsx", ['Товар', 'Количество', 'Дилерская цена', 'Обычная цена'],
+              chain(stock_items, [('ИТОГО', total_quantity, total_dealer_price, total_regular_price)]))
+
     # Отправляем итоги отдельным сообщением
     bot.send_message(chat_id, f"📊 <b>Итоги:</b>\n"
                              f"Общее количество: {total_quantity}\n"
@@ -233,23 +545,34 @@ def export_stock(chat_id):
                              f"Общая обычная цена: {total_regular_price:.2f} ₽",
                      parse_mode='HTML')
 
-# Функции для создания кнопок
+IMPORT_HELP = ("📥 <b>Заказ из файла</b>\n\n"
+               "Пришли документом файл .csv или .xlsx: в каждой строке товар и количество, "
+               "третьим столбцом можно указать цену — 'обычная' или 'дилерская' (по умолчанию обычная). "
+               "Строка заголовка со столбцами 'Товар' и 'Количество' тоже подойдёт.\n\n"
+               "Подпись к файлу станет названием заказа.")
+
+# Функции для создания кнопок: клавиатуры без данных строятся один раз,
+# страницы списков кэшируются по названиям на странице и соседним страницам
+@lru_cache(maxsize=None)
 def create_main_menu():
-    markup = types.InlineKeyboardMarkup()
+    markup = FrozenKeyboard()
     markup.add(types.InlineKeyboardButton("📋 Создать заказ", callback_data="neworder"))
     markup.add(types.InlineKeyboardButton("📦 Выгрузить остатки", callback_data="export_stock"))
     markup.add(types.InlineKeyboardButton("✏️ Редактировать заказ", callback_data="edit_order"))
+    markup.add(types.InlineKeyboardButton("📥 Загрузить заказ из файла", callback_data="import_order"))
     markup.add(types.InlineKeyboardButton("🔍 Найти товар", callback_data="search"))
     markup.add(types.InlineKeyboardButton("ℹ️ Инфо", callback_data="info"))
     return markup
 
+@lru_cache(maxsize=None)
 def create_back_button():
-    markup = types.InlineKeyboardMarkup()
+    markup = FrozenKeyboard()
     markup.add(types.InlineKeyboardButton("⬅️ Вернуться назад", callback_data="back"))
     return markup
 
+@lru_cache(maxsize=None)
 def create_search_buttons():
-    markup = types.InlineKeyboardMarkup()
+    markup = FrozenKeyboard()
     markup.row(types.InlineKeyboardButton("✏️ Редактировать", callback_data="edit_item"),
                types.InlineKeyboardButton("🛒 В заказ", callback_data="add_to_order"))
     markup.row(types.InlineKeyboardButton("➡️ Далее", callback_data="next"), 
@@ -258,8 +581,9 @@ def create_search_buttons():
     markup.add(types.InlineKeyboardButton("🏠 В меню", callback_data="back_to_menu"))
     return markup
 
+@lru_cache(maxsize=None)
 def create_edit_buttons():
-    markup = types.InlineKeyboardMarkup()
+    markup = FrozenKeyboard()
     markup.row(types.InlineKeyboardButton("📛 Название", callback_data="edit_name"),
                types.InlineKeyboardButton("📦 Количество", callback_data="edit_quantity"))
     markup.row(types.InlineKeyboardButton("🔒 Бронь", callback_data="edit_reserve"),
@@ -269,15 +593,21 @@ def create_edit_buttons():
     markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data="back_from_edit"))
     return markup
 
+@lru_cache(maxsize=None)
 def create_price_type_buttons():
-    markup = types.InlineKeyboardMarkup()
+    markup = FrozenKeyboard()
     markup.row(types.InlineKeyboardButton("💰 Обычная цена", callback_data="price_regular"),
               types.InlineKeyboardButton("🏷 Дилерская цена", callback_data="price_dealer"))
     markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data="back"))
     return markup
 
 def create_order_buttons(orders, page=0, mode="add"):
-    markup = types.InlineKeyboardMarkup()
+    start_idx = page * 8
+    key = ('orders', tuple(orders[start_idx:start_idx + 8]), page, mode, len(orders) > 8, start_idx + 8 < len(orders))
+    return render_cache.get(key, lambda: build_order_buttons(orders, page, mode))
+
+def build_order_buttons(orders, page, mode):
+    markup = FrozenKeyboard()
     start_idx = page * 8
     end_idx = min(start_idx + 8, len(orders))
     order_subset = orders[start_idx:end_idx]
@@ -303,17 +633,25 @@ def create_order_buttons(orders, page=0, mode="add"):
     markup.add(types.InlineKeyboardButton("⬅️ Вернуться назад", callback_data="back"))
     return markup
 
+@lru_cache(maxsize=None)
 def create_order_edit_buttons():
-    markup = types.InlineKeyboardMarkup()
+    markup = FrozenKeyboard()
     markup.row(types.InlineKeyboardButton("✏️ Изменить количество", callback_data="edit_item_qty"),
                types.InlineKeyboardButton("🗑 Удалить товар", callback_data="delete_item"))
+    markup.add(types.InlineKeyboardButton("🧮 Проверить итог", callback_data="check_total"))
     markup.add(types.InlineKeyboardButton("🗑 Удалить заказ", callback_data="delete_order"))
     markup.add(types.InlineKeyboardButton("✅ Завершить заказ", callback_data="complete_order"))
     markup.add(types.InlineKeyboardButton("⬅️ Вернуться назад", callback_data="back"))
     return markup
 
 def create_item_selection_buttons(valid_items, page=0, action="edit"):
-    markup = types.InlineKeyboardMarkup()
+    start_idx = page * 5
+    key = ('items', tuple(item[1] for item in valid_items[start_idx:start_idx + 5]), page, action,
+           len(valid_items) > 5, start_idx + 5 < len(valid_items))
+    return render_cache.get(key, lambda: build_item_selection_buttons(valid_items, page, action))
+
+def build_item_selection_buttons(valid_items, page, action):
+    markup = FrozenKeyboard()
     start_idx = page * 5
     end_idx = min(start_idx + 5, len(valid_items))
     item_subset = valid_items[start_idx:end_idx]
@@ -360,6 +698,38 @@ def handle_export_command(message):
     bot.reply_to(message, "⏳ Выгружаю остатки склада...")
     export_stock(message.chat.id)
 
+def inline_item_result(row_num, row):
+    row = format_row(row)
+    return types.InlineQueryResultArticle(
+        id=str(row_num),
+        title=row[1],
+        description=f"📏 {row[2]} шт. | 💰 {row[4]} | 🏷 {row[6]}",
+        input_message_content=types.InputTextMessageContent(get_full_item_info(row_num, row)))
+
+@bot.inline_handler(func=lambda query: True)
+def handle_inline_query(inline_query):
+    # "@бот название": товары из снимка склада без запросов к таблице, по страницам через next_offset
+    query = inline_query.query.strip().lower()
+    if not query:
+        bot.answer_inline_query(inline_query.id, [], cache_time=5)
+        return
+    found = inline_cache.get((warehouse_cache.version, query), lambda: warehouse_cache.search_snapshot(query))
+    refresh_warehouse_later()
+    if found is None:
+        bot.answer_inline_query(inline_query.id, [], cache_time=5)
+        return
+    rows, row_nums = found
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    page = row_nums[offset:offset + INLINE_PAGE_SIZE]
+    results = [inline_item_result(row_num, rows[row_num - 1]) for row_num in page]
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(row_nums) else ''
+    bot.answer_inline_query(inline_query.id, results, cache_time=INLINE_CACHE_TTL, next_offset=next_offset)
+
+def search_result(state):
+    # Строки результатов берутся из общего снимка склада: в сессии хранятся только номера строк
+    row_num = state['results'][state['index']]
+    return row_num, format_row(warehouse_cache.get_row(row_num))
+
 def show_search_result(chat_id, message_id):
     state = user_states.get(chat_id)
     if not state or 'results' not in state or 'index' not in state:
@@ -369,7 +739,7 @@ def show_search_result(chat_id, message_id):
         return
     index = state['index']
     total_results = len(state['results'])
-    row_num, row = state['results'][index]
+    row_num, row = search_result(state)
     response = f"🔍 <b>Результат {index + 1} из {total_results}:</b>\n{get_full_item_info(row_num, row)}"
     bot.edit_message_text(response, chat_id, message_id, reply_markup=create_search_buttons(), parse_mode='HTML')
 
@@ -409,6 +779,10 @@ def handle_callback(call):
         user_states[chat_id] = 'waiting_for_neworder'
         bot.edit_message_text("📋 Давай создадим новый заказ! Введи его название:", chat_id, call.message.message_id, reply_markup=create_back_button())
     
+    elif call.data == "import_order":
+        user_states[chat_id] = 'waiting_for_import'
+        bot.edit_message_text(IMPORT_HELP, chat_id, call.message.message_id, reply_markup=create_back_button(), parse_mode='HTML')
+    
     elif call.data == "search":
         user_states[chat_id] = 'waiting_for_search'
         bot.edit_message_text("🔍 Какой товар ищем? Введи название:", chat_id, call.message.message_id, reply_markup=create_back_button())
@@ -420,6 +794,7 @@ def handle_callback(call):
             "📋 <b>Создать заказ</b> — Добавить новый заказ, куда можно положить товары.\n"
             "📦 <b>Выгрузить остатки</b> — Показать, сколько товаров есть на складе, сгруппированных по буквам, и дать файл со списком.\n"
             "✏️ <b>Редактировать заказ</b> — Изменить или удалить товары в заказе, завершить его и скачать файл.\n"
+            "📥 <b>Загрузить заказ из файла</b> — Прислать CSV или Excel со списком товаров, и я соберу заказ целиком.\n"
             "🔍 <b>Найти товар</b> — Найти товар на складе, посмотреть его количество, цену, бронь и даже изменить данные.\n"
             "ℹ️ <b>Инфо</b> — Это ты сейчас читаешь! Инструкция для тебя.\n\n"
             "<b>Как пользоваться?</b>\n"
@@ -437,10 +812,9 @@ def handle_callback(call):
             page = int(parts[2])
             mode = parts[3]
             state['order_page'] = page
-            order_sheet = ensure_orders_sheet()
-            orders = get_order_list(order_sheet)
+            orders = order_store.order_names()
             if mode == "add" and state.get('state') == 'searching':
-                row_num, row = state['results'][state['index']]
+                row_num, row = search_result(state)
                 text = f"🛒 Добавляем товар:\n{get_full_item_info(row_num, row)}\nКуда положим?"
             elif mode == "edit" and state.get('state') == 'selecting_order_to_edit':
                 text = "📋 Выбери заказ для редактирования:"
@@ -450,7 +824,7 @@ def handle_callback(call):
     
     elif call.data == "back":
         if chat_id in user_states:
-            if user_states[chat_id] in ['waiting_for_neworder', 'waiting_for_search']:
+            if user_states[chat_id] in ['waiting_for_neworder', 'waiting_for_search', 'waiting_for_import']:
                 del user_states[chat_id]
                 bot.edit_message_text("🏠 Ты вернулся в главное меню! Что дальше? 😊", chat_id, call.message.message_id, reply_markup=create_main_menu())
             elif isinstance(user_states[chat_id], dict):
@@ -501,7 +875,7 @@ def handle_callback(call):
     
     elif call.data == "edit_item" and chat_id in user_states and isinstance(user_states[chat_id], dict) and user_states[chat_id].get('state') == 'searching':
         state = user_states[chat_id]
-        row_num, row = state['results'][state['index']]
+        row_num, row = search_result(state)
         bot.edit_message_text(f"✏️ Редактируем товар:\n{get_full_item_info(row_num, row)}\nЧто хочешь изменить?",
                             chat_id, call.message.message_id, reply_markup=create_edit_buttons())
     
@@ -509,7 +883,7 @@ def handle_callback(call):
         state = user_states[chat_id]
         action = call.data.split("_")[1]
         state['edit_action'] = action
-        row_num, row = state['results'][state['index']]
+        row_num, row = search_result(state)
         if action == "quantity":
             bot.edit_message_text(f"📏 Текущие данные:\n{get_full_item_info(row_num, row)}\nНовое количество на складе:",
                                 chat_id, call.message.message_id, reply_markup=create_back_button())
@@ -533,12 +907,11 @@ def handle_callback(call):
         state = user_states[chat_id]
         state['selecting_order'] = True
         state['order_page'] = 0
-        order_sheet = ensure_orders_sheet()
-        orders = get_order_list(order_sheet)
+        orders = order_store.order_names()
         if not orders:
             bot.edit_message_text("🛒 Сначала создай заказ в меню 'Создать заказ'!", chat_id, call.message.message_id, reply_markup=create_back_button())
             return
-        row_num, row = state['results'][state['index']]
+        row_num, row = search_result(state)
         bot.edit_message_text(f"🛒 Добавляем товар:\n{get_full_item_info(row_num, row)}\nКуда положим?",
                             chat_id, call.message.message_id, reply_markup=create_order_buttons(orders, state['order_page'], "add"))
     
@@ -547,7 +920,7 @@ def handle_callback(call):
         order_name = call.data.replace("select_order_", "")
         state['selected_order'] = order_name
         del state['selecting_order']
-        row_num, row = state['results'][state['index']]
+        row_num, row = search_result(state)
         stock = get_stock_quantity(row[1])
         bot.edit_message_text(f"🛒 Товар:\n{get_full_item_info(row_num, row)}\nВыбран заказ: {order_name}\nНа складе: {stock} шт.\nПо какой цене добавить?",
                             chat_id, call.message.message_id, reply_markup=create_price_type_buttons())
@@ -556,14 +929,13 @@ def handle_callback(call):
         state = user_states[chat_id]
         state['waiting_for_add'] = True
         state['price_type'] = call.data
-        row_num, row = state['results'][state['index']]
+        row_num, row = search_result(state)
         stock = get_stock_quantity(row[1])
         bot.edit_message_text(f"🛒 Товар:\n{get_full_item_info(row_num, row)}\nВыбран заказ: {state['selected_order']}\nНа складе: {stock} шт.\nСколько штук добавить?",
                             chat_id, call.message.message_id, reply_markup=create_back_button())
     
     elif call.data == "edit_order":
-        order_sheet = ensure_orders_sheet()
-        orders = get_order_list(order_sheet)
+        orders = order_store.order_names()
         if not orders:
             bot.edit_message_text("🛒 Нет заказов для редактирования.", chat_id, call.message.message_id, reply_markup=create_back_button())
             return
@@ -572,20 +944,15 @@ def handle_callback(call):
     
     elif call.data.startswith("select_order_") and chat_id in user_states and isinstance(user_states[chat_id], dict) and user_states[chat_id].get('state') == 'selecting_order_to_edit':
         order_name = call.data.replace("select_order_", "")
-        order_sheet = ensure_orders_sheet()
-        start_row, end_row = find_order_block(order_sheet, order_name)
-        if start_row is None or end_row is None or start_row > end_row:
-            bot.edit_message_text(f"❌ Заказ '{order_name}' не найден или повреждён.", chat_id, call.message.message_id, reply_markup=create_back_button())
-            return
-        block_data = order_sheet.get(f'A{start_row}:E{end_row}')
-        user_states[chat_id] = {
+        state = {
             'state': 'editing_order',
             'order_name': order_name,
-            'start_row': start_row,
-            'end_row': end_row,
-            'block_data': block_data,
             'result_message_id': call.message.message_id
         }
+        if refresh_order_state(state) is None:
+            bot.edit_message_text(f"❌ Заказ '{order_name}' не найден или повреждён.", chat_id, call.message.message_id, reply_markup=create_back_button())
+            return
+        user_states[chat_id] = state
         show_order_items(chat_id, call.message.message_id)
     
     elif call.data == "edit_item_qty" and chat_id in user_states and isinstance(user_states[chat_id], dict) and user_states[chat_id].get('state') == 'editing_order':
@@ -645,19 +1012,15 @@ def handle_callback(call):
             bot.edit_message_text(f"📏 Введи новое количество для товара '{item[1].replace('🛒 ', '')}' (на складе: {stock} шт.):",
                                 chat_id, call.message.message_id, reply_markup=create_back_button())
         elif action == "delete":
-            row_num = state['start_row'] + state['block_data'].index(item)
-            order_sheet = ensure_orders_sheet()
-            order_sheet.delete_rows(row_num, row_num)
-            state['end_row'] -= 1
-            block_data = order_sheet.get(f'A{state['start_row']}:E{state['end_row']}')
-            total = sum(float(row[4].replace(',', '.')) for row in block_data if len(row) > 4 and row[4] and row[1])
-            order_sheet.update_cell(state['end_row'], 5, total)
-            total_format = CellFormat(
-                backgroundColor=Color(0.9, 1, 0.9),
-                textFormat=TextFormat(fontFamily='Roboto', fontSize=11, bold=True),
-                horizontalAlignment='RIGHT')
-            format_cell_range(order_sheet, f'D{state['end_row']}:E{state['end_row']}', total_format)
-            state['block_data'] = block_data
+            block_index = state['block_data'].index(item)
+            with orders_write():
+                order = refresh_order_state(state)
+                if order is None or state['block_data'][block_index:block_index + 1] != [item]:
+                    bot.edit_message_text("❌ Заказ изменился, открой его заново.", chat_id, call.message.message_id, reply_markup=create_main_menu())
+                    del user_states[chat_id]
+                    return
+                order_store.delete_item(order, block_index)
+                refresh_order_state(state)
             del state['selecting_item']
             del state['action']
             response = f"🗑 Товар '{item[1].replace('🛒 ', '')}' удалён!\n{format_order_table(state['block_data'], state['start_row'])}"
@@ -670,29 +1033,42 @@ def handle_callback(call):
     elif call.data == "delete_order" and chat_id in user_states and isinstance(user_states[chat_id], dict) and user_states[chat_id].get('state') == 'editing_order':
         state = user_states[chat_id]
         order_name = state['order_name']
-        start_row, end_row = find_order_block(ensure_orders_sheet(), order_name)
-        if start_row is None or end_row is None or start_row > end_row:
-            bot.edit_message_text(f"❌ Заказ '{order_name}' не найден или повреждён.", chat_id, call.message.message_id, reply_markup=create_main_menu())
-            del user_states[chat_id]
-            return
-        order_sheet = ensure_orders_sheet()
-        num_rows = end_row - start_row + 1
-        order_sheet.delete_rows(start_row, start_row + num_rows - 1)
+        with orders_write():
+            order = order_store.find(order_name)
+            if order is None:
+                bot.edit_message_text(f"❌ Заказ '{order_name}' не найден или повреждён.", chat_id, call.message.message_id, reply_markup=create_main_menu())
+                del user_states[chat_id]
+                return
+            order_store.delete(order)
         bot.edit_message_text(f"🗑 Заказ '{order_name}' удалён!", chat_id, call.message.message_id, reply_markup=create_main_menu())
         del user_states[chat_id]
     
+    elif call.data == "check_total" and chat_id in user_states and isinstance(user_states[chat_id], dict) and user_states[chat_id].get('state') == 'editing_order':
+        # Итог обычно меняется на разницу одной строки; здесь он пересчитывается по всем строкам
+        state = user_states[chat_id]
+        with orders_write():
+            order = refresh_order_state(state)
+            checked = order_store.check_total(order) if order is not None else None
+            # Проверка перечитала лист: номера строк заказа могли измениться
+            order = refresh_order_state(state) if order is not None else None
+            if checked is None:
+                bot.answer_callback_query(call.id, "❌ У заказа нет строки 'Итого'." if order else "❌ Заказ не найден.")
+                return
+            stored, computed = checked
+        if stored == computed:
+            bot.answer_callback_query(call.id, f"✅ Итог сходится: {computed:.2f} ₽")
+        else:
+            bot.answer_callback_query(call.id, f"🧮 Итог исправлен: было {stored:.2f} ₽, стало {computed:.2f} ₽", show_alert=True)
+            show_order_items(chat_id, call.message.message_id)
+    
     elif call.data == "complete_order" and chat_id in user_states and isinstance(user_states[chat_id], dict) and user_states[chat_id].get('state') == 'editing_order':
         state = user_states[chat_id]
         order_name = state['order_name']
-        start_row, end_row = state['start_row'], state['end_row']
-        order_sheet = ensure_orders_sheet()
-        block_data = order_sheet.get(f'A{start_row}:E{end_row}')
-        df = pd.DataFrame(block_data, columns=['Название заказа', 'Товар', 'Количество', 'Цена', 'Сумма'])
-        file_path = f"{order_name}.xlsx"
-        df.to_excel(file_path, index=False)
-        with open(file_path, 'rb') as file:
-            bot.send_document(chat_id, file, caption=f"📄 Заказ '{order_name}' завершён! Вот твой файл.")
-        os.remove(file_path)
+        order = order_store.find(order_name)
+        block_data = order_store.order_rows(order) if order else state['block_data']
+        send_xlsx(chat_id, f"{order_name}.xlsx", ['Название заказа', 'Товар', 'Количество', 'Цена', 'Сумма'],
+                  ((row + [''] * 5)[:5] for row in block_data),
+                  caption=f"📄 Заказ '{order_name}' завершён! Вот твой файл.")
         bot.send_message(chat_id, "🏠 Ты вернулся в главное меню! Что дальше? 😊", reply_markup=create_main_menu())
         del user_states[chat_id]
 
@@ -707,38 +1083,27 @@ def process_state(message):
             if not order_name:
                 bot.reply_to(message, "📛 Название не может быть пустым! Попробуй ещё раз:", reply_markup=create_back_button())
                 return
-            order_sheet = ensure_orders_sheet()
-            orders = get_order_list(order_sheet)
-            if order_name in orders:
-                bot.reply_to(message, f"⚠️ Заказ '{order_name}' уже есть. Придумай другое название:", reply_markup=create_back_button())
-                return
-            all_data = order_sheet.get_all_values()
-            new_start = 2 if len(all_data) <= 1 else len(all_data) + 1
-            order_sheet.update(range_name=f'A{new_start}:E{new_start}', values=[[f'📋 {order_name}', '', '', '', '']])
-            order_sheet.update(values=[['Итого', 0]], range_name=f'D{new_start + 1}:E{new_start + 1}')
-            total_format = CellFormat(
-                backgroundColor=Color(0.9, 1, 0.9),
-                textFormat=TextFormat(fontFamily='Roboto', fontSize=11, bold=True),
-                horizontalAlignment='RIGHT')
-            format_cell_range(order_sheet, f'D{new_start + 1}:E{new_start + 1}', total_format)
+            with orders_write():
+                if order_store.find(order_name) is not None:
+                    bot.reply_to(message, f"⚠️ Заказ '{order_name}' уже есть. Придумай другое название:", reply_markup=create_back_button())
+                    return
+                order_store.create(order_name)
             bot.reply_to(message, f"✅ Заказ '{order_name}' успешно создан! Теперь можно добавлять товары 🛒", reply_markup=create_main_menu())
             del user_states[chat_id]
         except Exception as e:
-            bot.reply_to(message, f"❌ Ошибка: {str(e)}. Попробуй снова!", reply_markup=create_back_button())
+            bot.reply_to(message, user_error_text(e), reply_markup=create_back_button())
+    
+    elif state == 'waiting_for_import':
+        bot.reply_to(message, "📎 Пришли файл .csv или .xlsx документом — подпись к нему станет названием заказа.", reply_markup=create_back_button())
     
     elif state == 'waiting_for_search':
         try:
             query = message.text.strip().lower()
-            sheet = find_warehouse_sheet()
-            if not sheet:
+            row_nums = warehouse_cache.search(query)
+            if row_nums is None:
                 bot.reply_to(message, "❌ Лист 'СКЛАД' не найден. Проверь настройки!", reply_markup=create_back_button())
                 return
-            all_data = sheet.get_all_values()
-            search_results = []
-            for i, row in enumerate(all_data, 1):
-                if len(row) >= 2 and row[1].lower().startswith(query):
-                    formatted = format_row(row)
-                    search_results.append((i, formatted))
+            search_results = array('I', row_nums)
             if not search_results:
                 bot.reply_to(message, f"🔍 По запросу '{query}' ничего не найдено 😕", reply_markup=create_main_menu())
                 del user_states[chat_id]
@@ -752,7 +1117,7 @@ def process_state(message):
             }
             show_search_result(chat_id, result_message.message_id)
         except Exception as e:
-            bot.reply_to(message, f"❌ Ошибка: {str(e)}. Попробуй снова!", reply_markup=create_back_button())
+            bot.reply_to(message, user_error_text(e), reply_markup=create_back_button())
     
     elif isinstance(state, dict) and state.get('state') == 'searching' and 'edit_action' in state:
         try:
@@ -760,7 +1125,7 @@ def process_state(message):
             if not sheet:
                 bot.reply_to(message, "❌ Лист 'СКЛАД' не найден. Проверь настройки!", reply_markup=create_back_button())
                 return
-            row_num, row_data = state['results'][state['index']]
+            row_num, row_data = search_result(state)
             action = state['edit_action']
             value = message.text.strip()
             column_map = {'quantity': 3, 'reserve': 4, 'name': 2, 'price': 5, 'reserve2': 6, 'dealer_price': 7}
@@ -770,7 +1135,7 @@ def process_state(message):
                 if new_value < 0:
                     bot.reply_to(message, "⚠️ Количество не может быть меньше 0!", reply_markup=create_back_button())
                     return
-                sheet.update_cell(row_num, column_map[action], new_value)
+                update_warehouse_cell(sheet, row_num, column_map[action], new_value)
             elif action == 'reserve':
                 current_value = int(row_data[column_map[action] - 1]) if row_data[column_map[action] - 1] != '-' else 0
                 change = int(value)
@@ -782,7 +1147,7 @@ def process_state(message):
                 if new_value > stock:
                     bot.reply_to(message, f"⚠️ На складе только {stock} шт. Введи меньшее значение!", reply_markup=create_back_button())
                     return
-                sheet.update_cell(row_num, column_map[action], new_value)
+                update_warehouse_cell(sheet, row_num, column_map[action], new_value)
             elif action == 'reserve2':
                 current_value = int(row_data[column_map[action] - 1]) if row_data[column_map[action] - 1] != '-' else 0
                 change = int(value)
@@ -795,28 +1160,27 @@ def process_state(message):
                 if new_value > stock:
                     bot.reply_to(message, f"⚠️ На складе только {stock} шт. Введи меньшее значение!", reply_markup=create_back_button())
                     return
-                sheet.update_cell(row_num, column_map[action], new_value)
+                update_warehouse_cell(sheet, row_num, column_map[action], new_value)
             elif action == 'name':
-                sheet.update_cell(row_num, column_map[action], value)
+                update_warehouse_cell(sheet, row_num, column_map[action], value)
             elif action == 'price':
                 price = float(value.replace(',', '.'))
-                sheet.update_cell(row_num, column_map[action], price)
+                update_warehouse_cell(sheet, row_num, column_map[action], price)
             elif action == 'dealer_price':
                 price = float(value.replace(',', '.'))
-                sheet.update_cell(row_num, column_map[action], price)
-            state['results'][state['index']] = (row_num, format_row(sheet.row_values(row_num)))
+                update_warehouse_cell(sheet, row_num, column_map[action], price)
             del state['edit_action']
             show_search_result(chat_id, state['result_message_id'])
         except ValueError as ve:
             bot.reply_to(message, f"❌ Ошибка: {str(ve)}. Введи корректное значение!", reply_markup=create_back_button())
         except Exception as e:
-            bot.reply_to(message, f"❌ Ошибка: {str(e)}. Попробуй снова!", reply_markup=create_back_button())
+            bot.reply_to(message, user_error_text(e), reply_markup=create_back_button())
     
     elif isinstance(state, dict) and state.get('state') == 'searching' and state.get('waiting_for_add'):
         try:
             qty = int(message.text.strip())
             order_name = state['selected_order']
-            row_num, row_data = state['results'][state['index']]
+            row_num, row_data = search_result(state)
             stock = get_stock_quantity(row_data[1])
             if qty <= 0:
                 bot.reply_to(message, "⚠️ Количество должно быть больше 0!", reply_markup=create_back_button())
@@ -825,30 +1189,14 @@ def process_state(message):
                 bot.reply_to(message, f"⚠️ На складе только {stock} шт. Введи меньшее количество!", reply_markup=create_back_button())
                 return
             price_col = 4 if state['price_type'] == "price_regular" else 6
-            price_str = row_data[price_col].replace(' ₽', '').replace(',', '.') if row_data[price_col] != '-' else '0'
-            price = float(price_str)
+            price = parse_money(row_data[price_col])
             line_total = qty * price
-            order_sheet = ensure_orders_sheet()
-            orders = get_order_list(order_sheet)
-            if order_name not in orders:
-                bot.reply_to(message, f"❌ Заказ '{order_name}' пропал! Создай новый.", reply_markup=create_back_button())
-                return
-            start_row, end_row = find_order_block(order_sheet, order_name)
-            has_total_row = (order_sheet.cell(end_row, 4).value == 'Итого')
-            insert_row = end_row if has_total_row else end_row
-            order_sheet.insert_row(['', f'🛒 {row_data[1]}', qty, price, line_total], insert_row)
-            total_row = end_row + 1 if has_total_row else end_row
-            block_data = order_sheet.get(f'A{start_row}:E{total_row}')
-            total = sum(float(row[4].replace(',', '.')) for row in block_data if len(row) > 4 and row[4] and row[1])
-            if has_total_row:
-                order_sheet.update_cell(total_row, 5, total)
-            else:
-                order_sheet.update(values=[['Итого', total]], range_name=f'D{total_row}:E{total_row}')
-            total_format = CellFormat(
-                backgroundColor=Color(0.9, 1, 0.9),
-                textFormat=TextFormat(fontFamily='Roboto', fontSize=11, bold=True),
-                horizontalAlignment='RIGHT')
-            format_cell_range(order_sheet, f'D{total_row}:E{total_row}', total_format)
+            with orders_write():
+                order = order_store.find(order_name)
+                if order is None:
+                    bot.reply_to(message, f"❌ Заказ '{order_name}' пропал! Создай новый.", reply_markup=create_back_button())
+                    return
+                order_store.add_item(order, ['', f'🛒 {row_data[1]}', qty, price, line_total])
             del state['waiting_for_add']
             del state['selected_order']
             del state['price_type']
@@ -856,7 +1204,7 @@ def process_state(message):
         except ValueError as ve:
             bot.reply_to(message, f"❌ Ошибка: {str(ve)}. Введи число!", reply_markup=create_back_button())
         except Exception as e:
-            bot.reply_to(message, f"❌ Ошибка: {str(e)}. Попробуй снова!", reply_markup=create_back_button())
+            bot.reply_to(message, user_error_text(e), reply_markup=create_back_button())
     
     elif isinstance(state, dict) and state.get('state') == 'editing_order' and state.get('waiting_for_qty'):
         try:
@@ -874,23 +1222,17 @@ def process_state(message):
             if new_qty > stock:
                 bot.reply_to(message, f"⚠️ На складе только {stock} шт. Введи меньшее количество!", reply_markup=create_back_button())
                 return
-            row_num = state['start_row'] + state['block_data'].index(item)
-            order_sheet = ensure_orders_sheet()
-            order_sheet.update_cell(row_num, 3, new_qty)
-            price_str = order_sheet.cell(row_num, 4).value or '0'
-            price = float(price_str.replace(',', '.'))
+            block_index = state['block_data'].index(item)
+            price = parse_money(item[3])
             line_total = new_qty * price
-            order_sheet.update_cell(row_num, 5, line_total)
-            start_row, end_row = state['start_row'], state['end_row']
-            block_data = order_sheet.get(f'A{start_row}:E{end_row}')
-            total = sum(float(row[4].replace(',', '.')) for row in block_data if len(row) > 4 and row[4] and row[1])
-            order_sheet.update_cell(end_row, 5, total)
-            total_format = CellFormat(
-                backgroundColor=Color(0.9, 1, 0.9),
-                textFormat=TextFormat(fontFamily='Roboto', fontSize=11, bold=True),
-                horizontalAlignment='RIGHT')
-            format_cell_range(order_sheet, f'D{end_row}:E{end_row}', total_format)
-            state['block_data'] = block_data
+            with orders_write():
+                order = refresh_order_state(state)
+                if order is None or state['block_data'][block_index:block_index + 1] != [item]:
+                    bot.reply_to(message, "❌ Заказ изменился, открой его заново.", reply_markup=create_main_menu())
+                    del user_states[chat_id]
+                    return
+                order_store.set_quantity(order, block_index, new_qty, line_total)
+                refresh_order_state(state)
             bot.reply_to(message, f"✅ Количество обновлено: {new_qty} для '{item[1].replace('🛒 ', '')}'", reply_markup=create_back_button())
             del state['waiting_for_qty']
             del state['selected_item_index']
@@ -898,7 +1240,73 @@ def process_state(message):
         except ValueError:
             bot.reply_to(message, "❌ Введи корректное число!", reply_markup=create_back_button())
         except Exception as e:
-            bot.reply_to(message, f"❌ Ошибка: {str(e)}. Попробуй снова!", reply_markup=create_back_button())
+            bot.reply_to(message, user_error_text(e), reply_markup=create_back_button())
+
+def import_order(order_name, file_name, data):
+    # Заказ из файла целиком: разбор, поиск товаров, проверка остатков и одна запись в лист.
+    # Если хоть одна строка с ошибкой, заказ не создаётся: (создан ли заказ, текст ответа)
+    lines, errors = parse_order_file(file_name, data)
+    columns = warehouse_columns()
+    if columns is None:
+        return False, "❌ Лист 'СКЛАД' не найден. Проверь настройки!"
+    def item_name(row_num):
+        return format_row(warehouse_cache.get_row(row_num))[1]
+    resolved, resolve_errors, substitutions = resolve_lines(lines, warehouse_cache.find, warehouse_cache.search, item_name)
+    errors += resolve_errors
+    errors += check_stock(resolved, lambda row_num: int(columns.quantity[row_num - 1]) if row_num <= columns.count else 0)
+    items = []
+    for item, row_num in resolved:
+        row = format_row(warehouse_cache.get_row(row_num))
+        try:
+            price = parse_money(row[6 if item.dealer else 4])
+        except ValueError:
+            errors.append((item.line, f"'{row[1]}': цена на складе не число ('{row[6 if item.dealer else 4]}')"))
+            continue
+        items.append(['', f'🛒 {row[1]}', item.qty, price, item.qty * price])
+    if errors:
+        return False, f"⚠️ Заказ '{order_name}' не создан, исправь файл и пришли снова:\n{format_errors(errors)}"
+    if not items:
+        return False, "⚠️ В файле нет ни одного товара."
+    total = sum((values[4] for values in items), Decimal(0))
+    with orders_write():
+        if order_store.find(order_name) is not None:
+            return False, f"⚠️ Заказ '{order_name}' уже есть. Пришли файл с другой подписью."
+        order = order_store.create(order_name, items, total)
+        block_data = order_store.order_rows(order)
+    # Ответ в HTML: название из подписи или имени файла экранируется, иначе Telegram отклонит
+    # сообщение уже после создания заказа
+    response = f"✅ Заказ '{html.escape(order_name)}' создан из файла: {len(items)} строк.\n"
+    if substitutions:
+        response += f"🔁 Найдены поиском, проверь:\n{html.escape(format_errors(substitutions))}\n"
+    return True, response + format_order_table(block_data, order.start_row)
+
+@bot.message_handler(content_types=['document'])
+def handle_order_file(message):
+    chat_id = message.chat.id
+    document = message.document
+    # Название заказа — подпись к файлу, без неё имя файла
+    order_name = (message.caption or os.path.splitext(document.file_name or '')[0]).strip()
+    if not order_name:
+        bot.reply_to(message, "📛 Подпиши файл названием заказа и пришли снова!", reply_markup=create_back_button())
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        bot.reply_to(message, f"⚠️ Файл слишком большой (до {IMPORT_MAX_FILE_SIZE // 1024} КБ).", reply_markup=create_back_button())
+        return
+    try:
+        data = bot.download_file(bot.get_file(document.file_id).file_path)
+        created, response = import_order(order_name, document.file_name, data)
+    except ImportFileError as e:
+        bot.reply_to(message, f"❌ Не получилось прочитать файл: {e}.", reply_markup=create_back_button())
+        return
+    except Exception as e:
+        bot.reply_to(message, user_error_text(e), reply_markup=create_back_button())
+        return
+    if created and user_states.get(chat_id) == 'waiting_for_import':
+        del user_states[chat_id]
+    if created:
+        bot.reply_to(message, response, reply_markup=create_main_menu(), parse_mode='HTML')
+    else:
+        bot.reply_to(message, response, reply_markup=create_back_button())
 
 @bot.message_handler(func=lambda message: message.chat.id not in user_states)
 def default_handler(message):
@@ -907,10 +1315,59 @@ def default_handler(message):
 # Запуск бота
 if __name__ == "__main__":
     print(f"Bot started at {datetime.now()}")
-    bot.delete_webhook()  # Удаляем webhook на всякий случай
-    while True:
+    if BOT_RUNTIME == "async":
+        telegram_runtime.start()
+    if DISPATCH_STATS_INTERVAL > 0:
+        def log_dispatch_stats():
+            while True:
+                time.sleep(DISPATCH_STATS_INTERVAL)
+                print(f"Dispatcher: {dispatcher.stats()}")
+                if write_queue is not None:
+                    print(f"Write queue: {write_queue.stats()}")
+        threading.Thread(target=log_dispatch_stats, daemon=True).start()
+    if METRICS_PORT:
+        from webhook import make_webhook_server
+        metrics_server = make_webhook_server(MetricsApp(metrics), METRICS_HOST, METRICS_PORT)
+        threading.Thread(target=metrics_server.serve_forever, name='metrics', daemon=True).start()
+        print(f"Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    if write_queue is not None:
+        write_queue.start()
+    if SHEET_SYNC_INTERVAL > 0:
+        sheet_sync.start()
+    if sheet_mirror is not None:
+        sheet_mirror.start(MIRROR_INTERVAL, lambda: sheet_sync.last_modified)
+    if UPDATE_SOURCE == "webhook":
+        # Апдейты приходят POST-запросами и попадают в тот же пул dispatcher, что и при polling
+        from webhook import WebhookApp, make_webhook_server
+        app = WebhookApp(lambda update: dispatcher.submit(update_chat_id(update), handle_update, update),
+                         WEBHOOK_SECRET, WEBHOOK_PATH)
+        server = make_webhook_server(app, WEBHOOK_HOST, WEBHOOK_PORT)
+        if WEBHOOK_URL:
+            bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET, max_connections=WORKER_THREADS)
+        print(f"Webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
         try:
-            bot.polling(none_stop=True, interval=0, timeout=20)
-        except Exception as e:
-            print(f"Polling error: {e}")
-            time.sleep(5)  # Перезапуск через 5 секунд
+            server.serve_forever()
+        finally:
+            server.server_close()
+            dispatcher.shutdown(wait=True)
+    elif BOT_RUNTIME == "async":
+        # Апдейты получает AsyncTeleBot в цикле asyncio и отдаёт тому же пулу dispatcher:
+        # обработчики и вызовы таблицы выполняются в его потоках, цикл их не ждёт
+        try:
+            telegram_runtime.run_polling(lambda update: dispatcher.submit(update_chat_id(update), handle_update, update))
+        finally:
+            dispatcher.shutdown(wait=True)
+            telegram_runtime.stop()
+    else:
+        bot.delete_webhook()  # Удаляем webhook на всякий случай
+        failures = 0
+        while True:
+            started = time.monotonic()
+            try:
+                bot.polling(none_stop=True, interval=0, timeout=20)
+            except Exception as e:
+                # Пауза растёт при сбоях подряд и сбрасывается, если polling проработал хотя бы минуту
+                failures = failures + 1 if time.monotonic() - started < 60 else 1
+                delay = 1 + backoff_delay(failures, base=2.5, cap=120)
+                print(f"Polling error: {e}, перезапуск через {delay:.0f} с")
+                time.sleep(delay)
@@ -0,0 +1,240 @@
+import bisect
+import threading
+import time
+
+from search import SearchIndex
+
+
+# Индекс товаров по названию (столбец B): точный поиск и полнотекстовый поиск
+class ItemIndex:
+    def __init__(self, rows=None):
+        self.by_name = {}  # Название -> номера строк по возрастанию
+        self.names = {}  # Номер строки -> название
+        self.search_index = None  # Полнотекстовый индекс, строится при первом поиске
+        if rows:
+            self.rebuild(rows)
+
+    def rebuild(self, rows):
+        by_name = {}
+        names = {}
+        for i, row in enumerate(rows, 1):
+            if len(row) >= 2:
+                by_name.setdefault(row[1], []).append(i)
+                names[i] = row[1]
+        self.by_name, self.names = by_name, names
+        self.search_index = None
+
+    def _remove(self, row_num):
+        name = self.names.pop(row_num, None)
+        if name is None:
+            return
+        row_nums = self.by_name.get(name, [])
+        if row_num in row_nums:
+            row_nums.remove(row_num)
+        if not row_nums:
+            self.by_name.pop(name, None)
+
+    def set_name(self, row_num, name):
+        # Точечное обновление индекса при изменении одной строки
+        self._remove(row_num)
+        if self.search_index is not None and row_num > 1:
+            self.search_index.set_name(row_num, name)
+        if name is None:
+            return
+        bisect.insort(self.by_name.setdefault(name, []), row_num)
+        self.names[row_num] = name
+
+    def find(self, name):
+        # Первая строка с точно таким названием
+        row_nums = self.by_name.get(name)
+        return row_nums[0] if row_nums else None
+
+    def build_search(self):
+        # Строка заголовка в поиск не попадает
+        if self.search_index is None:
+            self.search_index = SearchIndex({row_num: name for row_num, name in self.names.items() if row_num > 1})
+        return self.search_index
+
+    def changed_names(self, previous):
+        # Строки, где название отличается от прежнего снимка, или None, если поисковый индекс
+        # прежнего снимка не перенести: его нет или изменилось много строк (например,
+        # вставка сдвинула весь лист) и проще построить заново
+        if previous.search_index is None:
+            return None
+        changed = [row_num for row_num in previous.names.keys() | self.names.keys()
+                   if row_num > 1 and previous.names.get(row_num) != self.names.get(row_num)]
+        return changed if len(changed) <= len(self.names) // 10 else None
+
+    def adopt_search(self, previous):
+        # Перенести поисковый индекс прежнего снимка, поправив изменившиеся названия
+        changed = None if self.search_index is not None else self.changed_names(previous)
+        if changed is None:
+            return
+        search_index = previous.search_index
+        for row_num in changed:
+            search_index.set_name(row_num, self.names.get(row_num))
+        previous.search_index = None
+        self.search_index = search_index
+
+    def search(self, query):
+        # Поиск по словам, подстроке и с опечатками, по убыванию релевантности
+        return self.build_search().search(query)
+
+
+# Кэш снимка листа "СКЛАД": один get_all_values() на TTL секунд для всех пользователей
+class WarehouseCache:
+    def __init__(self, loader, ttl=60):
+        self.loader = loader  # Функция, которая скачивает все значения листа (или None, если листа нет)
+        self.ttl = ttl
+        self.rows = None
+        self.loaded_at = 0
+        self.version = 0  # Растёт при каждой перезагрузке и каждом изменении
+        self.index = ItemIndex()
+        self.derived_values = {}  # Функция -> (версия снимка, посчитанное по нему значение)
+        self.lock = threading.RLock()
+
+    def is_fresh(self):
+        return self.rows is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    def get_rows(self):
+        with self.lock:
+            if not self.is_fresh():
+                rows = self.loader()
+                if rows is None:
+                    return None
+                self._store(rows, ItemIndex(rows))
+            return self.rows
+
+    def _store(self, rows, index):
+        index.adopt_search(self.index)
+        self.rows = rows
+        self.index = index
+        self.loaded_at = time.monotonic()
+        self.version += 1
+
+    def reload(self):
+        # Скачать лист заново, не дожидаясь TTL (из фоновой задачи): обработчики
+        # тем временем читают старый снимок
+        rows = self.loader()
+        if rows is None:
+            return None
+        index = ItemIndex(rows)
+        if index.changed_names(self.index) is None:
+            index.build_search()  # Строим вне блокировки, обработчики пока ищут по старому индексу
+        with self.lock:
+            self._store(rows, index)
+        return rows
+
+    def get_row(self, row_num):
+        # Номер строки как в таблице (с 1)
+        rows = self.get_rows()
+        if rows is None or row_num < 1 or row_num > len(rows):
+            return []
+        return rows[row_num - 1]
+
+    def find(self, name):
+        # Номер строки товара с точным названием или None
+        with self.lock:
+            if self.get_rows() is None:
+                return None
+            return self.index.find(name)
+
+    def search(self, query):
+        with self.lock:
+            if self.get_rows() is None:
+                return None
+            return self.index.search(query)
+
+    def search_snapshot(self, query):
+        # Поиск по уже скачанному снимку, даже если TTL истёк (таблицу не ждём):
+        # (строки снимка, номера строк) или None, если листа нет
+        with self.lock:
+            rows = self.rows if self.rows is not None else self.get_rows()
+            if rows is None:
+                return None
+            return rows, self.index.search(query)
+
+    def derived(self, build):
+        # Значение, посчитанное по снимку функцией build(rows), например разобранные столбцы;
+        # пересчитывается только после перезагрузки или изменения снимка
+        with self.lock:
+            rows = self.get_rows()
+            if rows is None:
+                return None
+            cached = self.derived_values.get(build)
+            if cached is None or cached[0] != self.version:
+                cached = (self.version, build(rows))
+                self.derived_values[build] = cached
+            return cached[1]
+
+    def invalidate(self):
+        with self.lock:
+            self.rows = None
+            self.loaded_at = 0
+
+    def expire(self):
+        # Перечитать лист при следующем обращении. Без блокировки: вызывается из потока записи,
+        # а обработчик под блокировкой может как раз ждать эту запись (drain_writes в загрузчике)
+        self.loaded_at = 0
+
+    def preload(self, rows):
+        # Снимок из локальной копии (при старте): считается свежим, сверку с таблицей
+        # делает фоновая синхронизация
+        with self.lock:
+            self._store(rows, ItemIndex(rows))
+
+    def snapshot(self):
+        # (версия, копия строк) для сохранения в локальную копию или None, если снимка нет
+        with self.lock:
+            if self.rows is None:
+                return None
+            return self.version, [list(row) for row in self.rows]
+
+    def touch(self):
+        # Синхронизация убедилась, что лист не менялся: снимок снова свежий
+        with self.lock:
+            if self.rows is not None:
+                self.loaded_at = time.monotonic()
+
+    def apply_rows(self, rows, version):
+        # Свежие значения листа из фоновой синхронизации: меняются только отличающиеся строки.
+        # False, если снимок изменился после чтения version (запись бота) — тогда
+        # синхронизация повторится на следующем шаге
+        with self.lock:
+            if self.version != version:
+                return False
+            old = self.rows
+            if old is None:
+                self._store(rows, ItemIndex(rows))
+                return True
+            changed = [i for i in range(max(len(old), len(rows)))
+                       if i >= len(old) or i >= len(rows) or old[i] != rows[i]]
+            if len(changed) > len(rows) // 10 + 1:
+                # Изменилось много строк (например, вставка сдвинула лист): индекс строим заново
+                self._store(rows, ItemIndex(rows))
+                return True
+            for i in changed:
+                old_name = old[i][1] if i < len(old) and len(old[i]) >= 2 else None
+                new_name = rows[i][1] if i < len(rows) and len(rows[i]) >= 2 else None
+                if old_name != new_name:
+                    self.index.set_name(i + 1, new_name)
+            self.rows = rows
+            self.loaded_at = time.monotonic()
+            if changed:
+                self.version += 1
+            return True
+
+    def set_cell(self, row_num, col, value):
+        # Запись в кэш вслед за update_cell, чтобы не перекачивать лист
+        with self.lock:
+            if self.rows is None:
+                return
+            while len(self.rows) < row_num:
+                self.rows.append([])
+            row = self.rows[row_num - 1]
+            if len(row) < col:
+                row.extend([''] * (col - len(row)))
+            row[col - 1] = '' if value is None else str(value)
+            if col == 2 or (len(row) >= 2 and row_num not in self.index.names):
+                self.index.set_name(row_num, row[1])
+            self.version += 1
@@ -0,0 +1,77 @@
+import hmac
+import json
+import threading
+from collections import deque
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from telebot import types
+
+# Проверить локально: отправить записанный апдейт на адрес сервера, например
+#   curl -X POST -H 'Content-Type: application/json' \
+#        -H 'X-Telegram-Bot-Api-Secret-Token: <WEBHOOK_SECRET>' \
+#        --data @update.json http://localhost:8080/telegram
+
+
+# Приём апдейтов от Telegram по webhook: проверка секрета, разбор JSON и передача
+# апдейта в очередь обработчиков (submit). Повторно доставленные апдейты пропускаются.
+# Без секрета любой, кто достучится до порта, сможет прислать поддельный апдейт,
+# поэтому секрет обязателен
+class WebhookApp:
+    def __init__(self, submit, secret_token, path='/telegram', remember=1000):
+        if not secret_token:
+            raise ValueError("Для webhook нужен секрет (WEBHOOK_SECRET)")
+        self.submit = submit  # Функция, которая ставит апдейт в очередь обработки
+        self.secret_token = secret_token
+        self.path = path
+        self.recent_ids = deque(maxlen=remember)
+        self.recent_set = set()
+        self.lock = threading.Lock()
+
+    def respond(self, start_response, status, body=b''):
+        start_response(status, [('Content-Type', 'text/plain; charset=utf-8'), ('Content-Length', str(len(body)))])
+        return [body]
+
+    def is_duplicate(self, update_id):
+        with self.lock:
+            if update_id in self.recent_set:
+                return True
+            if len(self.recent_ids) == self.recent_ids.maxlen:
+                self.recent_set.discard(self.recent_ids[0])
+            self.recent_ids.append(update_id)
+            self.recent_set.add(update_id)
+            return False
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') != self.path:
+            return self.respond(start_response, '404 Not Found')
+        if environ.get('REQUEST_METHOD') != 'POST':
+            return self.respond(start_response, '405 Method Not Allowed')
+        if not hmac.compare_digest(
+                environ.get('HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN', ''), self.secret_token):
+            return self.respond(start_response, '403 Forbidden')
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            update = types.Update.de_json(json.loads(environ['wsgi.input'].read(length).decode('utf-8')))
+            if update is None:
+                raise ValueError("пустой апдейт")
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return self.respond(start_response, '400 Bad Request')
+        if not self.is_duplicate(update.update_id):
+            self.submit(update)
+        return self.respond(start_response, '200 OK')
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        # Успешные запросы не пишем в лог: их столько же, сколько апдейтов
+        if not args or not str(args[1]).startswith('2'):
+            super().log_message(format, *args)
+
+
+def make_webhook_server(app, host='0.0.0.0', port=8080):
+    return make_server(host, port, app, server_class=ThreadingWSGIServer, handler_class=QuietRequestHandler)
@@ -0,0 +1,246 @@
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from sheets import backoff_delay, build_requests, is_rate_limited, is_transient_error
+
+JOURNAL_KEY_PREFIX = 'xyinia_journal_seq:'
+
+
+# Журнал изменений листов: файл JSON-строк, в который только дописывают.
+# Пакет записывается до подтверждения пользователю, отметка "done" — после записи в таблицу.
+# Журналом владеет один процесс: второй процесс с тем же путём не запустится (у каждого
+# процесса бота свой WRITE_JOURNAL), иначе они дописывали бы и сжимали файл друг друга
+class WriteJournal:
+    def __init__(self, path):
+        self.path = path
+        # Отдельный файл блокировки: сам журнал при сжатии заменяется новым файлом
+        self.lock_file = open(f'{path}.lock', 'a')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.lock_file.close()
+            raise RuntimeError(f"Журнал {path} уже открыт другим процессом бота: задай каждому процессу свой WRITE_JOURNAL")
+        self.journal_id = None
+        self.entries = []  # Незавершённые пакеты из файла, по порядку
+        self.last_seq = 0
+        self._read()
+        self.file = open(path, 'a', encoding='utf-8')
+        if self.journal_id is None:
+            self.journal_id = uuid.uuid4().hex
+            self.append({'journal': self.journal_id})
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return
+        entries = {}
+        done = 0
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # Оборванная последняя строка после падения
+                if 'journal' in record:
+                    self.journal_id = record['journal']
+                elif 'done' in record:
+                    done = max(done, record['done'])
+                else:
+                    entries[record['seq']] = record
+                    self.last_seq = max(self.last_seq, record['seq'])
+        self.last_seq = max(self.last_seq, done)
+        self.entries = [entries[seq] for seq in sorted(entries) if seq > done]
+
+    def append(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def compact(self, pending, done):
+        # Переписать журнал, оставив только незавершённые пакеты (атомарно, через временный файл)
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(json.dumps({'journal': self.journal_id}) + '\n')
+            file.write(json.dumps({'done': done}) + '\n')
+            for record in pending:
+                file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self.file.close()
+        os.replace(temporary, self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        # Закрыть журнал и отпустить блокировку (после этого его может открыть другой процесс)
+        self.file.close()
+        self.lock_file.close()
+
+
+# Отложенная запись в таблицу: пакеты SheetBatch сразу попадают в журнал и считаются
+# принятыми, а фоновый поток отправляет их в таблицу по несколько за один batchUpdate.
+# Вместе с пакетами в том же запросе обновляется метка (developer metadata таблицы)
+# с номером последнего записанного пакета: batchUpdate выполняется целиком или никак,
+# поэтому после падения повторяются только пакеты новее метки
+class WriteBehindQueue:
+    def __init__(self, registry, journal_path, max_batch=50, compact_every=1000, on_failed=None):
+        self.registry = registry
+        self.on_failed = on_failed  # on_failed(пакет, ошибка) — пакет не записан и пропущен
+        self.journal = WriteJournal(journal_path)
+        self.marker_key = JOURNAL_KEY_PREFIX + self.journal.journal_id
+        self.marker_id = None  # id метки в таблице, когда она создана
+        self.max_batch = max_batch
+        self.compact_every = compact_every
+        self.pending = deque(self.journal.entries)
+        self.seq = self.journal.last_seq
+        self.flushed_seq = self.pending[0]['seq'] - 1 if self.pending else self.seq
+        self.flushed = 0
+        self.failed = 0
+        self.since_compact = 0
+        self.recovered = False
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+
+    def submit(self, batch):
+        # Пакет в журнал и в очередь; номер пакета или None, если пакет пустой
+        if not batch.operations:
+            return None
+        operations, batch.operations = batch.operations, []
+        with self.condition:
+            self.seq += 1
+            entry = {'seq': self.seq, 'title': batch.sheet._title, 'partial': batch.sheet._partial,
+                     'ops': operations, 'at': time.time()}
+            self.journal.append(entry)
+            self.pending.append(entry)
+            self.condition.notify_all()
+            return self.seq
+
+    def pending_count(self):
+        with self.condition:
+            return len(self.pending)
+
+    def wait(self, seq, timeout=None):
+        # Дождаться, пока пакет seq окажется в таблице (или будет пропущен из-за ошибки)
+        with self.condition:
+            return self.condition.wait_for(lambda: self.flushed_seq >= seq, timeout)
+
+    def drain(self, timeout=None):
+        # Дождаться отправки всего, что уже в очереди (перед чтением листов из таблицы)
+        with self.condition:
+            target = self.seq
+        return self.wait(target, timeout)
+
+    def stats(self):
+        with self.condition:
+            oldest = self.pending[0]['at'] if self.pending else None
+            return {
+                'pending': len(self.pending),
+                'lag_seconds': round(time.time() - oldest, 3) if oldest else 0.0,
+                'flushed': self.flushed,
+                'failed': self.failed,
+                'flushed_seq': self.flushed_seq,
+            }
+
+    def recover(self):
+        # Найти метку этого журнала в таблице и отбросить пакеты, которые уже записаны
+        metadata = self.registry.request(
+            lambda: self.registry.get_spreadsheet().fetch_sheet_metadata({'fields': 'developerMetadata'}))
+        applied = -1
+        for item in metadata.get('developerMetadata', []):
+            # Если создание метки повторилось после потерянного ответа, верна метка с большим номером
+            if item.get('metadataKey') == self.marker_key and int(item.get('metadataValue') or 0) > applied:
+                self.marker_id = item['metadataId']
+                applied = int(item.get('metadataValue') or 0)
+        applied = max(applied, 0)
+        if self.marker_id is None:
+            response = self.registry.batch_update(lambda: {'requests': [{'createDeveloperMetadata': {
+                'developerMetadata': {'metadataKey': self.marker_key, 'metadataValue': '0',
+                                      'location': {'spreadsheet': True}, 'visibility': 'DOCUMENT'}}}]})
+            self.marker_id = response['replies'][0]['createDeveloperMetadata']['developerMetadata']['metadataId']
+        with self.condition:
+            while self.pending and self.pending[0]['seq'] <= applied:
+                self._complete(self.pending.popleft())
+            self.recovered = True
+
+    def _complete(self, entry):
+        self.flushed_seq = entry['seq']
+        self.since_compact += 1
+        self.condition.notify_all()
+
+    def _body(self, entries):
+        requests = []
+        for entry in entries:
+            worksheet = self.registry.handle(entry['title'], entry['partial'])
+            if worksheet is None:
+                raise ValueError(f"Лист '{entry['title']}' не найден")
+            requests.extend(build_requests(entry['ops'], worksheet.id))
+        requests.append({'updateDeveloperMetadata': {
+            'dataFilters': [{'developerMetadataLookup': {'metadataId': self.marker_id}}],
+            'developerMetadata': {'metadataValue': str(entries[-1]['seq'])},
+            'fields': 'metadataValue'}})
+        return {'requests': requests}
+
+    def flush_once(self):
+        # Отправить до max_batch первых пакетов одним запросом; False, если очередь пуста
+        with self.condition:
+            entries = list(self.pending)[:self.max_batch]
+        if not entries:
+            return False
+        try:
+            self.registry.batch_update(lambda: self._body(entries))
+        except Exception as e:
+            if is_transient_error(e):
+                raise
+            if len(entries) > 1:
+                # Ищем пакет с ошибкой: отправляем по одному
+                self.max_batch, limit = 1, self.max_batch
+                try:
+                    return self.flush_once()
+                finally:
+                    self.max_batch = limit
+            # Пакет, который таблица не принимает (например, лист удалили), пропускаем, чтобы не встала очередь.
+            # Локальная копия листа уже содержит эти изменения: что с ней делать, решает on_failed
+            self.failed += 1
+            if self.on_failed is not None:
+                self.on_failed(entries[0], e)
+        self.journal.append({'done': entries[-1]['seq']})
+        with self.condition:
+            for _ in entries:
+                self._complete(self.pending.popleft())
+            self.flushed += len(entries)
+            if self.since_compact >= self.compact_every:
+                self.journal.compact(list(self.pending), self.flushed_seq)
+                self.since_compact = 0
+        return True
+
+    def run(self):
+        failures = 0
+        while not self.stop_event.is_set():
+            try:
+                if not self.recovered:
+                    self.recover()
+                with self.condition:
+                    self.condition.wait_for(lambda: self.pending or self.stop_event.is_set(), 1)
+                while self.flush_once():
+                    failures = 0
+            except Exception as e:
+                # Квота или сеть не вернулись и после повторов: пакеты остаются в очереди и журнале.
+                # Без ответа таблицы (сеть, 5xx) запись могла пройти: перед повтором сверяемся с меткой
+                if not is_rate_limited(e):
+                    self.recovered = False
+                failures += 1
+                print(f"Ошибка записи в таблицу, повтор позже: {e}")
+                self.stop_event.wait(1 + backoff_delay(failures, base=2, cap=120))
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify_all()